@@ -0,0 +1,273 @@
+'''
+adaptive.py
+
+Adaptive sequential sweep. Scenarios are run in batches and,
+after each one, running statistics of named outputs of the
+completed scenarios are compared with those of the previous
+batch. The sweep stops once the mean of every output is known
+within a relative tolerance and did not move by more than that.
+
+Instead of the order of scenarios.csv, next batches might focus
+on the regions of the parameter space where outputs change the
+most, estimated from the completed scenarios, see focus.
+
+Outputs, saved as runs fields by run.py:
+
+    drawdown_W1..W4: largest head change at the well column,
+                     relative to the end of stress period 0,
+                     positive for a lowered head
+    outlet_budget  : cumulative volume out of the constant
+                     heads at the end of the simulation. The
+                     lower head boundary, the outlet, is the
+                     only one draining the model
+'''
+
+import os
+import numpy as np
+import pandas as pd
+import shapely.geometry as shp
+
+# Self
+import budget
+import inputs
+import results
+import warmstart
+import observations
+import intersections
+
+
+# Locations of the wells, as defined at flopy_config.configure
+well_points = {
+        'W1': shp.Point(25, 50),
+        'W2': shp.Point(75, 50),
+        'W3': shp.Point(50, 25),
+        'W4': shp.Point(50, 75),
+    }
+
+# Available outputs
+output_names = [ 'drawdown_' + w for w in well_points ] + [ 'outlet_budget' ]
+
+# Stress period whose final heads are the reference of drawdowns
+reference_period = 0
+
+# Points whose distances to completed scenarios are computed at once
+candidates_chunk = 1000
+
+
+
+def well_cells(modelgrid, cache_file=None):
+    '''
+    Cell of each well within a layer, as a flat index
+
+    @return:
+        dict, cell by well name, None if outside the grid
+    '''
+    cellids = intersections.intersect( modelgrid, list( well_points.values() ), cache_file )
+    cells   = {}
+    for name, c in zip( well_points, cellids ):
+        if not c:
+            cells[name] = None
+        elif modelgrid.grid_type == 'structured':
+            cells[name] = c[0][0]*modelgrid.ncol + c[0][1]
+        else:
+            cells[name] = c[0]
+
+    return cells
+
+
+
+def largest_change(changes):
+    '''
+    Change of largest magnitude, keeping its sign
+    '''
+    changes = np.asarray( changes )
+    if not changes.size:
+        return np.nan
+    return changes.flat[ np.abs( changes ).argmax() ].item()
+
+
+
+def outputs(simulation_folder, model_name, modelgrid, list_file, cache_file=None):
+    '''
+    Named outputs of a completed scenario, from its
+    heads and list files. Only heads at the well columns
+    are read, memory mapped, see results.head_records.
+    Without heads file, as with the obs output profile,
+    heads are those observed at the well columns, see
+    observations.py
+
+    @params:
+        simulation_folder (str)                      : simulation folder
+        model_name        (str)                      : name of the gwf model
+        modelgrid         (flopy.discretization.Grid): model grid
+        list_file         (str)                      : list file of the model
+        cache_file        (str)                      : intersections cache, see intersections.py
+
+    @return:
+        dict, value by output name
+    '''
+    values = {}
+
+    head_file = os.path.join( simulation_folder, model_name + '.hds' )
+    if os.path.exists( head_file ):
+        # A record by time step and layer,
+        # time steps in order of the file
+        records = results.head_records( head_file )
+        times   = list( zip( records['kper'].tolist(), records['kstp'].tolist() ) )
+        steps   = {}
+        for t in times:
+            steps.setdefault( t, len(steps) )
+        rows    = np.array( [ steps[t] for t in times ], dtype=int )
+        layers  = records['ilay'] - 1
+
+        # Reference heads, those at the end of reference_period,
+        # stress periods of heads files start at 1
+        reference = max( i for ( p, _ ), i in steps.items() if p == reference_period + 1 )
+        for name, cell in well_cells( modelgrid, cache_file ).items():
+            if cell is None:
+                values['drawdown_' + name] = np.nan
+                continue
+            column = np.full( ( len(steps), layers.max() + 1 ), np.nan )
+            column[ rows, layers ] = records['data'][:, cell]
+            values['drawdown_' + name] = largest_change( column[reference][np.newaxis] - column[reference + 1:] )
+        del records
+    else:
+        observed  = observations.read( simulation_folder )
+        if observed is None:
+            raise Exception('adaptive: neither heads nor head observations at ' + simulation_folder)
+        reference = sum( inputs.steps_per_period( simulation_folder )[:reference_period + 1] ) - 1
+        for name in well_points:
+            data = observations.column( observed, name, modelgrid.nlay )
+            values['drawdown_' + name] = largest_change( 
+                    ( data[reference][np.newaxis] - data[reference + 1:] )[ :, ~np.isnan( data[reference] ) ]
+                )
+
+    values['outlet_budget'] = budget.last_cumulative( list_file ).get( 'CHD_OUT', np.nan )
+
+    return values
+
+
+
+def completed(runsdf, indexes, names):
+    '''
+    Output values of completed scenarios among indexes
+
+    @return:
+        pandas.DataFrame, a column by output name
+    '''
+    indexes = [ i for i in indexes if i in runsdf.index ]
+    runs    = runsdf.loc[ indexes ]
+    runs    = runs[ runs['status'].isin( warmstart.completed_statuses ) ]
+    values  = runs.reindex( columns=names ).astype(float)
+
+    return values.dropna()
+
+
+
+def statistics(values):
+    '''
+    Running statistics of outputs
+
+    @params:
+        values (pandas.DataFrame): outputs of completed scenarios
+
+    @return:
+        pandas.DataFrame with rows count, mean, std and sem
+        (standard error of the mean), a column by output
+    '''
+    count = values.count()
+    std   = values.std( ddof=1 )
+
+    return pd.DataFrame( { 'count': count, 'mean': values.mean(), 'std': std, 'sem': std/np.sqrt( count ) } ).T
+
+
+
+def converged(current, previous, tolerance):
+    '''
+    Verifies if running statistics stabilised: the mean of every
+    output is known within tolerance, relative to its magnitude,
+    and moved less than that since the previous batch. Outputs
+    with a null mean are scaled by their standard deviation
+
+    @params:
+        current   (pandas.DataFrame): statistics after the last batch
+        previous  (pandas.DataFrame): statistics after the previous batch, None if first
+        tolerance (float)           : relative tolerance
+
+    @return:
+        bool
+    '''
+    if ( previous is None ) or ( ( current.loc['count'] < 2 ).any() ):
+        return False
+
+    scale = np.maximum( current.loc['mean'].abs(), current.loc['std'] )
+    scale = scale.where( scale > 0, 1 )
+    sem   = current.loc['sem']/scale
+    shift = ( current.loc['mean'] - previous.loc['mean'] ).abs()/scale
+
+    return bool( ( sem <= tolerance ).all() and ( shift <= tolerance ).all() )
+
+
+
+def nearest_points(points, others, exclude_self=False):
+    '''
+    Closest of others to each point, computing distances
+    for candidates_chunk points at a time
+
+    @params:
+        points       (numpy.ndarray): shape (points, dimensions)
+        others       (numpy.ndarray): shape (others, dimensions)
+        exclude_self (bool)         : points are others, a point is not its closest
+
+    @return:
+        tuple (index of the closest, distance to it), numpy.ndarray
+    '''
+    closest  = np.zeros( len(points), dtype=int )
+    distance = np.zeros( len(points) )
+    for start in range( 0, len(points), candidates_chunk ):
+        chunk = points[ start:start + candidates_chunk ]
+        d     = np.sqrt( ( ( chunk[:, np.newaxis] - others[np.newaxis] )**2 ).sum( axis=2 ) )
+        if exclude_self:
+            d[ np.arange( len(chunk) ), np.arange( start, start + len(chunk) ) ] = np.inf
+        closest[ start:start + len(chunk) ]  = d.argmin( axis=1 )
+        distance[ start:start + len(chunk) ] = d.min( axis=1 )
+
+    return closest, distance
+
+
+
+def focus(scenariosdf, values, candidates, size):
+    '''
+    Selects the candidates where outputs are expected to change
+    the most. The gradient of standardized outputs at each completed
+    scenario is estimated against its closest completed neighbour,
+    and the expected change at a candidate is that of its closest
+    completed scenario times its distance to it, in scaled parameters
+
+    @params:
+        scenariosdf (pandas.DataFrame): scenarios
+        values      (pandas.DataFrame): outputs of completed scenarios, see completed
+        candidates  (list)            : scenario indexes not executed yet
+        size        (int)             : number of candidates to select
+
+    @return:
+        list of selected indexes, by decreasing expected change
+    '''
+    if ( len(values) < 2 ) or ( len(candidates) <= size ):
+        return list( candidates )[:size]
+
+    scaled = warmstart.scaled_parameters( scenariosdf )
+    points = scaled.loc[ values.index ].to_numpy()
+    std    = values.std( ddof=1 ).replace( 0, 1 ).fillna( 1 )
+    y      = ( values/std ).to_numpy()
+
+    # Gradients at completed scenarios
+    neighbour, distance = nearest_points( points, points, exclude_self=True )
+    gradients = np.sqrt( ( ( y - y[neighbour] )**2 ).sum( axis=1 ) )/np.maximum( distance, 1e-12 )
+
+    # Expected change at candidates
+    candidates        = np.asarray( candidates )
+    closest, distance = nearest_points( scaled.loc[ candidates ].to_numpy(), points )
+    scores            = gradients[ closest ]*distance
+
+    return candidates[ np.argsort( -scores, kind='stable' )[:size] ].tolist()
@@ -0,0 +1,192 @@
+'''
+budget.py
+
+Fast checks of the volume budget at the list file of a model.
+Only budget summary lines are looked for, by a regular
+expression over chunks of the file, instead of parsing every
+budget term into dataframes as flopy.utils.Mf6ListBudget does.
+
+Benchmark against flopy with:
+
+    python budget.py the_experiment_name/SIM0/SIM0_MODEL.lst
+'''
+
+import os
+import re
+import sys
+import time
+import numpy as np
+
+
+# Bytes read at once
+chunk_size = 1 << 20
+
+# Budget header and discrepancies (cumulative, rate) of each time step
+summary_pattern = re.compile(
+        rb'VOLUME BUDGET FOR ENTIRE MODEL AT END OF TIME STEP\s*(\d+),\s*STRESS PERIOD\s*(\d+)'
+        rb'|PERCENT DISCREPANCY\s*=\s*(\S+)\s+PERCENT DISCREPANCY\s*=\s*(\S+)'
+    )
+
+# Terms of a budget table, cumulative volume first
+term_pattern = re.compile( rb'^\s*([A-Z0-9_\- ]+?)\s*=\s*(\S+)\s+([A-Z0-9_\- ]+?)\s*=\s*(\S+)', re.MULTILINE )
+
+
+
+def to_float(value):
+    '''
+    Number printed by mf6, overflowed fields (****) as infinity
+    '''
+    try:
+        return float( value )
+    except ValueError:
+        return np.inf
+
+
+
+def summaries(list_file):
+    '''
+    Budget summaries of a list file, as these are read
+
+    @return:
+        generator of tuples (time step, stress period, cumulative
+        discrepancy, rate discrepancy), one based as mf6 prints
+    '''
+    kstp, kper = 0, 0
+    remainder  = b''
+    with open( list_file, 'rb' ) as f:
+        while True:
+            chunk = f.read( chunk_size )
+            if not chunk:
+                break
+            # Complete lines only, the rest goes with the next chunk
+            content   = remainder + chunk
+            end       = content.rfind( b'\n' ) + 1
+            remainder = content[end:]
+            for match in summary_pattern.finditer( content, 0, end ):
+                if match.group(1) is not None:
+                    kstp, kper = int( match.group(1) ), int( match.group(2) )
+                else:
+                    yield kstp, kper, to_float( match.group(3) ), to_float( match.group(4) )
+        for match in summary_pattern.finditer( remainder ):
+            if match.group(1) is None:
+                yield kstp, kper, to_float( match.group(3) ), to_float( match.group(4) )
+
+
+
+def check_discrepancy(list_file, threshold):
+    '''
+    Verifies that budget discrepancies, cumulative and of
+    rates, are less than threshold for all time steps.
+    Reading stops at the first violation
+
+    @params:
+        list_file (str)  : list file of the model
+        threshold (float): percentage
+
+    @return:
+        tuple (passed, violation), violation is the first summary
+        not passing, see summaries, None if passed
+    '''
+    for summary in summaries( list_file ):
+        if not ( ( summary[2] < threshold ) and ( summary[3] < threshold ) ):
+            return False, summary
+
+    return True, None
+
+
+
+def period_discrepancies(list_file):
+    '''
+    Largest budget discrepancy of each stress period,
+    among cumulative and rate ones of its time steps
+
+    @return:
+        numpy.ndarray, by stress period (zero based), NaN
+        for periods without budget summaries
+    '''
+    by_period = {}
+    for kstp, kper, cumulative, rate in summaries( list_file ):
+        by_period[kper] = max( by_period.get( kper, -np.inf ), cumulative, rate )
+
+    discrepancies = np.full( max( by_period, default=0 ), np.nan )
+    for kper, value in by_period.items():
+        discrepancies[kper - 1] = value
+
+    return discrepancies
+
+
+
+def last_cumulative(list_file, tail_size=1 << 16):
+    '''
+    Cumulative volumes of the last budget of a list file,
+    read from its end
+
+    @return:
+        dict, volume by term as flopy names them, e.g. CHD_OUT.
+        Empty if the file has no budget
+    '''
+    header = b'VOLUME BUDGET FOR ENTIRE MODEL'
+    size   = os.path.getsize( list_file )
+    with open( list_file, 'rb' ) as f:
+        while True:
+            f.seek( max( size - tail_size, 0 ) )
+            content = f.read()
+            start   = content.rfind( header )
+            if ( start >= 0 ) or ( tail_size >= size ):
+                break
+            tail_size *= 4
+
+    if start < 0:
+        return {}
+
+    # Terms below IN: and OUT: up to their totals
+    block   = content[start:]
+    volumes = {}
+    for direction in [ b'IN', b'OUT' ]:
+        section = re.search( rb'\n\s*' + direction + rb':\s*\S*\s*\n\s*-+\s*-+\s*\n(.*?)\n\s*TOTAL ' + direction, block, re.DOTALL )
+        if section is None:
+            continue
+        for match in term_pattern.finditer( section.group(1) ):
+            name = match.group(1).decode().strip().replace( ' ', '_' )
+            volumes[ name + '_' + direction.decode() ] = to_float( match.group(2) )
+
+    return volumes
+
+
+
+if __name__=='__main__':
+
+    import flopy
+
+    if len(sys.argv) < 2:
+        raise Exception('budget: usage python budget.py model.lst [repetitions]')
+    list_file   = sys.argv[1]
+    repetitions = int( sys.argv[2] ) if len(sys.argv) > 2 else 10
+    threshold   = 1
+
+    start_time = time.time()
+    for r in range( repetitions ):
+        dfflux, dfvol = flopy.utils.Mf6ListBudget( list_file ).get_dataframes()
+        flopy_passed  = (
+                np.all( dfvol['PERCENT_DISCREPANCY'].to_numpy() < threshold ) and
+                np.all( dfflux['PERCENT_DISCREPANCY'].to_numpy() < threshold )
+            )
+    flopy_time = ( time.time() - start_time )/repetitions
+
+    start_time = time.time()
+    for r in range( repetitions ):
+        passed, violation = check_discrepancy( list_file, threshold )
+    check_time = ( time.time() - start_time )/repetitions
+
+    start_time = time.time()
+    for r in range( repetitions ):
+        discrepancies = period_discrepancies( list_file )
+    period_time = ( time.time() - start_time )/repetitions
+
+    if passed != flopy_passed:
+        raise Exception('budget: check disagrees with flopy.utils.Mf6ListBudget')
+    print('budget: ' + str(len(dfvol)) + ' budgets at ' + list_file)
+    print('budget: flopy.utils.Mf6ListBudget {:.4f} s, check_discrepancy {:.4f} s ({:.0f}x), period_discrepancies {:.4f} s'.format(
+        flopy_time, check_time, flopy_time/check_time, period_time
+    ))
+    print('budget: discrepancy by stress period ' + str(discrepancies))
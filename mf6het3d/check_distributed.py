@@ -0,0 +1,195 @@
+'''
+Check distributed execution on a small, already written, experiment.
+
+First, a lease held by this process is contended by others trying
+to break and claim it, and should stay held. Then several run.py
+--distributed processes are started on this host, after an expired
+lease of a dead process is planted on the first scenario. Every
+scenario should be executed exactly once, the expired lease taken
+over, and statuses merged on export, see leases.py. Statuses and
+leases of the experiment are cleared.
+
+    python check_distributed.py --experiment the_experiment_name --processes 4
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Directory of this file, with run.py
+current = os.path.dirname(os.path.realpath(__file__))
+
+# Self
+import store
+import leases
+
+
+#################
+# Administrative
+import config
+base_dir = config.FOLDERS['base']
+
+runsdb       = 'runs.sqlite' # Status store, see run.py
+live_seconds = 1 # Lease of the contended scenario
+
+############
+# Arguments
+parser = argparse.ArgumentParser( description='Check that distributed processes execute each scenario of an experiment once.' )
+parser.add_argument( '--experiment'   , type=str, help='name of the experiment to be checked' )
+parser.add_argument( '--start'        , type=int, help='initial scenario position' )
+parser.add_argument( '--end'          , type=int, help='final scenario position, not included' )
+parser.add_argument( '--processes'    , type=int, default=3, help='number of run.py processes started' )
+parser.add_argument( '--lease-seconds', type=float, default=10, help='seconds without heartbeat after which a claimed scenario is reclaimed' )
+args = parser.parse_args()
+
+
+
+def run(*options):
+    '''
+    Command line of run.py on the experiment, with options
+    '''
+    command = [ sys.executable, os.path.join( current, 'run.py' ), '--experiment', args.experiment ]
+    for option, value in ( ( '--start', args.start ), ( '--end', args.end ) ):
+        if value is not None:
+            command += [ option, str(value) ]
+    return command + [ str(option) for option in options ]
+
+
+
+def contend(lease_folder, index, lease_seconds, seconds):
+    '''
+    Tries to break and claim the lease of a scenario, during
+    seconds
+
+    @return:
+        int, times claimed
+    '''
+    holder  = leases.Holder( lease_folder, lease_seconds )
+    claimed = 0
+    try:
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            if holder.claim( index ):
+                claimed += 1
+                holder.release( index )
+    finally:
+        holder.stop()
+    return claimed
+
+
+
+def execute(command):
+    '''
+    Executes a command, raising if it fails
+
+    @return:
+        str, its output
+    '''
+    completed = subprocess.run( command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True )
+    if completed.returncode != 0:
+        print( completed.stdout )
+        raise Exception('check_distributed: ' + ' '.join( command[1:] ) + ' failed')
+    return completed.stdout
+
+
+
+if __name__=='__main__':
+
+    #############
+    # Experiment
+    if args.experiment is None:
+        raise Exception('check_distributed: --experiment was not defined')
+    experiment_folder = os.path.join( base_dir, args.experiment )
+    if not os.path.exists( experiment_folder ):
+        raise Exception('check_distributed: experiment ' + args.experiment + ' does not exists in output path.')
+    if args.processes < 2:
+        raise Exception('check_distributed: --processes should be at least 2')
+
+    # Clear statuses and leases,
+    # as the coordinator would
+    execute( run( '--clean' ) )
+    store_file   = os.path.join( experiment_folder, 'csv', runsdb )
+    lease_folder = os.path.join( experiment_folder, '.leases' )
+    indexes      = list( store.load( store_file ).index[ args.start:args.end ] )
+    if not indexes:
+        raise Exception('check_distributed: no scenarios in range')
+
+
+    ##############################
+    # A live lease, held by this
+    # process, contended by others
+    contended = indexes[-1]
+    holder    = leases.Holder( lease_folder, live_seconds )
+    if not holder.claim( contended ):
+        raise Exception('check_distributed: scenario ' + str(contended) + ' could not be claimed')
+    with ProcessPoolExecutor( max_workers=2, mp_context=multiprocessing.get_context('spawn') ) as executor:
+        claimed = sum( executor.map( contend, *zip( *[ ( lease_folder, contended, live_seconds, 5*live_seconds ) ]*2 ) ) )
+    if claimed or ( not holder.holds( contended ) ) or ( contended not in holder.held ):
+        raise Exception('check_distributed: live lease of scenario ' + str(contended) + ' broken while held, claimed ' + str(claimed) + ' times')
+    holder.stop()
+
+
+    ##############################
+    # Expired lease of a dead
+    # process on the first scenario
+    expired = indexes[0]
+    os.makedirs( lease_folder, exist_ok=True )
+    with open( os.path.join( lease_folder, str(expired) + leases.lease_extension ), 'w' ) as f:
+        json.dump( { 'token': 'dead', 'host': 'dead', 'pid': 0 }, f )
+    old = time.time() - 10*args.lease_seconds
+    os.utime( os.path.join( lease_folder, str(expired) + leases.lease_extension ), ( old, old ) )
+
+
+    ##############################
+    # Processes sharing the experiment,
+    # with workers, so each execution
+    # is reported, see run.run_scenarios
+    start_time = time.time()
+    command    = run( '--distributed', '--duplicates', '--workers', 2, '--lease-seconds', args.lease_seconds, '--run' )
+    processes  = [
+            subprocess.Popen( command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True )
+            for _ in range( args.processes )
+        ]
+    outputs = [ process.communicate()[0] for process in processes ]
+    for process, output in zip( processes, outputs ):
+        if process.returncode != 0:
+            print( output )
+            raise Exception('check_distributed: a run.py process failed')
+
+
+    ##############################
+    # Each scenario executed once
+    executions = {}
+    for output in outputs:
+        for index in re.findall( r'^run: scenario (\d+) finished with status', output, flags=re.MULTILINE ):
+            executions[int(index)] = executions.get( int(index), 0 ) + 1
+    missing = [ index for index in indexes if index not in executions ]
+    twice   = [ index for index, count in executions.items() if count > 1 ]
+    if missing:
+        raise Exception('check_distributed: scenarios not executed ' + str(missing))
+    if twice:
+        raise Exception('check_distributed: scenarios executed more than once ' + str(twice))
+
+    # The expired lease was taken over
+    taken = [ output for output in outputs if ( 'leases: lease of scenario ' + str(expired) + ' held by dead:0 expired' ) in output ]
+    if len(taken) != 1:
+        raise Exception('check_distributed: expired lease of scenario ' + str(expired) + ' broken by ' + str(len(taken)) + ' processes')
+
+    # Statuses merged by the coordinator
+    execute( run( '--export' ) )
+    runsdf  = store.load( store_file ).loc[ indexes ]
+    pending = list( runsdf.index[ runsdf['status'] == 'pending' ] )
+    if pending:
+        raise Exception('check_distributed: statuses not merged of scenarios ' + str(pending))
+
+    print(
+        'check_distributed: ' + str(len(indexes)) + ' scenarios executed once by ' + str(args.processes) + ' processes in ' +
+        '{:.1f} s, expired lease of scenario '.format( time.time() - start_time ) + str(expired) + ' taken over, ' +
+        'live lease of scenario ' + str(contended) + ' kept'
+    )
@@ -0,0 +1,90 @@
+'''
+Check the libmf6 backend on a small, already written, experiment.
+
+Scenarios are solved one after another from this process through
+xmi.run, as run.py does with --backend libmf6, and the first one
+solved again at the end. Every run should succeed, and the repeated
+one give the same outputs, so no state of libmf6 is carried from a
+scenario to the next, see xmi.py. Skipped when libmf6, at
+config.lib_name, or modflowapi are not installed.
+
+    python check_libmf6.py --experiment the_experiment_name --end 3
+'''
+
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+# Get directory of this file
+# and append parent to sys.path
+current = os.path.dirname(os.path.realpath(__file__))
+parent  = os.path.dirname(current)
+sys.path.append(parent)
+
+# Self
+from utils import scenarios
+import xmi
+
+
+#################
+# Administrative
+import config
+base_dir = config.FOLDERS['base']
+
+############
+# Arguments
+parser = argparse.ArgumentParser( description='Check that scenarios solved through libmf6 one after another are independent.' )
+parser.add_argument( '--experiment', type=str, help='name of the experiment to be checked' )
+parser.add_argument( '--start'     , type=int, help='initial scenario position' )
+parser.add_argument( '--end'       , type=int, default=2, help='final scenario position, not included' )
+args = parser.parse_args()
+
+
+
+if __name__=='__main__':
+
+    #############
+    # libmf6
+    lib_name = getattr( config, 'lib_name', None )
+    if ( lib_name is None ) or ( not os.path.exists( lib_name ) ):
+        print('check_libmf6: skipped, libmf6 not found at ' + str(lib_name) + ', define lib_name in config.')
+        sys.exit()
+    try:
+        import modflowapi
+    except ImportError:
+        print('check_libmf6: skipped, modflowapi is not installed')
+        sys.exit()
+
+    #############
+    # Experiment
+    if args.experiment is None:
+        raise Exception('check_libmf6: --experiment was not defined')
+    experiment_folder = os.path.join( base_dir, args.experiment )
+    if not os.path.exists( experiment_folder ):
+        raise Exception('check_libmf6: experiment ' + args.experiment + ' does not exists in output path.')
+    scenariosdf, _ = scenarios.load( os.path.join( experiment_folder, 'csv' ), args.start, args.end )
+    if scenariosdf.empty:
+        raise Exception('check_libmf6: no scenarios in range')
+
+
+    ##############################
+    # Solve one after another,
+    # the first one once more
+    cache_file = os.path.join( experiment_folder, '.cache', 'intersections.pkl' )
+    solved     = []
+    for index in list( scenariosdf.index ) + [ scenariosdf.index[0] ]:
+        sc = scenariosdf.loc[index]
+        success, reason, values = xmi.run(
+                os.path.join( experiment_folder, sc['simulation_name'] ), sc['simulation_name'], sc['model_name'],
+                lib_name, outputs=True, cache_file=cache_file, silent=True
+            )
+        if not success:
+            raise Exception('check_libmf6: scenario ' + str(index) + ' failed, ' + reason)
+        solved.append( pd.Series( values, dtype=float ) )
+
+    if not np.allclose( solved[0], solved[-1], equal_nan=True ):
+        raise Exception('check_libmf6: scenario ' + str(scenariosdf.index[0]) + ' solved again gave other outputs')
+
+    print('check_libmf6: ' + str(len(scenariosdf)) + ' scenarios solved through libmf6, independent of each other')
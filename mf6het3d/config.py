@@ -3,6 +3,10 @@ import os
 # Define exe_name for flopy
 exe_name = 'mf6'
 
+# libmf6 shared library of the same release,
+# for run.py --backend libmf6
+lib_name = 'libmf6.so'
+
 # Folders configuration
 # Add as many as needed
 base_folder = os.getcwd()
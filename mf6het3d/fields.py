@@ -0,0 +1,138 @@
+'''
+fields.py
+
+Loading of conductivity fields. The csv file is parsed only
+once and kept as a binary .npy file at data/.cache, which is
+memory mapped by the following calls.
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+# Transformed fields, by (source, variance)
+_hk_fields = {}
+
+
+
+def file_signature(file_path):
+    '''
+    Describes a file by its size, modification time and sha1
+    '''
+    stat = os.stat(file_path)
+    with open(file_path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    return {
+            'size'    : stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha1'    : sha1,
+        }
+
+
+
+def write_meta(meta_file, signature, shape):
+    '''
+    Writes the description of the csv file a cache was
+    built from, through a temporary file
+    '''
+    temporary = meta_file + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(dict(signature, shape=list(shape)), f)
+    os.replace(temporary, meta_file)
+
+
+
+def load_field(data_dir, field_file='hk_field.csv', shape=(100,100,10)):
+    '''
+    Loads a field saved as a single column csv file, as exported by sgems.
+
+    The first call converts the csv file into a .npy file at data_dir/.cache.
+    Following calls memory map the .npy file, unless the csv file changed,
+    in which case the cache is rebuilt.
+
+    @params:
+        data_dir   (str)  : folder containing field_file
+        field_file (str)  : name of the csv file
+        shape      (tuple): shape of the field as written by sgems
+
+    @return:
+        numpy.ndarray, read only, with axes swapped as
+        (number_of_layers, number_of_columns, number_of_rows)
+    '''
+    source_file = os.path.join(data_dir, field_file)
+    cache_dir   = os.path.join(data_dir, '.cache')
+    cache_file  = os.path.join(cache_dir, field_file + '.npy')
+    meta_file   = os.path.join(cache_dir, field_file + '.json')
+
+    # Fast check by size and modification time,
+    # falls back to sha1 if any of those changed
+    stat = os.stat(source_file)
+    if os.path.exists(cache_file) and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta['shape'] == list(shape):
+            if ( meta['size'] == stat.st_size ) and ( meta['mtime_ns'] == stat.st_mtime_ns ):
+                return np.load(cache_file, mmap_mode='r')
+            signature = file_signature(source_file)
+            if meta['sha1'] == signature['sha1']:
+                # Same content, touched or copied. Keep the new
+                # size and time, so next calls skip the sha1
+                write_meta(meta_file, signature, shape)
+                return np.load(cache_file, mmap_mode='r')
+
+
+    # Parse csv and save as npy
+    signature = file_signature(source_file)
+    field     = pd.read_csv(source_file).to_numpy().reshape(shape)
+    field     = np.ascontiguousarray( np.swapaxes(field, 0, 2) )
+
+    # Write to temporary files and replace,
+    # several processes could be doing the same
+    os.makedirs(cache_dir, exist_ok=True)
+    suffix = '.' + str(os.getpid()) + '.tmp'
+    with open(cache_file + suffix, 'wb') as f:
+        np.save(f, field)
+    os.replace(cache_file + suffix, cache_file)
+    write_meta(meta_file, signature, shape)
+
+    return np.load(cache_file, mmap_mode='r')
+
+
+
+def field_sha1(data_dir, field_file='hk_field.csv', shape=(100,100,10)):
+    '''
+    sha1 of the csv file of a field, as kept with its cache,
+    so it is only computed when the file changed
+
+    @return:
+        str, hex digest
+    '''
+    load_field(data_dir, field_file, shape)
+    with open(os.path.join(data_dir, '.cache', field_file + '.json')) as f:
+        return json.load(f)['sha1']
+
+
+
+def hk_field(data_dir, variance, field_file='hk_field.csv'):
+    '''
+    Hydraulic conductivity field exp(sqrt(variance)*field),
+    computed once per variance and process.
+
+    @params:
+        data_dir   (str)  : folder containing field_file
+        variance   (float): variance of the log conductivity field
+        field_file (str)  : name of the csv file
+
+    @return:
+        numpy.ndarray, read only, considered as m/day
+    '''
+    key = ( os.path.abspath(os.path.join(data_dir, field_file)), float(variance) )
+    if key not in _hk_fields:
+        hk_array = np.exp( np.sqrt(variance)*load_field(data_dir, field_file) )
+        hk_array.flags.writeable = False
+        _hk_fields[key] = hk_array
+
+    return _hk_fields[key]
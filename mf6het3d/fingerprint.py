@@ -0,0 +1,128 @@
+'''
+fingerprint.py
+
+Identification of scenarios producing the same model.
+
+A fingerprint is the sha1 of all input files of a simulation, with
+simulation and model names replaced by placeholders, so scenarios
+differing only by their names share the same fingerprint.
+'''
+
+import os
+import re
+import hashlib
+
+# Self
+import template
+
+
+# Files written by mf6 or by these scripts,
+# not considered as model input
+output_extensions = ( '.lst', '.hds', '.bud', '.cbc', '.grb', '.csv', '.json', '.tmp' )
+flopy_header      = b'# File generated by Flopy'
+
+
+
+def is_output(file_name):
+    '''
+    Verifies if file_name is not a model input file
+    '''
+    return file_name.lower().endswith( output_extensions )
+
+
+
+def normalize(content, simulation_name, model_name):
+    '''
+    Removes the flopy header, with its time stamp, and
+    replaces model and simulation names by placeholders. Only
+    whole names are replaced, not names containing them, e.g.
+    SIM1 within SIM12
+    '''
+    if content.startswith(flopy_header):
+        content = content[ content.find(b'\n') + 1: ]
+    for name, placeholder in [ (model_name, b'<model>'), (simulation_name, b'<simulation>') ]:
+        pattern = rb'(?<![A-Za-z0-9_])' + re.escape( name.encode() ) + rb'(?![A-Za-z0-9_])'
+        content = re.sub( pattern, placeholder, content, flags=re.IGNORECASE )
+    return content
+
+
+
+def compute(simulation_folder, simulation_name, model_name):
+    '''
+    Computes the fingerprint of a written simulation
+
+    @params:
+        simulation_folder (str): path to the simulation folder
+        simulation_name   (str): name of the simulation
+        model_name        (str): name of the gwf model
+
+    @return:
+        str, sha1 hex digest
+    '''
+    sha1 = hashlib.sha1()
+    for file_name in sorted( os.listdir(simulation_folder) ):
+        file_path = os.path.join(simulation_folder, file_name)
+        if is_output(file_name) or ( not os.path.isfile(file_path) ):
+            continue
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        sha1.update( normalize( file_name.encode(), simulation_name, model_name ) )
+        sha1.update( b'\0' )
+        sha1.update( normalize( content, simulation_name, model_name ) )
+        sha1.update( b'\0' )
+
+    return sha1.hexdigest()
+
+
+
+def output_files(simulation_folder):
+    '''
+    Output files of a simulation, as written by mf6
+    '''
+    return [
+            f for f in os.listdir(simulation_folder)
+            if f.lower().endswith( ('.lst', '.hds', '.bud', '.cbc', '.grb', '.obs.csv') )
+        ]
+
+
+
+def remove_outputs(simulation_folder):
+    '''
+    Removes output files of a simulation. Outputs might be
+    hard links shared with a duplicated scenario, so these are
+    unlinked instead of letting mf6 overwrite them
+    '''
+    for f in output_files(simulation_folder):
+        os.remove( os.path.join(simulation_folder, f) )
+
+
+
+def link_outputs(source_folder, source_names, target_folder, target_names):
+    '''
+    Links output files of a simulation into the folder of
+    a duplicated one, renaming those after the target names
+
+    @params:
+        source_folder (str)  : folder of the executed simulation
+        source_names  (tuple): (simulation_name, model_name) of the executed simulation
+        target_folder (str)  : folder of the duplicated simulation
+        target_names  (tuple): (simulation_name, model_name) of the duplicated simulation
+    '''
+    remove_outputs(target_folder)
+    for f in output_files(source_folder):
+        template.link( os.path.join(source_folder, f), os.path.join(target_folder, target_filename(f, source_names, target_names)) )
+
+
+
+def target_filename(file_name, source_names, target_names):
+    '''
+    Name of an output file of the executed simulation for a
+    duplicated one. Files named after the model or the simulation,
+    <name>.<extension>, are renamed by their exact stem, others
+    such as mfsim.lst keep their names
+    '''
+    stem, dot, extension = file_name.partition('.')
+    for source, target in zip( source_names, target_names ):
+        if stem.lower() == source.lower():
+            return target + dot + extension
+    return file_name
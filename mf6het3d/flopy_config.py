@@ -5,22 +5,70 @@ Flopy configuration file
 # Python dependencies
 import os
 import sys
+import json
+import time
+import hashlib
 import flopy
 import pickle
+import shutil
 import argparse
+import traceback
 import numpy as np
-import pandas as pd
 import shapely.geometry as shp
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Get directory of this file
+# and append parent to sys.path
+current = os.path.dirname(os.path.realpath(__file__))
+parent  = os.path.dirname(current)
+sys.path.append(parent)
+
+# Self
+from utils import scenarios
+import wells
+import heads
+import inputs
+import store
+import steady
+import warmstart
+import intersections
+import fields
+import template
+import observations
+import monitor
+
+
+#################
+# Administrative
+import config
 
 
 # Arguments 
 parser = argparse.ArgumentParser( description='Setup modflow 6 simulation.' )
 parser.add_argument( '--experiment', type=str, help='experiment to be configured' )
 parser.add_argument( '--write'     , action='store_true', help='write simulation' )
+parser.add_argument( '--workers'   , type=int, default=1, help='number of scenarios configured in parallel' )
+parser.add_argument( '--overwrite' , action='store_true', help='rewrite scenarios already written' )
+parser.add_argument( '--template'  , action='store_true', help='share package files between scenarios' )
+parser.add_argument( '--binary'    , action='store_true', help='write grid arrays as binary files' )
+parser.add_argument( '--steady'    , action='store_true', help='solve the initial steady state once per group of scenarios' )
+parser.add_argument( '--warm-start', action='store_true', help='start from the heads of the closest completed scenario' )
+parser.add_argument( '--output-profile', type=str, default='full', choices=list(observations.profiles), help='heads and budgets saved, see observations.py' )
+parser.add_argument( '--max-wall-time', type=float, help='seconds a steady state might run before being killed' )
+parser.add_argument( '--max-step-time', type=float, help='seconds a steady state might spend in a time step before being killed' )
+parser.add_argument( '--start'     , type=int, help='initial scenario position' )
+parser.add_argument( '--end'       , type=int, help='final scenario position, not included' )
 args   = parser.parse_args()
 
 
+# Written into each simulation folder once
+# all its files were written. Holds scenario parameters
+written_marker    = 'flopy_config.json'
+experiment_folder = None
+template_folder   = None
+
+
 # Configuration function
 def configure(
         simulation_name   = None,
@@ -30,7 +78,38 @@ def configure(
         newton_raphson    = None, 
         head_convergence  = None, 
         hk_field_variance = None, 
+        template_folder   = None,
+        binary_arrays     = False,
+        steady_state_only = False,
+        initial_heads_file= None,
+        initial_heads_period = None,
+        output_profile    = 'full',
+        monitoring_points = None,
     ):
+    '''
+    Builds the MF6 simulation of a scenario and writes it if --write.
+
+    If template_folder is given, package files depending only on
+    some parameters are shared between scenarios through that folder, 
+    see template.py
+
+    If binary_arrays, grid arrays of npf (k, k33) and ic (strt) are
+    written as binary external files, avoiding text formatting 
+    by flopy and parsing by mf6
+
+    If steady_state_only, only the initial steady state stress 
+    period is configured. If initial_heads_file is given, heads 
+    saved there are the starting heads, those of the last time step
+    or of the last one of initial_heads_period, see steady.py and 
+    warmstart.py
+
+    output_profile defines the heads and budgets saved, all of
+    them ('full'), those of the last time step of each stress 
+    period ('last') or only heads observed at the wells and at
+    monitoring_points ('obs'), see observations.py
+
+    Returns the flopy.mf6.MFSimulation
+    '''
 
     # Parse model parameters and define 
     # default values 
@@ -45,11 +124,22 @@ def configure(
     if simulation_name is None:
         sim_directory       = 'mf6_sim'
         sim_name            = 'mf6_sim'
+        intersections_file  = None
     else:
         sim_directory       = os.path.join( experiment_folder, simulation_name )
         sim_name            = simulation_name
+        intersections_file  = os.path.join( experiment_folder, '.cache', 'intersections.pkl' )
     if model_name is None:
         model_name          = 'mf6_model'
+    if monitoring_points is None:
+        # Heads observed with the obs output profile, 
+        # in addition to the columns of the wells
+        monitoring_points = [
+                { 'id': 'P1', 'point': shp.Point(50, 50), 'layers': [] },
+                { 'id': 'P2', 'point': shp.Point(90, 50), 'layers': [] },
+            ]
+    if output_profile not in observations.profiles:
+        raise Exception('flopy_config: output profile ' + str(output_profile) + ' not implemented.')
 
 
     ############################
@@ -60,6 +150,16 @@ def configure(
     newton_raphson           = True
     current_dir              = os.getcwd()
     data_dir                 = os.path.join( current_dir, 'data' )
+
+    # Shared package files, named after
+    # the parameters they depend on
+    shared_files = set()
+    def package_filename(package_type, extension, **parameters):
+        if template_folder is None:
+            return None
+        filename = template.shared_filename( package_type, extension, **parameters )
+        shared_files.add( filename )
+        return filename
     
     
     ################
@@ -67,13 +167,12 @@ def configure(
     ################
     # This file was generated with sgems. 
     # Contains 100X100X10 cells 
+    # The csv is parsed once and cached as binary,
+    # see fields.py
     hk_field_file     = 'hk_field.csv'
-    hk_df             = pd.read_csv( os.path.join( data_dir, hk_field_file ) )
-    hk_array          = hk_df.to_numpy().reshape(100,100,10)
-    hk_array          = np.swapaxes( hk_array, 0, 2 )
     # This array should have as shape
     # (number_of_layers, number_of_columns, number_of_rows )
-    hk_array = np.exp( np.sqrt(hk_field_variance)*hk_array ) # Considered as m/day
+    hk_array = fields.hk_field( data_dir, hk_field_variance, hk_field_file ) # Considered as m/day
     
     
     stress_periods = [
@@ -106,13 +205,15 @@ def configure(
                 'steady_state' : False
             },
         ]
+    if steady_state_only:
+        stress_periods = stress_periods[:1]
     
     
     
     ###################
     # Simulation data #
     ###################
-    mf6_executable      = 'mf6'  # In windows remember to specify the full path to exe
+    mf6_executable      = config.exe_name  # In windows remember to specify the full path to exe
     
     # Initializes flopy sim
     sim = flopy.mf6.MFSimulation(
@@ -136,6 +237,7 @@ def configure(
         sim,
         nper=len(stress_periods),
         perioddata=perioddata,
+        filename=package_filename('tdis', 'tdis'),
     )
     
     
@@ -160,6 +262,7 @@ def configure(
             outer_maximum      = outer_maximum_iterations,  # Number of iterations 
             outer_hclose       = head_convergence,          # Convergence criteria, same dimensions as head
             no_ptcrecord       = ['ALL'], 
+            filename           = package_filename('ims', 'ims', head_convergence=head_convergence),
     )
     
     
@@ -219,7 +322,8 @@ def configure(
             delr=domain_data['length']/domain_data['discretization']['columns'],
             delc=domain_data['width'] /domain_data['discretization']['rows'],
             top =domain_data['top'],
-            botm=bottom_array
+            botm=bottom_array,
+            filename=package_filename('dis', 'dis'),
         )
     
     
@@ -234,6 +338,11 @@ def configure(
         save_specific_discharge=True, 
         icelltype=icelltype,
         k=hk_array,
+        filename=package_filename(
+            'npf', 'npf', 
+            hk_field_variance=hk_field_variance, binary_arrays=binary_arrays, 
+            hk_field=fields.field_sha1( data_dir, hk_field_file ),
+        ),
     )
     
     
@@ -273,31 +382,22 @@ def configure(
         ]
     
     
-    # Initializes intersection object
-    ginter = flopy.utils.GridIntersect( gwf.modelgrid )
-    
-    
-    # Intersect each boundary location
-    # with domain and apply
-    chd_stress_period = []
-    for ch in constant_head_data:
-    
-        # intersect holds 'cellids' property
-        # for structured grid these follow row,column notation
-        # whereas for disv or disu grids follow layer,cellid notation
-        intersect = ginter.intersect( ch['line'] )
-        
-        # Apply it to all layers
-        # Structured grid
-        for layer in range(domain_data['discretization']['layers']):
-            for cell in intersect['cellids']:
-                chd_stress_period.append( [ (layer, cell[0], cell[1]), ch['head'] ] )
+    # Intersect boundary locations with domain,
+    # same grid and lines for all scenarios of
+    # the experiment, see intersections.py
+    boundary_cellids = intersections.intersect(
+            gwf.modelgrid,
+            [ ch['line'] for ch in constant_head_data ],
+            intersections_file,
+        )
     
-    # Initializes chd package
-    chd = flopy.mf6.ModflowGwfchd(
+    # Initializes chd package, each boundary
+    # location applied to all layers, see heads.py
+    chd = heads.build_chd(
             gwf,
-            stress_period_data=chd_stress_period,
-            maxbound=len(chd_stress_period)
+            constant_head_data,
+            boundary_cellids,
+            filename=package_filename('chd', 'chd'),
         )
     
     
@@ -307,24 +407,33 @@ def configure(
     # Where the model will start the 
     # iterations. If closer to the solution, 
     # faster execution
-    ic_array= np.zeros(
-            (
-                domain_data['discretization']['layers'],
-                domain_data['discretization']['columns'],
-                domain_data['discretization']['rows'],
-            ), dtype=np.float64)
-    
-    # Linear interpolation for initial conditions
-    # for each row
-    aux_row_dis = np.arange(1, domain_data['discretization']['columns'] + 1 , 1)
-    for ir in range(domain_data['discretization']['rows']):
-        ic_array[0, :, ir] = (1 - aux_row_dis/domain_data['discretization']['columns'])*constant_head_data[0]['head'] + \
-                             aux_row_dis/domain_data['discretization']['columns']*constant_head_data[1]['head']
+    # Linear interpolation between inlet and outlet
+    # heads along columns, for all rows and layers
+    ic_shape = (
+            domain_data['discretization']['layers'],
+            domain_data['discretization']['rows'],
+            domain_data['discretization']['columns'],
+        )
+    ic_parameters = { 'binary_arrays': binary_arrays }
+    if initial_heads_file is None:
+        ic_array = heads.linear_heads(
+                ic_shape,
+                constant_head_data[0]['head'],
+                constant_head_data[1]['head'],
+            )
+    else:
+        # Solved steady state or a completed
+        # scenario, see steady.py and warmstart.py
+        ic_array = steady.load_heads( initial_heads_file, stress_period=initial_heads_period )
+        if ic_array.shape != ic_shape:
+            raise Exception('flopy_config: heads at ' + initial_heads_file + ' do not match the grid')
+        ic_parameters['initial_heads'] = hashlib.sha1( ic_array.tobytes() ).hexdigest()
     
     # Initializes initial conditions package
     ic = flopy.mf6.ModflowGwfic(
             gwf,
             strt=ic_array,
+            filename=package_filename('ic', 'ic', **ic_parameters),
         )
     
     #########
@@ -440,73 +549,24 @@ def configure(
     
     
     
-    # Intersect wells with the grid
-    # and initializs cellids.
-    # Wells are considered to be a single point/cell
-    # from the surface perspective, without diameter
-    BOTTOM_TOLERANCE = 1e-7
-    
-    for w in wells_data:
-    
-        intersect = ginter.intersect( w['point'] )
-        w['cellids'] = intersect['cellids'] 
-    
-        # Indices tuple has only one element, 
-        # with indices representing layers for the well
-        layer_indices_tuple = np.where( 
-                (bottom_array - w['screen_top'] < BOTTOM_TOLERANCE) & 
-                (bottom_array - w['screen_bottom'] >= BOTTOM_TOLERANCE) 
-            )
-    
-        # Assign layers 
-        w['layers'] = list(layer_indices_tuple[0])
-    
-    
-    
-    # Initialize wel_stress_period dict
-    # which is passed to the well package
-    wel_stress_period = {}
-    for sp in stress_periods:
-        wel_stress_period[ sp['id'] ] = []
-    
-    # Populate wel_stress_period dict
+    # Pumping of configured stress periods only
     for w in wells_data:
+        w['pumping'] = [ wsp for wsp in w['pumping'] if wsp['stress_period_id'] < len(stress_periods) ]
     
-        # If the well is not pumping, continue 
-        # to the next
-        if not w['pumping']:
-            continue
-    
-        # Loop over pumping cycles/stress periods
-        for wsp in w['pumping']:
-    
-            cellids = w['cellids'].item()
-    
-            w_stress_period = []
-    
-            # Apply flow rate to deepest layer,
-            # increasing vertical k of upper layers
-            # In the case of multiple layers
-            npf_package  = gwf.get_package('npf')
-            kxx_data     = npf_package.k.get_data()
-            kxx_data[ w['layers'][:-1], cellids[0], cellids[1] ] = [ kxx*10 for kxx in kxx_data[ w['layers'][:-1], cellids[0], cellids[1] ] ]
-            npf_package.k33.set_data(kxx_data)
-            w_stress_period.append(
-                    [
-                        (w['layers'][-1], cellids[0], cellids[1]),
-                        wsp['flow_rate'],
-                        w['id'] + '_SP' + str(wsp['stress_period_id'])
-                    ]
-                )
-            # Assign to stress period
-            wel_stress_period[ wsp['stress_period_id'] ].extend( w_stress_period )
     
-    # Build package
-    wel = flopy.mf6.ModflowGwfwel(
+    # Intersect wells with the grid, distribute
+    # flow rates and build package, see wells.py.
+    # Apply flow rate to deepest layer,
+    # increasing vertical k of upper layers
+    # In the case of multiple layers
+    wel = wells.build(
             gwf,
-            stress_period_data=wel_stress_period,
-            boundnames=True,
-            save_flows=True
+            None,
+            wells_data,
+            len(stress_periods),
+            pumping_method='deepest_layer_kzz_correction',
+            intersections_file=intersections_file,
+            filename=package_filename('wel', 'wel', pumping_flow_rate=pumping_flow_rate),
         )
     
     ###########
@@ -532,7 +592,8 @@ def configure(
             ss=storage_data['specific_storage'],
             sy=storage_data['specific_yield'],
             steady_state=steady_state,
-            transient=transient_state
+            transient=transient_state,
+            filename=package_filename('sto', 'sto', specific_storage=specific_storage),
         )
     
     
@@ -540,20 +601,224 @@ def configure(
     ##################
     # Output control #
     ##################
+    # Saved heads and budgets depend 
+    # on the output profile, see observations.py
+    saverecord  = observations.profiles[output_profile]
     budget_file = model_name + '.bud'
     head_file   = model_name + '.hds'
-    oc = flopy.mf6.ModflowGwfoc(
-            gwf,
-            budget_filerecord=budget_file,
-            head_filerecord  =head_file,
-            saverecord=[('HEAD', 'ALL'), ('BUDGET', 'ALL')]
-        )
+    if saverecord:
+        oc = flopy.mf6.ModflowGwfoc(
+                gwf,
+                budget_filerecord=budget_file,
+                head_filerecord  =head_file,
+                saverecord=saverecord
+            )
+    else:
+        oc = flopy.mf6.ModflowGwfoc( gwf )
+
+    # Heads at the columns of the wells 
+    # and at monitoring points
+    if output_profile == 'obs':
+        locations = [ { 'id': w['id'], 'point': w['point'] } for w in wells_data ] + monitoring_points
+        obs = observations.build(
+                gwf,
+                locations,
+                intersections_file=intersections_file,
+                filename=package_filename(
+                    'obs', 'obs', 
+                    locations=[ ( l['id'], l['point'].wkt, [ int(k) for k in l.get('layers', []) ] ) for l in locations ]
+                ),
+            )
     
+    #################
+    # Binary arrays #
+    #################
+    # Grid arrays as OPEN/CLOSE binary files, 
+    # named after the package file so these 
+    # are shared with it, see template.py.
+    # flopy only records their names, files
+    # are written with the simulation
+    binary_files = {}
+    if binary_arrays:
+        for package, array_name in [ (npf, 'k'), (npf, 'k33'), (ic, 'strt') ]:
+            array = getattr( package, array_name )
+            if not array.has_data():
+                continue
+            values = array.array
+            stem   = package.filename.rsplit('.', 1)[0] + '.' + array_name
+            layers = [
+                    ( stem + '_layer' + str(ilay + 1) + '.bin', values[ilay], array_name, ilay + 1 )
+                    for ilay in range( values.shape[0] )
+                ]
+            array.set_data( [ { 'filename': layer[0], 'binary': True, 'factor': 1.0 } for layer in layers ] )
+            binary_files.setdefault( package.filename, [] ).extend( layers )
+
+
     #############
     # Write MF6 #
     #############
     if args.write:
-        sim.write_simulation()
+        if template_folder is None:
+            sim.write_simulation()
+            for layers in binary_files.values():
+                inputs.write_arrays( sim_directory, layers )
+        else:
+            template.write_simulation( sim, template_folder, shared_files, binary_files )
+
+    return sim
+
+
+
+def set_experiment_folder(folder, template=None):
+    '''
+    Worker processes initializer, defines
+    the experiment and template folders used by configure
+    '''
+    global experiment_folder, template_folder
+    experiment_folder = folder
+    template_folder   = template
+
+
+
+def is_written(simulation_name, parameters):
+    '''
+    Verifies if a scenario was completely written with
+    the same parameters, by reading its written_marker
+
+    @params:
+        simulation_name (str): name of the simulation
+        parameters     (dict): scenario parameters
+
+    @return:
+        bool
+    '''
+    marker_file = os.path.join( experiment_folder, simulation_name, written_marker )
+    if not os.path.exists( marker_file ):
+        return False
+    try:
+        with open( marker_file ) as f:
+            return json.load( f ) == parameters
+    except ValueError:
+        return False
+
+
+
+def write_scenario(idsc, parameters, warm_start=None):
+    '''
+    Configures and writes a single scenario.
+
+    Scenarios already written with the same parameters 
+    and options are skipped, unless --overwrite is given. Any other folder content is removed
+    before writing, so partially written scenarios are never reused.
+    Exceptions are caught and reported back to the caller.
+
+    @params:
+        idsc        (int)  : scenario index
+        parameters  (dict) : keyword arguments for configure
+        warm_start  (tuple): (simulation name, heads file) of the scenario
+                             whose heads are the starting heads, see warmstart.py
+
+    @return:
+        tuple (idsc, status, elapsed seconds, error message),
+        status is one of 'written', 'skipped' or 'failed'
+    '''
+    start_time = time.time()
+
+    # Make parameters json friendly
+    parameters = { k: ( v.item() if hasattr(v, 'item') else v ) for k, v in parameters.items() }
+    written    = dict( parameters, binary_arrays=args.binary )
+    if args.output_profile != 'full':
+        written['output_profile'] = args.output_profile
+
+    # Start from the steady state of its group,
+    # or from the heads of a completed scenario
+    initial_heads_file   = None
+    initial_heads_period = None
+    if args.steady:
+        written['steady_state'] = steady.group_name( parameters )
+        initial_heads_file      = steady.heads_file( experiment_folder, written['steady_state'] )
+    elif warm_start is not None:
+        written['warm_start']   = warm_start[0]
+        initial_heads_file      = warm_start[1]
+        initial_heads_period    = warmstart.warm_start_period
+
+    try:
+        sim_directory = os.path.join( experiment_folder, parameters['simulation_name'] )
+        if args.write:
+            if ( not args.overwrite ) and is_written( parameters['simulation_name'], written ):
+                return idsc, 'skipped', time.time() - start_time, ''
+            if os.path.exists( sim_directory ):
+                shutil.rmtree( sim_directory )
+
+        configure(
+                template_folder=template_folder, 
+                binary_arrays=args.binary, 
+                initial_heads_file=initial_heads_file, 
+                initial_heads_period=initial_heads_period,
+                output_profile=args.output_profile,
+                **parameters
+            )
+
+        if args.write:
+            with open( os.path.join( sim_directory, written_marker ), 'w' ) as f:
+                json.dump( written, f )
+
+    except Exception:
+        return idsc, 'failed', time.time() - start_time, traceback.format_exc()
+
+    return idsc, 'written', time.time() - start_time, ''
+
+
+
+def solve_steady_state(name, parameters):
+    '''
+    Configures, writes and runs the steady state simulation
+    of a group of scenarios, see steady.py. Skipped if 
+    already solved with the same parameters and options, 
+    unless --overwrite is given. mf6 is monitored as by 
+    run.py, and killed once it exceeds --max-wall-time or 
+    --max-step-time, see monitor.py
+
+    @params:
+        name       (str) : group name, also simulation and model name
+        parameters (dict): steady state parameters of the group
+
+    @return:
+        tuple (name, status, elapsed seconds, error message),
+        status is one of 'solved', 'skipped' or 'failed'
+    '''
+    start_time = time.time()
+    written    = dict( parameters, binary_arrays=args.binary )
+
+    try:
+        sim_directory = os.path.join( experiment_folder, name )
+        if ( not args.overwrite ) and is_written( name, written ) and \
+                os.path.exists( steady.heads_file( experiment_folder, name ) ):
+            return name, 'skipped', time.time() - start_time, ''
+        if os.path.exists( sim_directory ):
+            shutil.rmtree( sim_directory )
+
+        configure(
+                simulation_name=name,
+                model_name=name,
+                binary_arrays=args.binary,
+                steady_state_only=True,
+                **parameters
+            )
+        success, reason, output = monitor.run(
+                sim_directory, config.exe_name, model_name=name, silent=True,
+                wall_time=args.max_wall_time, step_time=args.max_step_time
+            )
+        if not success:
+            raise Exception('flopy_config: steady state ' + name + ' failed, ' + reason + '\n' + '\n'.join( output[-20:] ))
+
+        with open( os.path.join( sim_directory, written_marker ), 'w' ) as f:
+            json.dump( written, f )
+
+    except Exception:
+        return name, 'failed', time.time() - start_time, traceback.format_exc()
+
+    return name, 'solved', time.time() - start_time, ''
 
 
 
@@ -568,16 +833,120 @@ if __name__=='__main__':
     experiment_folder = os.path.join( base_dir, args.experiment )
     if not os.path.exists(experiment_folder):
         raise Exception('flopy_config: experiment ' + args.experiment + ' not found in base_dir ' + base_dir )
+    if args.workers < 1:
+        raise Exception('flopy_config: --workers should be at least 1')
+    if args.steady and not args.write:
+        raise Exception('flopy_config: --steady requires --write')
+    if args.steady and args.warm_start:
+        raise Exception('flopy_config: use either --steady or --warm-start')
+
+    # Shared package files. 
+    # Template is rebuilt on overwrite
+    if args.template:
+        template_folder = os.path.join( experiment_folder, 'template' )
+        if args.overwrite and args.write and os.path.exists( template_folder ):
+            shutil.rmtree( template_folder )
 
 
     ################
     # Load scenarios
-    scenarios = pd.read_csv( os.path.join( experiment_folder, 'csv', 'scenarios.csv'), index_col=0 )  
+    # A lazy scenario space is only built for
+    # the given range, see utils/scenarios.py
+    scenariosdf, _ = scenarios.load( os.path.join( experiment_folder, 'csv' ), args.start, args.end )
     
     print( 'flopy_config: configuring experiment ' + args.experiment )
-    for idsc, sc in scenarios.iterrows():
-        print( 'flopy_config: configuring scenario ' + str(idsc) )
-        configure(**sc.to_dict())
+    start_time = time.time()
+
+
+    #########################################
+    # Warm start from the closest completed scenario.
+    # Heads are linked into the experiment cache, 
+    # so these survive the source being rewritten
+    warm_starts = {}
+    store_file  = os.path.join( experiment_folder, 'csv', 'runs.sqlite' )
+    if args.warm_start and os.path.exists( store_file ):
+        runsdf    = store.load( store_file )
+        completed = [
+                idsc for idsc in runsdf.index[ runsdf['status'].isin( warmstart.completed_statuses ) ]
+                if ( idsc in scenariosdf.index ) and os.path.exists( warmstart.heads_file( experiment_folder, scenariosdf.loc[idsc] ) )
+            ]
+        cache_dir = os.path.join( experiment_folder, '.cache', 'warmstart' )
+        os.makedirs( cache_dir, exist_ok=True )
+        for idsc in scenariosdf.index:
+            source = warmstart.nearest( scenariosdf, idsc, completed )
+            if source is None:
+                continue
+            source_name = scenariosdf.loc[source, 'simulation_name']
+            cached_file = os.path.join( cache_dir, source_name + '.hds' )
+            if source_name not in [ w[0] for w in warm_starts.values() ]:
+                template.link( warmstart.heads_file( experiment_folder, scenariosdf.loc[source] ), cached_file )
+            warm_starts[idsc] = ( source_name, cached_file )
+    if args.warm_start:
+        print( 'flopy_config: ' + str(len(warm_starts)) + ' scenarios warm started' )
+
+
+    ##############################
+    # Steady states, once per group
+    if args.steady:
+        groups = steady.groups( scenariosdf )
+        print( 'flopy_config: ' + str(len(scenariosdf)) + ' scenarios, ' + str(len(groups)) + ' steady states' )
+        results = []
+        if args.workers == 1:
+            for name, parameters in groups.items():
+                results.append( solve_steady_state( name, parameters ) )
+                print( 'flopy_config: steady state ' + name + ' ' + results[-1][1] + ' in ' + '{:.2f}'.format(results[-1][2]) + ' s' )
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=args.workers, 
+                    initializer=set_experiment_folder, 
+                    initargs=(experiment_folder, template_folder)
+                ) as executor:
+                futures = [ executor.submit( solve_steady_state, name, parameters ) for name, parameters in groups.items() ]
+                for future in as_completed( futures ):
+                    results.append( future.result() )
+                    print( 'flopy_config: steady state ' + results[-1][0] + ' ' + results[-1][1] + ' in ' + '{:.2f}'.format(results[-1][2]) + ' s' )
+        failed = [ r for r in results if r[1] == 'failed' ]
+        for name, status, elapsed, error in failed:
+            print( error )
+        if failed:
+            raise Exception('flopy_config: ' + str(len(failed)) + ' steady states failed')
+
+
+    results    = []
+    if args.workers == 1:
+        for idsc, sc in scenariosdf.iterrows():
+            print( 'flopy_config: configuring scenario ' + str(idsc) )
+            results.append( write_scenario( idsc, sc.to_dict(), warm_starts.get(idsc) ) )
+            idsc, status, elapsed, error = results[-1]
+            print( 'flopy_config: scenario ' + str(idsc) + ' ' + status + ' in ' + '{:.2f}'.format(elapsed) + ' s' )
+    else:
+        with ProcessPoolExecutor(
+                max_workers=args.workers, 
+                initializer=set_experiment_folder, 
+                initargs=(experiment_folder, template_folder)
+            ) as executor:
+            futures = [ 
+                    executor.submit( write_scenario, idsc, sc.to_dict(), warm_starts.get(idsc) ) 
+                    for idsc, sc in scenariosdf.iterrows() 
+                ]
+            for future in as_completed( futures ):
+                results.append( future.result() )
+                idsc, status, elapsed, error = results[-1]
+                print( 'flopy_config: scenario ' + str(idsc) + ' ' + status + ' in ' + '{:.2f}'.format(elapsed) + ' s' )
+
+
+    ########
+    # Report
+    failed = [ r for r in results if r[1] == 'failed' ]
+    for idsc, status, elapsed, error in failed:
+        print( 'flopy_config: scenario ' + str(idsc) + ' failed' )
+        print( error )
+    print( 
+        'flopy_config: ' + 
+        str( sum( r[1] == 'written' for r in results ) ) + ' written, ' +
+        str( sum( r[1] == 'skipped' for r in results ) ) + ' skipped, ' +
+        str( len(failed) ) + ' failed in ' + '{:.2f}'.format( time.time() - start_time ) + ' s' 
+    )
 
 
     print('flopy_config: done!')
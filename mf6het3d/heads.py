@@ -0,0 +1,125 @@
+'''
+heads.py
+
+Builders of the constant head package and of the starting
+heads, by NumPy broadcasting over layers and cells instead
+of python loops, for structured (DIS) and vertex (DISV) grids.
+
+A constant head boundary is a dict as defined in
+flopy_config.configure:
+
+    {
+        'name': 'inlet',
+        'head': 110,
+        'line': shapely.geometry.LineString(...),
+    }
+'''
+
+import flopy
+import numpy as np
+
+
+
+def cellids_array(modelgrid, cellids):
+    '''
+    Cells within a layer as an integer array, shape (cells, 2)
+    with (row, column) for DIS grids and (cells, 1) with
+    cell2d for DISV grids
+    '''
+    if modelgrid.grid_type == 'structured':
+        return np.array( cellids, dtype=int ).reshape(-1, 2)
+    elif modelgrid.grid_type == 'vertex':
+        return np.array( cellids, dtype=int ).reshape(-1, 1)
+    raise Exception('heads.py: grid type ' + str(modelgrid.grid_type) + ' not implemented.')
+
+
+
+def chd_records(modelgrid, boundaries, boundary_cellids, layers=None):
+    '''
+    Constant head records of all boundaries, applied to
+    all layers, as a structured array
+
+    @params:
+        modelgrid        (flopy.discretization.Grid): model grid
+        boundaries       (list)                     : constant head boundaries definition
+        boundary_cellids (list)                     : cells of each boundary within a layer, see intersections.py
+        layers           (list)                     : layers of the boundaries, all if None
+
+    @return:
+        numpy.recarray with fields cellid and head, ordered by
+        boundary, layer and cell
+    '''
+    if layers is None:
+        layers = np.arange( modelgrid.nlay )
+    layers = np.asarray( layers, dtype=int )
+
+    cells = []
+    heads = []
+    for ch, cellids in zip( boundaries, boundary_cellids ):
+        cellids = cellids_array( modelgrid, cellids )
+        # (layers, cells, 1 + cell dimensions)
+        layered = np.concatenate(
+                [
+                    np.broadcast_to( layers[:, np.newaxis, np.newaxis], ( len(layers), len(cellids), 1 ) ),
+                    np.broadcast_to( cellids[np.newaxis, :, :], ( len(layers), ) + cellids.shape ),
+                ],
+                axis=2,
+            ).reshape( -1, 1 + cellids.shape[1] )
+        cells.append( layered )
+        heads.append( np.full( len(layered), ch['head'], dtype=np.float64 ) )
+
+    cells = np.concatenate( cells ) if cells else np.zeros( ( 0, 3 ), dtype=int )
+    heads = np.concatenate( heads ) if heads else np.zeros( 0 )
+
+    # cellids as tuples, built column wise
+    cellids = list( zip( *cells.T.tolist() ) )
+    return np.rec.fromrecords(
+            list( zip( cellids, heads.tolist() ) ),
+            dtype=[ ('cellid', object), ('head', np.float64) ],
+        )
+
+
+
+def build_chd(gwf, boundaries, boundary_cellids, **kwargs):
+    '''
+    Builds the constant head package, boundaries
+    applied to all layers
+
+    @params:
+        gwf              (flopy.mf6.ModflowGwf): model
+        boundaries       (list)                : constant head boundaries definition
+        boundary_cellids (list)                : cells of each boundary within a layer
+        kwargs                                 : passed to flopy.mf6.ModflowGwfchd, e.g. filename
+
+    @return:
+        flopy.mf6.ModflowGwfchd
+    '''
+    records = chd_records( gwf.modelgrid, boundaries, boundary_cellids )
+    return flopy.mf6.ModflowGwfchd(
+            gwf,
+            stress_period_data={ 0: { 'data': records } },
+            maxbound=len(records),
+            **kwargs
+        )
+
+
+
+def linear_heads(shape, inlet_head, outlet_head):
+    '''
+    Starting heads of all layers, linearly interpolated
+    along columns between the inlet (first column) and
+    the outlet (last column) heads
+
+    @params:
+        shape       (tuple): (layers, rows, columns)
+        inlet_head  (float): head of the inlet boundary
+        outlet_head (float): head of the outlet boundary
+
+    @return:
+        numpy.ndarray of shape (layers, rows, columns)
+    '''
+    columns  = shape[2]
+    fraction = np.arange( 1, columns + 1 )/columns
+    profile  = ( 1 - fraction )*inlet_head + fraction*outlet_head
+
+    return np.ascontiguousarray( np.broadcast_to( profile, shape ), dtype=np.float64 )
@@ -0,0 +1,195 @@
+'''
+inputs.py
+
+Lightweight access to the written files of a simulation. Files
+are located through the name files, and the model grid is read
+from the binary grid file written by mf6, so scenarios are run
+and post-processed without loading every package into flopy
+objects. A full load is left to load, for whoever asks for it.
+'''
+
+import os
+import re
+import flopy
+import numpy as np
+
+
+# Header of binary array files, as written by flopy and read by mf6
+array_header = np.dtype([
+        ( 'kstp'  , '<i4' ),
+        ( 'kper'  , '<i4' ),
+        ( 'pertim', '<f8' ),
+        ( 'totim' , '<f8' ),
+        ( 'text'  , 'S16' ),
+        ( 'ncol'  , '<i4' ),
+        ( 'nrow'  , '<i4' ),
+        ( 'ilay'  , '<i4' ),
+    ])
+
+
+
+def block_entries(file_path, block):
+    '''
+    Entries of a block of a name file, as lists of words
+    '''
+    with open( file_path ) as f:
+        content = f.read()
+    match = re.search( r'^\s*BEGIN\s+' + block + r'\b.*?$(.*?)^\s*END\s+' + block + r'\b', content, re.IGNORECASE | re.MULTILINE | re.DOTALL )
+    if match is None:
+        return []
+
+    return [
+            line.split() for line in match.group(1).splitlines()
+            if line.strip() and ( not line.strip().startswith( ('#', '!') ) )
+        ]
+
+
+
+def model_file(simulation_folder, model_name):
+    '''
+    Name file of a model, from mfsim.nam
+    '''
+    for entry in block_entries( os.path.join( simulation_folder, 'mfsim.nam' ), 'models' ):
+        if ( len(entry) > 2 ) and ( entry[2].lower() == model_name.lower() ):
+            return os.path.join( simulation_folder, entry[1].strip('\'"') )
+    raise Exception('inputs: model ' + model_name + ' not found at ' + simulation_folder)
+
+
+
+def package_file(simulation_folder, model_name, ftype):
+    '''
+    File of the first package of type ftype of a model,
+    e.g. 'IC6' or 'DIS6'
+    '''
+    for entry in block_entries( model_file( simulation_folder, model_name ), 'packages' ):
+        if entry[0].upper() == ftype.upper():
+            return os.path.join( simulation_folder, entry[1].strip('\'"') )
+    raise Exception('inputs: package ' + ftype + ' of model ' + model_name + ' not found at ' + simulation_folder)
+
+
+
+def period_data(simulation_folder):
+    '''
+    Stress periods of the time discretization file
+
+    @return:
+        list of (length, time steps, multiplier)
+    '''
+    for entry in block_entries( os.path.join( simulation_folder, 'mfsim.nam' ), 'timing' ):
+        if entry[0].upper() == 'TDIS6':
+            tdis_file = os.path.join( simulation_folder, entry[1].strip('\'"') )
+            return [
+                    ( float( period[0] ), int( period[1] ), float( period[2] ) )
+                    for period in block_entries( tdis_file, 'perioddata' )
+                ]
+    raise Exception('inputs: time discretization not found at ' + simulation_folder)
+
+
+
+def steps_per_period(simulation_folder):
+    '''
+    Number of time steps of each stress period, from
+    the time discretization file
+
+    @return:
+        list of int
+    '''
+    return [ nstp for _, nstp, _ in period_data( simulation_folder ) ]
+
+
+
+def time_steps(simulation_folder):
+    '''
+    Time steps of a simulation, as mf6 computes them
+    from the time discretization file
+
+    @return:
+        tuple of numpy.ndarray (kper, kstp, delt, totim),
+        kper and kstp one based, as in output files
+    '''
+    kper, kstp, delt = [], [], []
+    for iper, ( perlen, nstp, tsmult ) in enumerate( period_data( simulation_folder ) ):
+        if tsmult == 1:
+            lengths = np.full( nstp, perlen/nstp )
+        else:
+            lengths = perlen*( tsmult - 1 )/( tsmult**nstp - 1 )*tsmult**np.arange( nstp )
+        kper += [ iper + 1 ]*nstp
+        kstp += list( range( 1, nstp + 1 ) )
+        delt += list( lengths )
+    delt = np.array( delt )
+
+    return np.array( kper ), np.array( kstp ), delt, np.cumsum( delt )
+
+
+
+def write_array(file_path, array, text, ilay=1):
+    '''
+    Writes a layer array as a binary file, for OPEN/CLOSE
+    with (BINARY), in double precision
+
+    @params:
+        file_path (str)          : file to write
+        array     (numpy.ndarray): array of a layer, shape (rows, columns) or (1, cells)
+        text      (str)          : array name, e.g. 'STRT'
+        ilay      (int)          : layer, one based
+    '''
+    array  = np.asarray( array, dtype='<f8' )
+    header = np.zeros( 1, dtype=array_header )
+    header['kstp'], header['kper'] = 1, 1
+    header['text'] = text.upper().rjust(16)
+    header['ncol'] = array.shape[-1]
+    header['nrow'] = array.size//array.shape[-1]
+    header['ilay'] = ilay
+    with open( file_path, 'wb' ) as f:
+        header.tofile( f )
+        array.tofile( f )
+
+
+
+def write_arrays(folder, arrays):
+    '''
+    Writes layer arrays as binary files, see write_array
+
+    @params:
+        folder (str) : folder of the files
+        arrays (list): (file name, array, text, ilay) of each layer
+    '''
+    for file_name, array, text, ilay in arrays:
+        write_array( os.path.join( folder, file_name ), array, text, ilay )
+
+
+
+def modelgrid(simulation_folder, simulation_name, model_name):
+    '''
+    Model grid of a run simulation, from the binary grid file
+    written by mf6 next to the discretization file. Without it,
+    only the discretization package is loaded
+
+    @return:
+        flopy.discretization.Grid
+    '''
+    for ftype in [ 'DIS6', 'DISV6' ]:
+        try:
+            grid_file = package_file( simulation_folder, model_name, ftype ) + '.grb'
+        except Exception:
+            continue
+        if os.path.exists( grid_file ):
+            return flopy.mf6.utils.MfGrdFile( grid_file ).modelgrid
+        break
+
+    sim = load( simulation_folder, simulation_name, load_only=[ 'dis', 'disv' ] )
+    return sim.get_model( model_name ).modelgrid
+
+
+
+def load(simulation_folder, simulation_name, load_only=None):
+    '''
+    Loads a written simulation into flopy, all of its
+    packages or those of load_only
+
+    @return:
+        flopy.mf6.MFSimulation
+    '''
+    return flopy.mf6.MFSimulation.load(
+            sim_ws=simulation_folder, sim_name=simulation_name, verbosity_level=0, load_only=load_only
+        )
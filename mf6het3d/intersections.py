@@ -0,0 +1,224 @@
+'''
+intersections.py
+
+Cache of grid intersections. Scenarios of an experiment share
+the model grid and the geometries of boundaries and wells, so
+each geometry is intersected once per grid and kept at
+<experiment>/.cache/intersections.pkl, keyed by the grid
+signature and the geometry itself (wkb).
+
+Points missing from the cache are intersected in bulk, by
+binary search on the grid edges for structured grids and
+through a spatial index of the cells for vertex grids. Other
+geometries are intersected by flopy.utils.GridIntersect.
+'''
+
+import os
+import pickle
+import hashlib
+import flopy
+import numpy as np
+import shapely
+import shapely.geometry as shp
+from flopy.utils.geometry import transform
+
+
+# Intersections by cache file, as
+# { grid signature: { geometry wkb: [cellids] } }
+_caches = {}
+
+# Spatial indexes of vertex grids, by grid signature
+_indexes = {}
+
+
+
+def grid_signature(modelgrid):
+    '''
+    Identifies the plan view of a grid, by its type, placement
+    and cells. Layers are not considered
+
+    @return:
+        str, sha1 hex digest
+    '''
+    sha1 = hashlib.sha1()
+    sha1.update( str(( modelgrid.grid_type, modelgrid.xoffset, modelgrid.yoffset, modelgrid.angrot )).encode() )
+    if modelgrid.grid_type == 'structured':
+        arrays = [ modelgrid.delr, modelgrid.delc ]
+    elif modelgrid.grid_type == 'vertex':
+        arrays = [ modelgrid.verts ] + [ np.array(iv) for iv in modelgrid.iverts ]
+    else:
+        raise Exception('intersections.py: grid type ' + str(modelgrid.grid_type) + ' not implemented.')
+    for array in arrays:
+        sha1.update( np.ascontiguousarray( array, dtype=float ).tobytes() )
+        sha1.update( b'\0' )
+
+    return sha1.hexdigest()
+
+
+
+def load(cache_file):
+    '''
+    Loads intersections saved at cache_file, once per process
+    '''
+    if cache_file not in _caches:
+        cache = {}
+        if ( cache_file is not None ) and os.path.exists( cache_file ):
+            try:
+                with open( cache_file, 'rb' ) as f:
+                    cache = pickle.load( f )
+            except ( EOFError, pickle.UnpicklingError ):
+                # Broken cache, rebuilt on save
+                cache = {}
+        _caches[cache_file] = cache
+
+    return _caches[cache_file]
+
+
+
+def save(cache_file, cache):
+    '''
+    Saves intersections, merged with those saved by other
+    processes since this one loaded the cache
+    '''
+    if os.path.exists( cache_file ):
+        try:
+            with open( cache_file, 'rb' ) as f:
+                saved = pickle.load( f )
+        except ( EOFError, pickle.UnpicklingError ):
+            saved = {}
+        for signature, entries in saved.items():
+            for key, cellids in entries.items():
+                cache.setdefault( signature, {} ).setdefault( key, cellids )
+
+    os.makedirs( os.path.dirname( cache_file ), exist_ok=True )
+    temporary = cache_file + '.' + str(os.getpid()) + '.tmp'
+    with open( temporary, 'wb' ) as f:
+        pickle.dump( cache, f )
+    os.replace( temporary, cache_file )
+
+
+
+def edge_positions(edges, values):
+    '''
+    Cell index of each value within edges, increasing or
+    decreasing, as flopy.utils.gridintersect.ModflowGridIndices
+    .find_position_in_array: values on an edge belong to the
+    first cell, values outside to none (-1)
+    '''
+    increasing = edges[-1] > edges[0]
+    ascending  = edges if increasing else edges[::-1]
+    if increasing:
+        positions = np.searchsorted( ascending, values, side='left' ) - 1
+    else:
+        positions = len(edges) - 1 - np.searchsorted( ascending, values, side='right' )
+    positions = np.clip( positions, 0, len(edges) - 2 )
+
+    outside = ( values < ascending[0] ) | ( values > ascending[-1] )
+    positions[ outside ] = -1
+
+    return positions
+
+
+
+def intersect_points_structured(modelgrid, points):
+    '''
+    Intersects points with a structured grid at once
+
+    @return:
+        list, [(row, column)] for each point, empty if outside
+    '''
+    x = np.array([ p.x for p in points ], dtype=float)
+    y = np.array([ p.y for p in points ], dtype=float)
+    if ( modelgrid.angrot != 0 ) or ( modelgrid.xoffset != 0 ) or ( modelgrid.yoffset != 0 ):
+        x, y = transform( x, y, modelgrid.xoffset, modelgrid.yoffset, modelgrid.angrot_radians, inverse=True )
+
+    xedges, yedges = modelgrid.xyedges
+    columns = edge_positions( np.asarray(xedges, dtype=float), x )
+    rows    = edge_positions( np.asarray(yedges, dtype=float), y )
+
+    return [
+            [ ( int(r), int(c) ) ] if ( r >= 0 ) and ( c >= 0 ) else []
+            for r, c in zip( rows, columns )
+        ]
+
+
+
+def intersect_points_vertex(modelgrid, signature, points):
+    '''
+    Intersects points with a vertex grid at once, querying a
+    spatial index of the cells. Requires shapely>=2, returns
+    None otherwise
+
+    @return:
+        list, [cell2d] for each point, sorted
+    '''
+    if not hasattr( shapely, 'STRtree' ):
+        return None
+
+    if signature not in _indexes:
+        xvertices = modelgrid.xvertices
+        yvertices = modelgrid.yvertices
+        cells     = [ shp.Polygon( list( zip( xv, yv ) ) ) for xv, yv in zip( xvertices, yvertices ) ]
+        _indexes[signature] = shapely.STRtree( cells )
+
+    ipoints, icells = _indexes[signature].query( np.array( points, dtype=object ), predicate='intersects' )
+    cellids = [ [] for p in points ]
+    for ip, ic in zip( ipoints, icells ):
+        cellids[ip].append( int(ic) )
+
+    return [ sorted(c) for c in cellids ]
+
+
+
+def intersect(modelgrid, geometries, cache_file=None, ginter=None):
+    '''
+    Intersects geometries with the model grid, looking
+    these up in the cache first
+
+    @params:
+        modelgrid  (flopy.discretization.Grid): model grid
+        geometries (list)                     : shapely geometries
+        cache_file (str)                      : file persisting the cache, memory only if None
+        ginter     (GridIntersect)            : used for geometries other than points, created if None
+
+    @return:
+        list, cellids intersected by each geometry. These
+        follow (row, column) notation for structured grids
+        and are cell2d indexes for vertex grids
+    '''
+    signature = grid_signature( modelgrid )
+    cache     = load( cache_file )
+    entries   = cache.setdefault( signature, {} )
+
+    keys    = [ g.wkb for g in geometries ]
+    missing = {}
+    for key, geometry in zip( keys, geometries ):
+        if key not in entries:
+            missing[key] = geometry
+
+    if missing:
+        # Points in bulk
+        points = { k: g for k, g in missing.items() if g.geom_type == 'Point' }
+        if points:
+            if modelgrid.grid_type == 'structured':
+                cellids = intersect_points_structured( modelgrid, list( points.values() ) )
+            else:
+                cellids = intersect_points_vertex( modelgrid, signature, list( points.values() ) )
+            if cellids is not None:
+                for key, c in zip( points, cellids ):
+                    entries[key] = c
+                    del missing[key]
+
+        # Remaining geometries, one at a time
+        if missing and ( ginter is None ):
+            ginter = flopy.utils.GridIntersect( modelgrid )
+        for key, geometry in missing.items():
+            entries[key] = [
+                    tuple( int(i) for i in c ) if modelgrid.grid_type == 'structured' else int(c)
+                    for c in ginter.intersect( geometry )['cellids']
+                ]
+
+        if cache_file is not None:
+            save( cache_file, cache )
+
+    return [ entries[key] for key in keys ]
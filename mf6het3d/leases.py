@@ -0,0 +1,343 @@
+'''
+leases.py
+
+Work queue over a shared file system, so run.py processes on
+several hosts drain the same experiment. Scenarios are claimed
+through lease files at <experiment>/.leases:
+
+    <index>.lease: held by a process, created exclusively, so
+                   only one process claims a scenario. Its
+                   modification time is refreshed by a heartbeat
+    <index>.done : the scenario was executed, with the fingerprint
+                   of its inputs, see fingerprint.py. A marker of
+                   other inputs does not count as done. It keeps
+                   the run fields of the scenario, and of those
+                   sharing its outputs, merged into the status
+                   store by the coordinator, see collect
+    <index>.lock : held while a lease is checked and removed, or
+                   refreshed, created exclusively, see lock_lease
+
+A lease not refreshed for lease_seconds belongs to a dead process
+and is broken by whoever claims the scenario next. A lease is never
+missing while valid, so it can not be claimed by two processes. Times are
+compared against the clock of the file system, not of the host,
+so hosts with skewed clocks agree on expiry.
+'''
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+
+
+# Seconds without heartbeat after which a lease expires
+lease_seconds = 120
+
+lease_extension = '.lease'
+done_extension  = '.done'
+lock_extension  = '.lock'
+
+
+
+class Holder:
+    '''
+    Leases held by this process. A heartbeat thread refreshes
+    them every quarter of lease_seconds while held
+
+    @params:
+        lease_folder  (str)  : folder of lease files
+        lease_seconds (float): seconds without heartbeat after which a lease expires
+        fingerprints  (dict) : input fingerprints by scenario index, None to accept any done marker
+    '''
+
+    def __init__(self, lease_folder, lease_seconds=lease_seconds, fingerprints=None):
+        os.makedirs( lease_folder, exist_ok=True )
+        self.lease_folder  = lease_folder
+        self.lease_seconds = lease_seconds
+        self.fingerprints  = fingerprints
+        self.token         = socket.gethostname() + ':' + str(os.getpid()) + ':' + uuid.uuid4().hex
+        self.clock_file    = os.path.join( lease_folder, '.clock.' + uuid.uuid4().hex )
+        self.held          = {}
+        self.lock          = threading.Lock()
+        self.stopped       = threading.Event()
+        self.heartbeat     = threading.Thread( target=self.beat, daemon=True )
+        self.heartbeat.start()
+
+
+    def path(self, index, extension=lease_extension):
+        '''
+        Lease file, or done marker, of a scenario
+        '''
+        return os.path.join( self.lease_folder, str(index) + extension )
+
+
+    def now(self):
+        '''
+        Current time of the file system
+        '''
+        with open( self.clock_file, 'w' ):
+            pass
+        return os.stat( self.clock_file ).st_mtime
+
+
+    def beat(self):
+        '''
+        Refreshes held leases, until stopped, waiting for leases
+        checked by another process. A lease missing, or of another
+        process, was lost
+        '''
+        while not self.stopped.wait( self.lease_seconds/4 ):
+            with self.lock:
+                for index, lease_file in list( self.held.items() ):
+                    self.lock_lease( index, wait=True )
+                    try:
+                        if self.holds( index ):
+                            os.utime( lease_file )
+                        else:
+                            del self.held[index]
+                            print('leases: lease of scenario ' + str(index) + ' was lost')
+                    finally:
+                        self.unlock_lease( index )
+
+
+    def lock_lease(self, index, wait=False):
+        '''
+        Takes the lock of the lease of a scenario. A lease is only
+        checked and removed, or refreshed, under its lock, so the
+        check and the removal are a single step. A lock left by
+        a dead process is removed once older than lease_seconds
+
+        @params:
+            index (int) : scenario index
+            wait  (bool): wait until taken
+
+        @return:
+            bool, True if taken
+        '''
+        lock_file = self.path( index, lock_extension )
+        while True:
+            try:
+                os.close( os.open( lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY ) )
+                return True
+            except FileExistsError:
+                pass
+            try:
+                if self.now() - os.stat( lock_file ).st_mtime > self.lease_seconds:
+                    os.remove( lock_file )
+                    continue
+            except FileNotFoundError:
+                continue
+            if not wait:
+                return False
+            time.sleep( 0.01 )
+
+
+    def unlock_lease(self, index):
+        '''
+        Releases the lock of the lease of a scenario
+        '''
+        try:
+            os.remove( self.path( index, lock_extension ) )
+        except FileNotFoundError:
+            pass
+
+
+    def is_done(self, index):
+        '''
+        Verifies if a scenario was executed by any process,
+        from the same inputs
+        '''
+        marker = self.read( self.path( index, done_extension ) )
+        if marker is None:
+            return False
+        if self.fingerprints is None:
+            return True
+        return marker.get('fingerprint') == self.fingerprints.get( index )
+
+
+    def read(self, lease_file):
+        '''
+        Content of a lease file, None if absent or being written
+        '''
+        try:
+            with open( lease_file ) as f:
+                return json.load( f )
+        except ( FileNotFoundError, ValueError ):
+            return None
+
+
+    def create(self, index):
+        '''
+        Creates the lease file of a scenario, if there is none
+        '''
+        lease_file = self.path( index )
+        try:
+            fd = os.open( lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY )
+        except FileExistsError:
+            return False
+        with os.fdopen( fd, 'w' ) as f:
+            json.dump( { 'token': self.token, 'host': socket.gethostname(), 'pid': os.getpid() }, f )
+        with self.lock:
+            self.held[index] = lease_file
+        return True
+
+
+    def expired(self, index):
+        '''
+        Verifies if the lease of a scenario exists and expired
+        '''
+        try:
+            modified = os.stat( self.path( index ) ).st_mtime
+        except FileNotFoundError:
+            return False
+        return self.now() - modified > self.lease_seconds
+
+
+    def break_expired(self, index):
+        '''
+        Removes the lease of a scenario if expired. Its modification
+        time is checked again and the lease removed under its lock,
+        so it is not refreshed, nor replaced, in between
+        '''
+        if ( not self.expired( index ) ) or ( not self.lock_lease( index ) ):
+            return
+        try:
+            lease_file = self.path( index )
+            if not self.expired( index ):
+                return
+            expired = self.read( lease_file ) or { 'host': 'unknown', 'pid': '' }
+            os.remove( lease_file )
+            print('leases: lease of scenario ' + str(index) + ' held by ' + str(expired.get('host')) + ':' + str(expired.get('pid')) + ' expired')
+        finally:
+            self.unlock_lease( index )
+
+
+    def claim(self, index):
+        '''
+        Claims a scenario not done yet, breaking an expired lease
+
+        @return:
+            bool, True if claimed
+        '''
+        if self.is_done( index ):
+            return False
+        if self.create( index ):
+            # Done between the check and the claim
+            if self.is_done( index ):
+                self.release( index )
+                return False
+            return True
+        self.break_expired( index )
+        return self.create( index )
+
+
+    def holds(self, index):
+        '''
+        Verifies this process still holds the lease of a scenario
+        '''
+        lease = self.read( self.path( index ) )
+        return ( lease is not None ) and ( lease['token'] == self.token )
+
+
+    def release(self, index):
+        '''
+        Gives up the lease of a scenario, if still held
+        '''
+        with self.lock:
+            self.held.pop( index, None )
+        self.lock_lease( index, wait=True )
+        try:
+            if self.holds( index ):
+                os.remove( self.path( index ) )
+        finally:
+            self.unlock_lease( index )
+
+
+    def complete(self, index, runs={}):
+        '''
+        Marks a claimed scenario as done and releases it
+
+        @params:
+            index (int) : scenario index
+            runs  (dict): run fields (dict) by scenario index, recorded at the done marker
+        '''
+        with self.lock:
+            self.held.pop( index, None )
+        if not self.holds( index ):
+            print('leases: lease of scenario ' + str(index) + ' was lost, executed by another process too')
+        done_file = self.path( index, done_extension )
+        with open( done_file + '.' + uuid.uuid4().hex, 'w' ) as f:
+            json.dump( {
+                    'token'      : self.token,
+                    'fingerprint': None if self.fingerprints is None else self.fingerprints.get( index ),
+                    'completed'  : time.time(),
+                    'runs'       : { str(i): fields for i, fields in runs.items() },
+                }, f, default=lambda v: v.item() )
+        os.replace( f.name, done_file )
+        self.release( index )
+
+
+    def leased_by_others(self, indexes):
+        '''
+        Scenarios among indexes not done, with a live lease
+        of another process. Expired leases are not live
+        '''
+        now    = self.now()
+        leased = []
+        for index in indexes:
+            if self.is_done( index ) or ( index in self.held ):
+                continue
+            try:
+                modified = os.stat( self.path( index ) ).st_mtime
+            except FileNotFoundError:
+                continue
+            if now - modified <= self.lease_seconds:
+                leased.append( index )
+        return leased
+
+
+    def stop(self):
+        '''
+        Stops the heartbeat and releases held leases
+        '''
+        self.stopped.set()
+        self.heartbeat.join()
+        for index in list( self.held ):
+            self.release( index )
+        if os.path.exists( self.clock_file ):
+            os.remove( self.clock_file )
+
+
+
+def collect(lease_folder):
+    '''
+    Done markers of an experiment
+
+    @return:
+        dict of markers (dict) by scenario index
+    '''
+    if not os.path.isdir( lease_folder ):
+        return {}
+    markers = {}
+    for f in os.listdir( lease_folder ):
+        if not f.endswith( done_extension ):
+            continue
+        try:
+            with open( os.path.join( lease_folder, f ) ) as marker:
+                markers[ int( f[:-len(done_extension)] ) ] = json.load( marker )
+        except ( FileNotFoundError, ValueError ):
+            continue
+    return markers
+
+
+
+def clear(lease_folder):
+    '''
+    Removes all leases and done markers of an experiment
+    '''
+    if not os.path.isdir( lease_folder ):
+        return
+    for f in os.listdir( lease_folder ):
+        os.remove( os.path.join( lease_folder, f ) )
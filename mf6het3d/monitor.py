@@ -0,0 +1,198 @@
+'''
+monitor.py
+
+Execution of mf6 under budgets. The standard output of mf6 is
+streamed and the list files are followed while it runs, so the
+progress and convergence of every time step are known before
+it exits. Runs exceeding a budget are killed at once, freeing
+their core, and reported with the reason:
+
+    wall_time       : seconds since mf6 started
+    step_time       : seconds without progressing to another time step
+    outer_iterations: outer iterations (calls to the numerical
+                      solution) of all time steps so far
+    failed_steps    : time steps which failed to converge
+
+A budget of None is not applied.
+'''
+
+import os
+import re
+import time
+import queue
+import threading
+import subprocess
+
+# Self
+import warmstart
+
+
+# Seconds between budget checks
+poll_interval = 0.5
+
+# Progress line printed by mf6 when a time step starts
+progress_pattern = re.compile( r'Solving:\s+Stress period:\s+(\d+)\s+Time step:\s+(\d+)', re.IGNORECASE )
+
+# Convergence failure of a time step, at the list files
+failure_pattern = re.compile( rb'FAILED TO MEET SOLVER CONVERGENCE CRITERIA', re.IGNORECASE )
+
+# Normal termination, as verified by flopy
+normal_termination = 'normal termination'
+
+
+
+class ListFollower:
+    '''
+    Follows a list file being written, parsing complete
+    lines appended since the last call
+    '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.offset    = 0
+        self.outer     = 0
+        self.failed    = 0
+
+
+    def update(self):
+        '''
+        Parses new lines, counting outer iterations and
+        failures to converge
+        '''
+        if not os.path.exists( self.file_path ):
+            return
+        with open( self.file_path, 'rb' ) as f:
+            f.seek( self.offset )
+            content = f.read()
+        end = content.rfind( b'\n' ) + 1
+        if end == 0:
+            return
+        content      = content[:end]
+        self.offset += end
+        self.outer  += sum( int(c) for c in warmstart.calls_pattern.findall( content ) )
+        self.failed += len( failure_pattern.findall( content ) )
+
+
+
+def read_lines(stream, lines):
+    '''
+    Puts lines of a stream into a queue, None at its end.
+    Executed by a thread, so reading never blocks the checks
+    '''
+    for line in iter( stream.readline, '' ):
+        lines.put( line )
+    stream.close()
+    lines.put( None )
+
+
+
+def exceeded(budgets, elapsed, since_progress, outer, failed):
+    '''
+    First budget exceeded, if any
+
+    @return:
+        str, reason, empty if none
+    '''
+    checks = [
+            ( 'wall_time'       , elapsed       , 'wall time of {:.1f} s'                     ),
+            ( 'step_time'       , since_progress, '{:.1f} s without completing a time step'   ),
+            ( 'outer_iterations', outer         , '{:.0f} outer iterations'                   ),
+            ( 'failed_steps'    , failed        , '{:.0f} time steps failed to converge'      ),
+        ]
+    for budget, value, message in checks:
+        limit = budgets.get( budget )
+        if ( limit is not None ) and ( value > limit ):
+            return 'killed, ' + budget + ' budget of ' + str(limit) + ' exceeded, ' + message.format( value )
+
+    return ''
+
+
+
+def run(simulation_folder, exe_name, model_name=None, silent=False, **budgets):
+    '''
+    Executes mf6 at simulation_folder, monitoring its progress
+
+    @params:
+        simulation_folder (str) : folder with mfsim.nam
+        exe_name          (str) : mf6 executable
+        model_name        (str) : name of the gwf model, whose list file is followed too
+        silent            (bool): do not print mf6 output
+        budgets                 : wall_time, step_time, outer_iterations, failed_steps
+
+    @return:
+        tuple (success, reason, output lines), reason
+        is empty on success
+    '''
+    unknown = set( budgets ) - { 'wall_time', 'step_time', 'outer_iterations', 'failed_steps' }
+    if unknown:
+        raise Exception('monitor: unknown budgets ' + ', '.join( sorted(unknown) ))
+
+    # List files are only followed for iteration budgets
+    follow     = ( budgets.get('outer_iterations') is not None ) or ( budgets.get('failed_steps') is not None )
+    list_files = [ 'mfsim.lst' ] + ( [ model_name + '.lst' ] if model_name is not None else [] )
+    followers  = [ ListFollower( os.path.join( simulation_folder, f ) ) for f in list_files ]
+
+    # Output of gfortran units is buffered when not a terminal. Standard
+    # output is unbuffered so progress arrives as printed, and list
+    # files too when followed
+    env = dict( os.environ, GFORTRAN_UNBUFFERED_PRECONNECTED='y' )
+    if follow:
+        env['GFORTRAN_UNBUFFERED_ALL'] = 'y'
+
+    process = subprocess.Popen(
+            [ exe_name ], cwd=simulation_folder, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+        )
+    lines  = queue.Queue()
+    reader = threading.Thread( target=read_lines, args=( process.stdout, lines ), daemon=True )
+    reader.start()
+
+    output        = []
+    reason        = ''
+    started       = time.time()
+    last_progress = started
+    last_check    = 0
+    finished      = False
+    while not finished:
+        try:
+            line = lines.get( timeout=poll_interval )
+        except queue.Empty:
+            line = ''
+        if line is None:
+            finished = True
+        elif line:
+            line = line.rstrip()
+            output.append( line )
+            if not silent:
+                print( line )
+            if progress_pattern.search( line ):
+                last_progress = time.time()
+
+        # Budgets, at most once per poll_interval
+        now = time.time()
+        if finished or ( now - last_check < poll_interval ):
+            continue
+        last_check = now
+        if follow:
+            for follower in followers:
+                follower.update()
+        reason = exceeded(
+                budgets, now - started, now - last_progress,
+                max( f.outer for f in followers ), max( f.failed for f in followers )
+            )
+        if reason:
+            process.kill()
+            break
+
+    process.wait()
+    reader.join()
+
+    if reason:
+        return False, reason, output
+
+    if process.returncode != 0:
+        return False, 'mf6 exited with code ' + str(process.returncode), output
+    if not any( normal_termination in line.lower() for line in output ):
+        return False, 'mf6 did not terminate normally', output
+
+    return True, '', output
@@ -0,0 +1,137 @@
+'''
+observations.py
+
+Output profiles of the simulations. Saving heads and budgets of
+every cell at every time step writes far more than the few
+locations looked at afterwards, so configure accepts a profile:
+
+    full: heads and budgets of all cells, every time step
+    last: heads and budgets of all cells, last time step
+          of each stress period
+    obs : no heads nor budgets files. Heads at the columns of
+          the wells and at monitoring points are written by an
+          OBS package, every time step, into head_file
+
+A location is a dict as defined in flopy_config.configure:
+
+    {
+        'id'    : 'P1',
+        'point' : shapely.geometry.Point(50, 50),
+        'layers': [0, 9],   # Optional, all layers if empty
+    }
+
+and its observations are named <id>_L<layer>, one based.
+'''
+
+import os
+import flopy
+import pandas as pd
+
+# Self
+import intersections
+
+
+# Save records of the output control by profile
+profiles = {
+        'full': [ ('HEAD', 'ALL') , ('BUDGET', 'ALL') ],
+        'last': [ ('HEAD', 'LAST'), ('BUDGET', 'LAST') ],
+        'obs' : [],
+    }
+
+# Continuous output of head observations. Without
+# model names, so the OBS file is shared by scenarios
+head_file = 'heads.obs.csv'
+
+
+
+def observation_name(location_id, layer):
+    '''
+    Name of the head observation of a location at
+    a layer, zero based. Upper case, as mf6 writes it
+    '''
+    return ( str(location_id) + '_L' + str(layer + 1) ).upper()
+
+
+
+def head_records(modelgrid, locations, cellids):
+    '''
+    Head observations of locations, at their layers
+
+    @params:
+        modelgrid (flopy.discretization.Grid): model grid
+        locations (list)                     : locations definition
+        cellids   (list)                     : cells of each location within a layer, see intersections.py
+
+    @return:
+        list of (name, 'HEAD', cellid)
+    '''
+    records = []
+    for location, cells in zip( locations, cellids ):
+        if not cells:
+            print('observations: location ' + str(location['id']) + ' outside the grid, not observed')
+            continue
+        layers = location.get('layers') or range( modelgrid.nlay )
+        for layer in layers:
+            records.append( ( observation_name( location['id'], layer ), 'HEAD', ( int(layer), ) + tuple( cells[0] ) ) )
+
+    return records
+
+
+
+def build(gwf, locations, intersections_file=None, **kwargs):
+    '''
+    Builds the OBS package of heads at locations
+
+    @params:
+        gwf                (flopy.mf6.ModflowGwf): groundwater flow model
+        locations          (list)                : locations definition
+        intersections_file (str)                 : intersections cache, see intersections.py
+        kwargs                                   : passed to flopy.mf6.ModflowUtlobs, e.g. filename
+
+    @return:
+        flopy.mf6.ModflowUtlobs
+    '''
+    cellids = intersections.intersect(
+            gwf.modelgrid,
+            [ location['point'] for location in locations ],
+            intersections_file
+        )
+
+    return flopy.mf6.ModflowUtlobs(
+            gwf,
+            digits=10,
+            continuous={ head_file: head_records( gwf.modelgrid, locations, cellids ) },
+            **kwargs
+        )
+
+
+
+def read(simulation_folder):
+    '''
+    Head observations of a run simulation
+
+    @return:
+        pandas.DataFrame, a column by observation, indexed
+        by simulation time. None if there are none
+    '''
+    file_path = os.path.join( simulation_folder, head_file )
+    if not os.path.exists( file_path ):
+        return None
+
+    observed         = pd.read_csv( file_path, index_col=0 )
+    observed.columns = observed.columns.str.upper()
+
+    return observed
+
+
+
+def column(observed, location_id, nlay):
+    '''
+    Observed heads at the column of a location, missing
+    layers are NaN
+
+    @return:
+        numpy.ndarray, shape (times, layers)
+    '''
+    names = [ observation_name( location_id, layer ) for layer in range( nlay ) ]
+    return observed.reindex( columns=names ).to_numpy( dtype=float )
@@ -0,0 +1,184 @@
+'''
+Extract results of completed simulations into a columnar store
+'''
+
+import os
+import sys
+import time
+import shutil
+import warnings
+import argparse
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Get directory of this file
+# and append parent to sys.path
+current = os.path.dirname(os.path.realpath(__file__))
+parent  = os.path.dirname(current)
+sys.path.append(parent)
+
+# Self
+from utils import scenarios
+import store
+import inputs
+import results
+import warmstart
+
+
+#################
+# Administrative
+import config
+base_dir = config.FOLDERS['base']
+
+runsdb = 'runs.sqlite' # Status store, see run.py
+
+############
+# Arguments
+parser = argparse.ArgumentParser( description='Extract results of completed scenarios of an experiment.' )
+parser.add_argument( '--experiment'   , type=str, help='name of the experiment to be post processed' )
+parser.add_argument( '--start'        , type=int, help='initial scenario position' )
+parser.add_argument( '--end'          , type=int, help='final scenario position, not included' )
+parser.add_argument( '--workers'      , type=int, default=1, help='number of scenarios extracted in parallel' )
+parser.add_argument( '--shard-size'   , type=int, default=results.shard_size, help='scenarios by shard of the store' )
+parser.add_argument( '--period-arrays', action='store_true', help='keep heads of all cells at the end of each stress period' )
+parser.add_argument( '--overwrite'    , action='store_true', help='rebuild the store, extracting all scenarios again' )
+args = parser.parse_args()
+
+
+
+def extract_scenario(experiment_folder, simulation_name, model_name, period_arrays=False):
+    '''
+    Extracts results of a single scenario, see results.extract.
+    Exceptions are caught and reported back to the caller
+
+    @return:
+        tuple (simulation name, results, error message),
+        results are None on failure
+    '''
+    try:
+        simulation_folder = os.path.join( experiment_folder, simulation_name )
+        extracted = results.extract(
+                simulation_folder, simulation_name, model_name,
+                inputs.modelgrid( simulation_folder, simulation_name, model_name ),
+                cache_file=os.path.join( experiment_folder, '.cache', 'intersections.pkl' ),
+                period_arrays=period_arrays,
+            )
+    except Exception:
+        return simulation_name, None, traceback.format_exc()
+
+    return simulation_name, extracted, ''
+
+
+
+def extract_scenarios(experiment_folder, pending, workers=1, period_arrays=False):
+    '''
+    Extracts results of scenarios, one after another or through
+    a pool of worker processes. At most twice workers scenarios
+    are extracted at the same time, so results are not held in
+    memory beyond those being written
+
+    @params:
+        experiment_folder (str) : path to the experiment folder
+        pending           (list): (simulation name, model name) of scenarios
+        workers           (int) : number of worker processes
+        period_arrays     (bool): keep heads of all cells at the end of each stress period
+
+    @return:
+        generator of (simulation name, results, error message)
+        as scenarios are extracted
+    '''
+    if workers <= 1:
+        for name, model_name in pending:
+            yield extract_scenario( experiment_folder, name, model_name, period_arrays=period_arrays )
+        return
+
+    pending = list( pending )
+    running = set()
+    with ProcessPoolExecutor( max_workers=workers ) as executor:
+        while pending or running:
+            while pending and ( len(running) < 2*workers ):
+                name, model_name = pending.pop(0)
+                running.add( executor.submit( extract_scenario, experiment_folder, name, model_name, period_arrays=period_arrays ) )
+            done, running = wait( running, return_when=FIRST_COMPLETED )
+            for future in done:
+                yield future.result()
+
+
+
+if __name__=='__main__':
+
+    #############
+    # Experiment
+    if args.experiment is None:
+        raise Exception('postprocess: --experiment was not defined')
+    experiment_folder = os.path.join( base_dir, args.experiment )
+    if not os.path.exists( experiment_folder ):
+        raise Exception('postprocess: experiment ' + args.experiment + ' does not exists in output path.')
+    if args.workers < 1:
+        raise Exception('postprocess: --workers should be at least 1')
+    if args.shard_size < 1:
+        raise Exception('postprocess: --shard-size should be at least 1')
+
+    store_file = os.path.join( experiment_folder, 'csv', runsdb )
+    if not os.path.exists( store_file ):
+        raise Exception('postprocess: no runs to post process, ' + store_file + ' not found')
+    runsdf = store.load( store_file )
+
+    # Scenarios, from scenarios.csv or from a
+    # lazy scenario space, see utils/scenarios.py
+    scenariosdf, space = scenarios.load( os.path.join( experiment_folder, 'csv' ), whole=True )
+    if space is not None:
+        scenariosdf = space.take( runsdf.index )
+    scenariosdf = scenariosdf.iloc[ args.start:args.end ]
+
+
+    ##############################
+    # Completed scenarios, skipping
+    # those extracted from the same outputs
+    results_folder = os.path.join( experiment_folder, 'results' )
+    if args.overwrite and os.path.exists( results_folder ):
+        shutil.rmtree( results_folder )
+    indexdf   = results.index( results_folder )
+    completed = runsdf.index[ runsdf['status'].isin( warmstart.completed_statuses ) ]
+    pending   = []
+    for index, sc in scenariosdf[ scenariosdf.index.isin( completed ) ].iterrows():
+        name = sc['simulation_name']
+        if ( name in indexdf.index ) and ( indexdf.loc[name, 'outputs'] == results.signature( os.path.join( experiment_folder, name ) ) ):
+            continue
+        pending.append( ( name, sc['model_name'] ) )
+
+    print(
+        'postprocess: ' + str(len(pending)) + ' scenarios to extract, ' +
+        str(len(completed) - len(pending)) + ' completed scenarios already in the store or out of range'
+    )
+
+
+    ##############################
+    # Extract, written by shards as
+    # scenarios are extracted
+    start_time = time.time()
+    names      = []
+    extracted  = []
+    failed     = 0
+    for name, result, error in extract_scenarios( experiment_folder, pending, args.workers, args.period_arrays ):
+        if result is None:
+            failed += 1
+            print('################ WARNING #################')
+            warnings.warn('postprocess: scenario ' + name + ' failed\n' + error)
+            continue
+        names.append( name )
+        extracted.append( result )
+        if len(names) >= args.shard_size:
+            results.write_shard( results_folder, names, extracted )
+            print('postprocess: ' + str(len(names)) + ' scenarios written to the store')
+            names, extracted = [], []
+
+    if names:
+        results.write_shard( results_folder, names, extracted )
+        print('postprocess: ' + str(len(names)) + ' scenarios written to the store')
+
+    print(
+        'postprocess: ' + str(len(pending) - failed) + ' extracted, ' + str(failed) + ' failed in ' +
+        '{:.1f} s, store at '.format( time.time() - start_time ) + results_folder
+    )
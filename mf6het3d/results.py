@@ -0,0 +1,385 @@
+'''
+results.py
+
+Columnar store of the results of an experiment, written by
+postprocess.py at <experiment>/results, so scenarios are compared
+without opening the binary output files of mf6 again:
+
+    index.csv      : a row per scenario, by simulation_name, with
+                     its shard and row, and scalar results, such
+                     as cumulative volumes of budget terms
+    shard_<n>.npz  : arrays of up to shard_size scenarios
+
+Outputs are streamed: heads are memory mapped, and only the cells
+of the well columns are read, full layers only for the heads of
+period_arrays. Budget records are read one at a time, skipping
+those not summarised. Time series of a shard are concatenated
+along the time steps of its scenarios, those of row i are
+offsets[i]:offsets[i + 1]:
+
+    simulation_name    (scenarios,)
+    offsets            (scenarios + 1,)
+    kper, kstp, totim  (steps,), one based
+    well_heads         (steps, wells, layers), heads at the columns of well_names
+    budget             (steps, terms, 2), rates in and out of budget_terms
+    observed           (steps, observations), heads of observation_names
+    period_heads       (scenarios, periods, cells), float32, heads at the last
+                       time step of each stress period, with period_arrays
+
+Steps not saved, as with the last or obs output profiles, see
+observations.py, are NaN.
+'''
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+# Self
+import inputs
+import adaptive
+import fingerprint
+import observations
+
+
+# Scenarios by shard
+shard_size = 32
+
+index_file    = 'index.csv'
+shard_pattern = re.compile( r'^shard_(\d+)\.npz$' )
+
+# Budget records not summarised, flows between
+# cells and specific discharges are not budget terms
+skipped_terms = ( 'FLOW-JA-FACE', 'DATA-SPDIS', 'DATA-SAT' )
+
+# Headers of budget file records, as written by mf6
+budget_header = np.dtype([
+        ( 'kstp' , '<i4' ),
+        ( 'kper' , '<i4' ),
+        ( 'text' , 'S16' ),
+        ( 'ndim1', '<i4' ),
+        ( 'ndim2', '<i4' ),
+        ( 'ndim3', '<i4' ),
+    ])
+budget_times = np.dtype([
+        ( 'imeth' , '<i4' ),
+        ( 'delt'  , '<f8' ),
+        ( 'pertim', '<f8' ),
+        ( 'totim' , '<f8' ),
+    ])
+list_names   = np.dtype( 'S64' ) # txt1id1, txt1id2, txt2id1, txt2id2
+
+
+
+def head_records(head_file):
+    '''
+    Records of a heads file, memory mapped. mf6 writes a record
+    by layer, all of the same size
+
+    @return:
+        numpy.memmap with the fields of inputs.array_header
+        and data, the heads of a layer
+    '''
+    header = np.fromfile( head_file, dtype=inputs.array_header, count=1 )
+    if not len(header):
+        return np.zeros( 0, dtype=inputs.array_header )
+    cells  = int( header['ncol'][0] )*int( header['nrow'][0] )
+    record = np.dtype( inputs.array_header.descr + [ ( 'data', '<f8', ( cells, ) ) ] )
+
+    return np.memmap( head_file, dtype=record, mode='r' )
+
+
+
+def budget_records(budget_file):
+    '''
+    Records of a budget file, one at a time. Data of records
+    in skipped_terms is not read
+
+    @return:
+        generator of (kper, kstp, text, flows), flows is None
+        for skipped records
+    '''
+    with open( budget_file, 'rb' ) as f:
+        while True:
+            header = np.fromfile( f, dtype=budget_header, count=1 )
+            if not len(header):
+                return
+            header = header[0]
+            times  = np.fromfile( f, dtype=budget_times, count=1 )[0]
+            text   = header['text'].decode().strip()
+            if times['imeth'] == 1:
+                count = int( header['ndim1'] )*int( header['ndim2'] )*abs( int( header['ndim3'] ) )
+                if text in skipped_terms:
+                    f.seek( 8*count, os.SEEK_CUR )
+                    flows = None
+                else:
+                    flows = np.fromfile( f, dtype='<f8', count=count )
+            elif times['imeth'] == 6:
+                np.fromfile( f, dtype=list_names, count=1 )
+                ndat  = int( np.fromfile( f, dtype='<i4', count=1 )[0] )
+                f.seek( 16*( ndat - 1 ), os.SEEK_CUR )
+                nlist = int( np.fromfile( f, dtype='<i4', count=1 )[0] )
+                entry = np.dtype([ ( 'id1', '<i4' ), ( 'id2', '<i4' ), ( 'q', '<f8' ), ( 'aux', '<f8', ( ndat - 1, ) ) ])
+                if text in skipped_terms:
+                    f.seek( entry.itemsize*nlist, os.SEEK_CUR )
+                    flows = None
+                else:
+                    flows = np.fromfile( f, dtype=entry, count=nlist )['q']
+            else:
+                raise Exception('results: budget records of method ' + str(times['imeth']) + ' not implemented.')
+            yield int( header['kper'] ), int( header['kstp'] ), text, flows
+
+
+
+def extract(simulation_folder, simulation_name, model_name, modelgrid, cache_file=None, period_arrays=False):
+    '''
+    Results of a completed scenario, from whatever outputs
+    it saved, see module description
+
+    @params:
+        simulation_folder (str)                      : simulation folder
+        simulation_name   (str)                      : name of the simulation
+        model_name        (str)                      : name of the gwf model
+        modelgrid         (flopy.discretization.Grid): model grid
+        cache_file        (str)                      : intersections cache, see intersections.py
+        period_arrays     (bool)                     : keep heads of all cells at the end of each stress period
+
+    @return:
+        dict of arrays and names, and 'scalars', a dict of
+        scalar results by name
+    '''
+    kper, kstp, delt, totim = inputs.time_steps( simulation_folder )
+    steps  = { ( p, s ): i for i, ( p, s ) in enumerate( zip( kper, kstp ) ) }
+    nper   = int( kper.max() )
+    ncpl   = modelgrid.ncpl
+    nlay   = modelgrid.nlay
+    cells  = adaptive.well_cells( modelgrid, cache_file )
+    last   = { p: max( i for ( q, _ ), i in steps.items() if q == p ) for p in range( 1, nper + 1 ) }
+    result = {
+            'kper'            : kper,
+            'kstp'            : kstp,
+            'totim'           : totim,
+            'well_names'      : np.array( list( cells ) ),
+            'well_heads'      : np.full( ( len(kper), len(cells), nlay ), np.nan ),
+            'budget_terms'    : np.array( [], dtype=str ),
+            'budget'          : np.full( ( len(kper), 0, 2 ), np.nan ),
+            'observation_names': np.array( [], dtype=str ),
+            'observed'        : np.full( ( len(kper), 0 ), np.nan ),
+        }
+    if period_arrays:
+        result['period_heads'] = np.full( ( nper, nlay*ncpl ), np.nan, dtype=np.float32 )
+    scalars = {}
+
+    # Heads, a record by layer
+    head_file = os.path.join( simulation_folder, model_name + '.hds' )
+    if os.path.exists( head_file ):
+        records = head_records( head_file )
+        rows    = np.array([ steps.get( ( int(p), int(s) ), -1 ) for p, s in zip( records['kper'], records['kstp'] ) ])
+        layers  = records['ilay'] - 1
+        valid   = rows >= 0
+        for iw, cell in enumerate( cells.values() ):
+            if cell is not None:
+                result['well_heads'][ rows[valid], iw, layers[valid] ] = records['data'][ valid, cell ]
+        if period_arrays:
+            for p, i in last.items():
+                for r in np.flatnonzero( rows == i ):
+                    result['period_heads'][ p - 1, layers[r]*ncpl:( layers[r] + 1 )*ncpl ] = records['data'][r]
+        scalars['head_steps'] = len( np.unique( rows[valid] ) )
+        del records
+
+    # Budget rates, in and out, by term
+    budget_file = os.path.join( simulation_folder, model_name + '.bud' )
+    if os.path.exists( budget_file ):
+        terms = {}
+        for p, s, text, flows in budget_records( budget_file ):
+            i = steps.get( ( p, s ) )
+            if ( flows is None ) or ( i is None ):
+                continue
+            if text not in terms:
+                terms[text] = np.full( ( len(kper), 2 ), np.nan )
+            rates = terms[text][i]
+            rates[:] = np.nan_to_num( rates ) + [ flows[ flows > 0 ].sum(), -flows[ flows < 0 ].sum() ]
+        if terms:
+            result['budget_terms'] = np.array( list( terms ) )
+            result['budget']       = np.stack( list( terms.values() ), axis=1 )
+            saved                  = ~np.isnan( result['budget'][:, 0, 0] )
+            scalars['budget_steps'] = int( saved.sum() )
+            # Cumulative volumes, only if every time step was saved
+            for t, text in enumerate( terms ):
+                for k, direction in enumerate( [ 'IN', 'OUT' ] ):
+                    scalars[ text + '_' + direction ] = ( delt*result['budget'][:, t, k] ).sum() if saved.all() else np.nan
+
+    # Observations, matched to time steps by time
+    observed = observations.read( simulation_folder )
+    if observed is not None:
+        times = observed.index.to_numpy( dtype=float )
+        rows  = np.abs( totim[np.newaxis] - times[:, np.newaxis] ).argmin( axis=1 )
+        valid = np.isclose( totim[rows], times, rtol=1e-6 )
+        result['observation_names'] = observed.columns.to_numpy( dtype=str )
+        result['observed']          = np.full( ( len(kper), observed.shape[1] ), np.nan )
+        result['observed'][ rows[valid] ] = observed.to_numpy( dtype=float )[valid]
+
+    scalars['time_steps'] = len(kper)
+    scalars['outputs']    = signature( simulation_folder )
+    result['scalars']     = scalars
+
+    return result
+
+
+
+def signature(simulation_folder):
+    '''
+    Identifies the output files of a simulation as written, by
+    their sizes and modification times, so results are extracted
+    again once the scenario is run again
+    '''
+    files = sorted( fingerprint.output_files( simulation_folder ) )
+    stats = [ os.stat( os.path.join( simulation_folder, f ) ) for f in files ]
+
+    return ';'.join( f + ':' + str(s.st_size) + ':' + str(s.st_mtime_ns) for f, s in zip( files, stats ) )
+
+
+
+def union(names_list):
+    '''
+    Names in order of appearance among several lists
+    '''
+    return list( dict.fromkeys( n for names in names_list for n in names ) )
+
+
+
+def align(values, names, all_names, axis):
+    '''
+    Values of names placed at the position of all_names
+    along axis, NaN where missing
+    '''
+    shape       = list( values.shape )
+    shape[axis] = len(all_names)
+    aligned     = np.full( shape, np.nan )
+    position    = [ all_names.index(n) for n in names ]
+    index       = [ slice(None) ]*len(shape)
+    index[axis] = position
+    aligned[ tuple(index) ] = values
+
+    return aligned
+
+
+
+def write_shard(results_folder, names, extracted):
+    '''
+    Writes extracted results of several scenarios as a
+    new shard, and registers them at the index. Previous
+    results of the same scenarios are superseded, shards
+    left without scenarios are removed
+
+    @params:
+        results_folder (str) : results folder of the experiment
+        names          (list): simulation names
+        extracted      (list): results of each scenario, see extract
+    '''
+    os.makedirs( results_folder, exist_ok=True )
+    numbers = [ int( m.group(1) ) for m in map( shard_pattern.match, os.listdir( results_folder ) ) if m ]
+    shard   = 'shard_' + str( max( numbers, default=-1 ) + 1 ).zfill(5) + '.npz'
+
+    terms    = union([ e['budget_terms'] for e in extracted ])
+    observed = union([ e['observation_names'] for e in extracted ])
+    lengths  = [ len( e['kper'] ) for e in extracted ]
+    arrays   = {
+            'simulation_name'  : np.array( names ),
+            'offsets'          : np.concatenate([ [0], np.cumsum( lengths ) ]),
+            'kper'             : np.concatenate([ e['kper'] for e in extracted ]),
+            'kstp'             : np.concatenate([ e['kstp'] for e in extracted ]),
+            'totim'            : np.concatenate([ e['totim'] for e in extracted ]),
+            'well_names'       : extracted[0]['well_names'],
+            'well_heads'       : np.concatenate([ e['well_heads'] for e in extracted ]),
+            'budget_terms'     : np.array( terms, dtype=str ),
+            'budget'           : np.concatenate([ align( e['budget'], list( e['budget_terms'] ), terms, 1 ) for e in extracted ]),
+            'observation_names': np.array( observed, dtype=str ),
+            'observed'         : np.concatenate([
+                    align( e['observed'], list( e['observation_names'] ), observed, 1 ) for e in extracted
+                ]),
+        }
+    if all( 'period_heads' in e for e in extracted ):
+        nper = max( len( e['period_heads'] ) for e in extracted )
+        arrays['period_heads'] = np.stack([
+                np.pad( e['period_heads'], ( ( 0, nper - len( e['period_heads'] ) ), ( 0, 0 ) ), constant_values=np.nan )
+                for e in extracted
+            ])
+
+    # Written aside, never seen partially written
+    temporary = os.path.join( results_folder, shard + '.' + str(os.getpid()) + '.tmp.npz' )
+    np.savez( temporary, **arrays )
+    os.replace( temporary, os.path.join( results_folder, shard ) )
+
+    rows = pd.DataFrame([ e['scalars'] for e in extracted ], index=pd.Index( names, name='simulation_name' ))
+    rows.insert( 0, 'row', np.arange( len(names) ) )
+    rows.insert( 0, 'shard', shard )
+    indexdf = index( results_folder )
+    indexdf = pd.concat([ indexdf[ ~indexdf.index.isin( rows.index ) ], rows ])
+    temporary = os.path.join( results_folder, index_file + '.' + str(os.getpid()) + '.tmp' )
+    indexdf.to_csv( temporary )
+    os.replace( temporary, os.path.join( results_folder, index_file ) )
+
+    # Shards fully superseded
+    for f in os.listdir( results_folder ):
+        if shard_pattern.match( f ) and ( f not in set( indexdf['shard'] ) ):
+            os.remove( os.path.join( results_folder, f ) )
+
+
+
+def index(results_folder):
+    '''
+    Scenarios of the store, with scalar results
+
+    @return:
+        pandas.DataFrame indexed by simulation_name, empty
+        if there is no store
+    '''
+    file_path = os.path.join( results_folder, index_file )
+    if not os.path.exists( file_path ):
+        return pd.DataFrame( columns=[ 'shard', 'row' ], index=pd.Index( [], name='simulation_name' ) )
+
+    return pd.read_csv( file_path, index_col=0 )
+
+
+
+def load(results_folder, simulation_names=None, keys=None):
+    '''
+    Results of scenarios, reading each shard they are at once
+
+    @params:
+        results_folder   (str) : results folder of the experiment
+        simulation_names (list): scenarios, all if None
+        keys             (list): arrays to load, e.g. ['totim', 'budget'], all if None
+
+    @return:
+        dict of results by simulation name, each a dict of
+        arrays by key, time series sliced to the scenario
+    '''
+    indexdf = index( results_folder )
+    if simulation_names is not None:
+        missing = [ n for n in simulation_names if n not in indexdf.index ]
+        if missing:
+            raise Exception('results: scenarios ' + ', '.join( missing ) + ' not found at ' + results_folder)
+        indexdf = indexdf.loc[ simulation_names ]
+
+    loaded = {}
+    for shard, rows in indexdf.groupby( 'shard', sort=False ):
+        with np.load( os.path.join( results_folder, shard ) ) as data:
+            offsets = data['offsets']
+            names   = [ k for k in data.files if ( k not in ( 'simulation_name', 'offsets' ) ) and ( ( keys is None ) or ( k in keys ) ) ]
+            arrays  = { k: data[k] for k in names }
+            for name, row in rows['row'].items():
+                scenario = {}
+                for k, a in arrays.items():
+                    if k.endswith( '_names' ) or k.endswith( '_terms' ):
+                        scenario[k] = a
+                    elif k == 'period_heads':
+                        scenario[k] = a[row]
+                    else:
+                        scenario[k] = a[ offsets[row]:offsets[row + 1] ]
+                loaded[name] = scenario
+
+    if simulation_names is not None:
+        return { n: loaded[n] for n in simulation_names }
+    return loaded
@@ -4,14 +4,37 @@ Execute simulations
 
 import os
 import sys
-import flopy
-import pandas as pd
-import numpy as np
+import json
+import time
+import socket
+import warnings
 import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Get directory of this file
+# and append parent to sys.path
+current = os.path.dirname(os.path.realpath(__file__))
+parent  = os.path.dirname(current)
+sys.path.append(parent)
+
+# Self
+from utils import scenarios
+import store
+import budget
+import inputs
+import adaptive
+import leases
+import schedule
+import xmi
+import monitor
+import warmstart
+import fingerprint
 
 
 #################
-# Administrative 
+# Administrative
 import config
 base_dir = config.FOLDERS['base']
 
@@ -25,154 +48,749 @@ except Exception as e:
 
 # To config?
 runscsv               = 'runs.csv'
+runsdb                = 'runs.sqlite' # Status store, runs.csv is exported from it
 discrepancy_threshold = 1 # Percentage
+stale_hours           = 24 # Running scenarios from other hosts are requeued after, see --stale-hours
+shared_store          = True # Distributed processes keep statuses at their done markers instead, see leases.py
 
 ############
-# Arguments 
+# Arguments
 parser = argparse.ArgumentParser( description='Execute simulations scenarios for a given experiment.' )
 parser.add_argument( '--experiment', type=str, help='name of the experiment to be run' )
 parser.add_argument( '--start'     , type=int, help='intial experiment index' )
 parser.add_argument( '--end'       , type=int, help='final experiment index', )
 parser.add_argument( '--run'       , action='store_true', help='run it' )
 parser.add_argument( '--clean'     , action='store_true', help='forces restarting output runs.csv' )
+parser.add_argument( '--export'    , action='store_true', help='export runs status into runs.csv and compact the status store' )
+parser.add_argument( '--workers'   , type=int, default=1, help='number of simulations executed in parallel' )
+parser.add_argument( '--duplicates', action='store_true', help='run scenarios with the same model as another, instead of linking results' )
+parser.add_argument( '--resume'    , action='store_true', help='skip scenarios already run with the same inputs, requeue stale running ones' )
+parser.add_argument( '--stale-hours', type=float, default=stale_hours, help='hours after which running scenarios of other hosts are requeued' )
+parser.add_argument( '--warm-start', action='store_true', help='start from the heads of the closest completed scenario' )
+parser.add_argument( '--in-order'  , action='store_true', help='dispatch scenarios to workers in order, instead of longest predicted first' )
+parser.add_argument( '--distributed', action='store_true', help='claim scenarios through lease files, so processes on several hosts share the experiment' )
+parser.add_argument( '--lease-seconds', type=float, default=leases.lease_seconds, help='seconds without heartbeat after which a claimed scenario is reclaimed' )
+parser.add_argument( '--adaptive'  , action='store_true', help='run in batches until outputs statistics stabilise' )
+parser.add_argument( '--batch'     , type=int, default=8, help='scenarios per batch of an adaptive run' )
+parser.add_argument( '--tolerance' , type=float, default=0.01, help='relative tolerance of outputs statistics of an adaptive run' )
+parser.add_argument( '--focus'     , action='store_true', help='batches of an adaptive run focus where outputs change the most' )
+parser.add_argument( '--backend'   , type=str, default='process', choices=['process', 'libmf6'], help='execute mf6 as a process, or in-process through libmf6' )
+parser.add_argument( '--max-wall-time', type=float, help='seconds a scenario might run before being killed' )
+parser.add_argument( '--max-step-time', type=float, help='seconds a scenario might spend in a time step before being killed' )
+parser.add_argument( '--max-outer-iterations', type=int, help='outer iterations of all time steps of a scenario before being killed' )
+parser.add_argument( '--max-failed-steps', type=int, help='time steps failing to converge before a scenario is killed' )
+parser.add_argument( '--outputs'   , type=str, nargs='+', choices=adaptive.output_names, default=adaptive.output_names, help='outputs tracked by an adaptive run' )
 args = parser.parse_args()
 
 
-#############
-# Experiment 
-if args.experiment is None:
-    raise Exception('run: --experiment was not defined')
-experiment_name   = args.experiment
-experiment_folder = os.path.join(base_dir, experiment_name)  
-if not os.path.exists(experiment_folder):
-    raise Exception('run: experiment ' + experiment_name + ' does not exists in output path.')
-
-# Import scenarios
-if not os.path.exists(os.path.join(experiment_folder, 'csv', 'scenarios.csv')):
-    raise Exception('run: experiment ' + experiment_name + ' does without scenarios defined.')
-scenariosdf = pd.read_csv(os.path.join(experiment_folder, 'csv', 'scenarios.csv'), index_col=0)
-
-
-# Determine indexes
-indexes = None
-if args.start and args.end:
-    indexes = np.arange(int(args.start), int(args.end), 1 ).astype(np.int32)
-elif args.start:
-    indexes = np.arange(int(args.start), len( SCENARIOS ), 1 ).astype(np.int32)
-elif args.end:
-    indexes = np.arange(0, int(args.end), 1 ).astype(np.int32)
-else:
-    indexes = None
-
-
-# RUN
-run_simulation = False
-if args.run:
-    run_simulation = True
-else:
-    print('run: not running. Force execution with --run')
-    sys.exit()
-
-
-# Import scenarios
-if ( not os.path.exists(os.path.join(experiment_folder, 'csv', runscsv)) ) or ( args.clean ):
-    # Initialize runsdf from sceanriosdf with status column pending
-    runsdf           = scenariosdf.copy()
-    runsdf['status'] = 'pending'
-    runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
-else:
-    # Load runs
-    runsdf = pd.read_csv(os.path.join(experiment_folder, 'csv', runscsv), index_col=0)
-
-if indexes is None:
-    if run_simulation:
-        for index, sc in scenariosdf.iterrows():
-       
-            # Load simulation 
-            simulation_folder = os.path.join(experiment_folder, sc['simulation_name']) 
-            sim = flopy.mf6.MFSimulation.load(sim_ws=simulation_folder, sim_name=sc['simulation_name'], exe_name=config.exe_name)
-            
-            # Report status as running
-            runsdf.loc[index,'status'] = 'running'
-            runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
-
-            # Execute 
-            success, mf6_output = sim.run_simulation(pause=False, report=True)
-
-
-
-            if not success:
-
-                print('################ WARNING #################')
-                warnings.warn('MF6 did not terminate normally for simulation ' + sc['simulation_name'])
-
-                # Report status failed
-                runsdf.loc[index,'status'] = 'failed'
-                runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
 
+def run_scenario(
+        experiment_folder, index, simulation_name, model_name, silent=False, warm_start=None, outputs=False, budgets={}, 
+        backend='process'
+    ):
+    '''
+    Executes a single scenario and verifies its budget discrepancy.
+    mf6 is monitored while it runs and killed once it exceeds any
+    of budgets, see monitor.py. With the libmf6 backend, mf6 runs
+    in a process spawned for the scenario and outputs are read
+    from its memory instead, see xmi.py. With warm_start, the scenario starts from the heads
+    of another one, without modifying its written files, see
+    warmstart.py
+
+    It does not modify runs.csv, so it can be safely executed
+    by worker processes. Status is returned to the caller, which
+    is the only one writing runs.csv.
+
+    @params:
+        experiment_folder (str): path to the experiment folder
+        index             (int): scenario index
+        simulation_name   (str): name of the simulation
+        model_name        (str): name of the gwf model
+        silent           (bool): do not print mf6 output
+        warm_start      (tuple): (simulation name, heads file) of the scenario
+                                 whose heads are the starting heads
+        outputs          (bool): compute named outputs, see adaptive.py
+        budgets          (dict): execution budgets, see monitor.py
+        backend           (str): 'process' or 'libmf6', see xmi.py
+
+    @return:
+        tuple (index, status, fields), status is one of 'failed', 'alert' or 'success',
+        fields are solver iterations, execution time, warm start source, outputs
+        and the reason of a failure, to be saved as runs fields
+    '''
+
+    # Run from written files, 
+    # without loading the simulation
+    simulation_folder = os.path.join(experiment_folder, simulation_name)
+    fingerprint.remove_outputs(simulation_folder)
+
+    # Warm started when written, 
+    # see flopy_config.py
+    fields = { 'warm_start_from': '', 'failure_reason': '', 'period_discrepancies': '' }
+    marker = os.path.join(simulation_folder, 'flopy_config.json')
+    if os.path.exists(marker):
+        with open(marker) as f:
+            fields['warm_start_from'] = json.load(f).get('warm_start', '')
+
+    # Execute, timing mf6 for 
+    # scheduling, see schedule.py
+    backups = []
+    try:
+        if warm_start is not None:
+            backups = warmstart.apply(simulation_folder, model_name, warm_start[1])
+            fields['warm_start_from'] = warm_start[0]
+        start_time = time.time()
+        if backend == 'libmf6':
+            success, fields['failure_reason'], values = xmi.run(
+                    simulation_folder, simulation_name, model_name, config.lib_name, outputs=outputs, 
+                    cache_file=os.path.join(experiment_folder, '.cache', 'intersections.pkl'), silent=silent, **budgets
+                )
+        else:
+            success, fields['failure_reason'], mf6_output = monitor.run(
+                    simulation_folder, config.exe_name, model_name=model_name, silent=silent, **budgets
+                )
+        fields['run_time'] = time.time() - start_time
+    finally:
+        warmstart.restore(backups)
+
+    fields['outer_iterations'], fields['inner_iterations'] = warmstart.iterations(simulation_folder, model_name)
+
+    if not success:
+        print('################ WARNING #################')
+        warnings.warn('MF6 did not terminate normally for simulation ' + simulation_name + ', ' + fields['failure_reason'])
+        return index, 'failed', fields
+
+    # Check convergence threshold for all stress periods,
+    # scanning budget summaries of the lst file, see budget.py
+    list_file = os.path.join(simulation_folder, model_name+'.lst')
+
+    if outputs and ( backend == 'libmf6' ):
+        fields.update(values)
+    elif outputs:
+        fields.update(
+            adaptive.outputs(
+                simulation_folder, model_name, inputs.modelgrid(simulation_folder, simulation_name, model_name), list_file,
+                os.path.join(experiment_folder, '.cache', 'intersections.pkl')
+            )
+        )
+
+    # If all balances are less than N% discrepant, pass
+    passed, violation = budget.check_discrepancy(list_file, discrepancy_threshold)
+    if not passed:
+        fields['period_discrepancies'] = json.dumps( budget.period_discrepancies(list_file).tolist() )
+        print(
+            'run: scenario ' + str(index) + ' budget discrepancy of ' + str(max(violation[2:])) + ' % at time step ' + 
+            str(violation[0]) + ' of stress period ' + str(violation[1]) + ', by stress period ' + fields['period_discrepancies']
+        )
+        return index, 'alert', fields
+
+    return index, 'success', fields
+
+
+
+def save_fields(runsdf, updates):
+    '''
+    Updates fields of several scenarios, in runsdf
+    and in the status store, see store.py, unless
+    distributed
+
+    @params:
+        runsdf  (pandas.DataFrame): runs status
+        updates (dict)            : dict of fields (dict) by scenario index
+    '''
+    for index, fields in updates.items():
+        for field, value in fields.items():
+            runsdf.loc[index,field] = value
+    if shared_store:
+        store.update_many(os.path.join(experiment_folder, 'csv', runsdb), updates)
+
+
+
+def report_status(runsdf, index, status, **fields):
+    '''
+    Updates the status of a scenario, and any other given field
+    '''
+    save_fields(runsdf, { index: dict(status=status, **fields) })
+
+
+
+def report_running(runsdf, index):
+    '''
+    Reports a scenario as running by this process, 
+    so stale entries can be detected, see is_stale
+    '''
+    report_status(runsdf, index, 'running', host=socket.gethostname(), pid=os.getpid(), started=time.time())
+
+
+
+def compute_fingerprints(runsdf, scenariosdf, indexes):
+    '''
+    Fingerprints scenarios input files, see fingerprint.py,
+    and saves them as runs field fingerprint
+    '''
+    updates = {}
+    for index in indexes:
+        sc = scenariosdf.loc[index]
+        updates[index] = { 
+            'fingerprint': fingerprint.compute(
+                os.path.join(experiment_folder, sc['simulation_name']), sc['simulation_name'], sc['model_name']
+            )
+        }
+    save_fields(runsdf, updates)
+
+
+
+def find_duplicates(runsdf, scenariosdf, indexes):
+    '''
+    Groups fingerprinted scenarios producing the same model. 
+    First scenario of each group is the one to be executed.
+    duplicate_of (simulation name of the executed scenario) 
+    is saved as a runs field
+
+    @params:
+        runsdf      (pandas.DataFrame): runs status
+        scenariosdf (pandas.DataFrame): scenarios
+        indexes     (list)            : scenario indexes
+
+    @return:
+        tuple (list of indexes to be executed, 
+               dict of duplicated indexes by executed index)
+    '''
+    executed   = []
+    duplicates = {}
+    updates    = {}
+    by_fingerprint = {}
+    for index in indexes:
+        fp = runsdf.loc[index,'fingerprint']
+        if fp in by_fingerprint:
+            duplicates[ by_fingerprint[fp] ].append(index)
+            updates[index] = { 'duplicate_of': scenariosdf.loc[ by_fingerprint[fp], 'simulation_name' ] }
+        else:
+            by_fingerprint[fp] = index
+            duplicates[index]  = []
+            executed.append(index)
+            updates[index] = { 'duplicate_of': '' }
+    save_fields(runsdf, updates)
+
+    return executed, duplicates
+
+
+
+def is_stale(run, stale_hours=stale_hours):
+    '''
+    Verifies if a scenario reported as running is not being executed
+    anymore. On the same host, its process should be alive. Otherwise,
+    it should have started less than stale_hours ago. Without pid or
+    start time, as those imported from a previous runs.csv, nothing
+    tells it is alive, so it is stale
+
+    @params:
+        run         (pandas.Series): row of runs.csv
+        stale_hours (float)        : hours after which running scenarios of other hosts are stale
+
+    @return:
+        bool
+    '''
+    pid     = pd.to_numeric(run['pid'], errors='coerce')
+    started = pd.to_numeric(run['started'], errors='coerce')
+    if pd.isna(pid) or pd.isna(started) or ( not run['host'] ):
+        return True
+
+    if ( run['host'] == socket.gethostname() ) and ( os.name == 'posix' ):
+        pid = int(pid)
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    return ( time.time() - float(started) ) > stale_hours*3600
+
+
+
+def select_resumable(runsdf, indexes, duplicates={}, stale_hours=stale_hours):
+    '''
+    Selects scenarios to be executed when resuming an experiment.
+    Skips a scenario, with its duplicates, if all of them succeeded
+    with the same inputs they have now, or if it is being executed
+    by a live process. Stale running scenarios are requeued.
+
+    @params:
+        runsdf     (pandas.DataFrame): runs status, with fingerprints
+        indexes    (list)            : scenario indexes to be executed
+        duplicates (dict)            : duplicated indexes by executed index
+        stale_hours (float)          : hours after which running scenarios of other hosts are requeued
+
+    @return:
+        list of indexes to be executed
+    '''
+    selected  = []
+    up_to_date, running, requeued = 0, 0, 0
+    for index in indexes:
+        runs = runsdf.loc[ [index] + duplicates.get(index, []) ]
+        if ( ( runs['status'] == 'success' ) & ( runs['run_fingerprint'] == runs['fingerprint'] ) ).all():
+            up_to_date += 1
+            continue
+        if runsdf.loc[index,'status'] == 'running':
+            if not is_stale( runsdf.loc[index], stale_hours ):
+                running += 1
                 continue
-
-            # Check convergence threshold for all stress periods
-            # Load lst file
-            mf_list_file  = flopy.utils.Mf6ListBudget( os.path.join(experiment_folder, sc['simulation_name'], sc['model_name']+'.lst') )
-            dfflux, dfvol = mf_list_file.get_dataframes()
-            
-            # If all balances are less than N% discrepant, pass
-            if (
-                ( not np.all( dfvol['PERCENT_DISCREPANCY'].to_numpy() < discrepancy_threshold ) ) or
-                ( not np.all( dfflux['PERCENT_DISCREPANCY'].to_numpy() < discrepancy_threshold ) )
-            ):
-                # Report status alert
-                runsdf.loc[index,'status'] = 'alert'
-                runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
-            else:
-                # Report status success
-                runsdf.loc[index,'status'] = 'success'
-                runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
-
-else:
-    if run_simulation:
+            requeued += 1
+        selected.append(index)
+
+    print(
+        'run: resuming, ' + str(up_to_date) + ' up to date, ' + str(running) + ' running, ' + 
+        str(requeued) + ' stale requeued, ' + str(len(selected)) + ' to be executed'
+    )
+
+    return selected
+
+
+
+def run_identity(runsdf, index):
+    '''
+    Fields telling which inputs a scenario was executed with,
+    and which scenario it shares outputs with
+    '''
+    return {
+            'fingerprint'    : runsdf.loc[index,'fingerprint'],
+            'run_fingerprint': runsdf.loc[index,'fingerprint'],
+            'duplicate_of'   : runsdf.loc[index,'duplicate_of'],
+        }
+
+
+
+def finish_scenario(runsdf, scenariosdf, index, status, duplicates, fields={}):
+    '''
+    Reports the status of an executed scenario, with fields 
+    returned by run_scenario, and links its outputs into the 
+    folders of its duplicates.
+
+    Warm started scenarios report the iterations saved with 
+    respect to the closest cold started one, see warmstart.py
+
+    @return:
+        dict of reported fields (dict) by scenario index
+    '''
+    fields = dict(fields)
+    if fields.get('warm_start_from'):
+        outer, inner = warmstart.baseline(runsdf, scenariosdf, index)
+        fields['outer_iterations_saved'] = outer - fields['outer_iterations']
+        fields['inner_iterations_saved'] = inner - fields['inner_iterations']
+        if np.isnan(outer):
+            saving = 'no cold started run to compare with'
+        else:
+            saving = (
+                '{:.0f}'.format(fields['outer_iterations_saved']) + ' outer and ' + 
+                '{:.0f}'.format(fields['inner_iterations_saved']) + ' inner iterations saved'
+            )
+        print('run: scenario ' + str(index) + ' warm started from ' + fields['warm_start_from'] + ', ' + saving)
+    updates = { index: dict(status=status, **run_identity(runsdf, index), **fields) }
+    sc      = scenariosdf.loc[index]
+    for duplicate in duplicates.get(index, []):
+        dsc = scenariosdf.loc[duplicate]
+        fingerprint.link_outputs(
+                os.path.join(experiment_folder, sc['simulation_name']), 
+                (sc['simulation_name'], sc['model_name']),
+                os.path.join(experiment_folder, dsc['simulation_name']), 
+                (dsc['simulation_name'], dsc['model_name'])
+            )
+        updates[duplicate] = dict(status=status, **run_identity(runsdf, duplicate), **fields)
+    save_fields(runsdf, updates)
+
+    return updates
+
+
+
+def select_warm_start(runsdf, scenariosdf, index):
+    '''
+    Scenario whose heads are the starting heads of another, 
+    the closest completed one with a heads file
+
+    @return:
+        tuple (simulation name, heads file), None if there is none
+    '''
+    completed = [
+            i for i in runsdf.index[ runsdf['status'].isin(warmstart.completed_statuses) ]
+            if ( i in scenariosdf.index ) and os.path.exists( warmstart.heads_file(experiment_folder, scenariosdf.loc[i]) )
+        ]
+    source = warmstart.nearest(scenariosdf, index, completed)
+    if source is None:
+        return None
+    return scenariosdf.loc[source, 'simulation_name'], warmstart.heads_file(experiment_folder, scenariosdf.loc[source])
+
+
+
+def run_scenarios(
+        runsdf, scenariosdf, indexes, workers=1, duplicates={}, warm_start=False, outputs=False, budgets={}, 
+        longest_first=True, holder=None, backend='process'
+    ):
+    '''
+    Executes scenarios given by indexes, one after another
+    or through a pool of worker processes.
+
+    In parallel mode, at most workers scenarios are dispatched
+    at the same time, so a 'running' status always
+    corresponds to a simulation in execution. Statuses are
+    reported as simulations finish, in whatever order that is.
+    Scenarios are dispatched longest predicted first, unless
+    longest_first is False, see schedule.py. With a lease holder, 
+    only scenarios it claims are executed, see leases.py
+
+    @params:
+        runsdf      (pandas.DataFrame): runs status
+        scenariosdf (pandas.DataFrame): scenarios
+        indexes     (list)            : scenario indexes to be executed
+        workers     (int)             : number of worker processes
+        duplicates  (dict)            : duplicated indexes by executed index
+        warm_start  (bool)            : start from the closest completed scenario
+        outputs     (bool)            : compute named outputs, see adaptive.py
+        budgets     (dict)            : execution budgets, see monitor.py
+        longest_first (bool)          : dispatch longest predicted first, with workers
+        holder      (leases.Holder)   : claims scenarios shared with other processes
+        backend     (str)             : 'process' or 'libmf6', see xmi.py
+    '''
+
+    if workers <= 1:
         for index in indexes:
-            sc = scenariosdf.iloc[index]
-        
-            # Load simulation
-            simulation_folder = os.path.join(experiment_folder, sc['simulation_name']) 
-            sim = flopy.mf6.MFSimulation.load(sim_ws=simulation_folder, sim_name=sc['simulation_name'], exe_name=config.exe_name)
-            
-            # Report status as running
-            runsdf.loc[index,'status'] = 'running'
-            runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
-
-            # Execute
-            success, mf6_output = sim.run_simulation(pause=False, report=True)
-
-            if not success:
-                print('################ WARNING #################')
-                warnings.warn('MF6 did not terminate normally for simulation ' + sc['simulation_name'])
-
-                # Report status failed
-                runsdf.loc[index,'status'] = 'failed'
-                runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
-
+            if ( holder is not None ) and ( not holder.claim(index) ):
                 continue
-
-            # Check convergence threshold for all stress periods
-            # Load lst file
-            mf_list_file  = flopy.utils.Mf6ListBudget( os.path.join(experiment_folder, sc['simulation_name'], sc['model_name']+'.lst') )
-            dfflux, dfvol = mf_list_file.get_dataframes()
-            
-            # If all balances are less than N% discrepant, pass
-            if (
-                ( not np.all( dfvol['PERCENT_DISCREPANCY'].to_numpy() < discrepancy_threshold ) ) or
-                ( not np.all( dfflux['PERCENT_DISCREPANCY'].to_numpy() < discrepancy_threshold ) )
-            ):
-                # Report status alert
-                runsdf.loc[index,'status'] = 'alert'
-                runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
+            sc     = scenariosdf.loc[index]
+            source = select_warm_start(runsdf, scenariosdf, index) if warm_start else None
+            report_running(runsdf, index)
+            try:
+                _, status, fields = run_scenario(
+                        experiment_folder, index, sc['simulation_name'], sc['model_name'], warm_start=source, outputs=outputs, budgets=budgets, backend=backend
+                    )
+            except Exception as e:
+                print('################ WARNING #################')
+                warnings.warn('run: scenario ' + str(index) + ' raised ' + repr(e))
+                status, fields = 'failed', { 'failure_reason': repr(e) }
+            updates = finish_scenario(runsdf, scenariosdf, index, status, duplicates, fields)
+            if holder is not None:
+                holder.complete(index, updates)
+        return
+
+
+    print('run: executing ' + str(len(indexes)) + ' scenarios with ' + str(workers) + ' workers')
+    pending = schedule.longest_first(runsdf, scenariosdf, indexes) if longest_first else list(indexes)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+
+            # Keep the pool full
+            while pending and ( len(running) < workers ):
+                index  = pending.pop(0)
+                if ( holder is not None ) and ( not holder.claim(index) ):
+                    continue
+                sc     = scenariosdf.loc[index]
+                source = select_warm_start(runsdf, scenariosdf, index) if warm_start else None
+                future = executor.submit(
+                        run_scenario, experiment_folder, index, sc['simulation_name'], sc['model_name'], 
+                        silent=True, warm_start=source, outputs=outputs, budgets=budgets, backend=backend
+                    )
+                running[future] = index
+                report_running(runsdf, index)
+
+            # Collect whatever finished
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    _, status, fields = future.result()
+                except Exception as e:
+                    print('################ WARNING #################')
+                    warnings.warn('run: scenario ' + str(index) + ' raised ' + repr(e))
+                    status, fields = 'failed', { 'failure_reason': repr(e) }
+                updates = finish_scenario(runsdf, scenariosdf, index, status, duplicates, fields)
+                if holder is not None:
+                    holder.complete(index, updates)
+                print('run: scenario ' + str(index) + ' finished with status ' + status)
+
+
+
+def run_distributed(runsdf, scenariosdf, indexes, holder, **kwargs):
+    '''
+    Executes scenarios shared with other processes, possibly 
+    on other hosts, claiming them through lease files, see 
+    leases.py. Returns once all of them are done, waiting for 
+    those claimed by others, which are reclaimed if their 
+    leases expire. Statuses are kept at done markers, and 
+    merged into the status store by the coordinator, see 
+    merge_distributed
+
+    @params:
+        runsdf      (pandas.DataFrame): runs status
+        scenariosdf (pandas.DataFrame): scenarios
+        indexes     (list)            : scenario indexes to be executed
+        holder      (leases.Holder)   : lease holder of this process
+        kwargs                        : passed to run_scenarios
+    '''
+    print('run: distributed, claiming scenarios as ' + holder.token)
+    try:
+        while True:
+            remaining = [ i for i in indexes if not holder.is_done(i) ]
+            if not remaining:
+                break
+            others = set( holder.leased_by_others(remaining) )
+            free   = [ i for i in remaining if i not in others ]
+            if free:
+                run_scenarios(runsdf, scenariosdf, free, holder=holder, **kwargs)
             else:
-                # Report status success
-                runsdf.loc[index,'status'] = 'success'
-                runsdf.to_csv(os.path.join(experiment_folder, 'csv', runscsv) )
-
+                print('run: distributed, waiting for ' + str(len(others)) + ' scenarios claimed by other processes')
+                time.sleep(holder.lease_seconds/4)
+    finally:
+        holder.stop()
+
+    print('run: distributed, all scenarios done')
+
+
+
+def run_adaptive(runsdf, scenariosdf, indexes, names, batch, tolerance, focus=False, tracked=None, **kwargs):
+    '''
+    Executes scenarios in batches, until running statistics 
+    of outputs stabilise within tolerance, see adaptive.py.
+    Scenarios left are not executed and remain pending
+
+    @params:
+        runsdf      (pandas.DataFrame): runs status
+        scenariosdf (pandas.DataFrame): scenarios
+        indexes     (list)            : scenario indexes to be executed
+        names       (list)            : tracked outputs
+        batch       (int)             : scenarios per batch
+        tolerance   (float)           : relative tolerance of outputs statistics
+        focus       (bool)            : batches focus where outputs change the most
+        tracked     (list)            : scenario indexes whose outputs are tracked, 
+                                        including duplicates, indexes if None
+        kwargs                        : passed to run_scenarios
+    '''
+    if batch < 1:
+        raise Exception('run: --batch should be at least 1')
+    if tracked is None:
+        tracked = indexes
+
+    pending  = list(indexes)
+    previous = None
+    while pending:
+        values = adaptive.completed(runsdf, tracked, names)
+        if focus:
+            selected = adaptive.focus(scenariosdf, values, pending, batch)
+        else:
+            selected = pending[:batch]
+        chosen  = set(selected)
+        pending = [ i for i in pending if i not in chosen ]
+
+        run_scenarios(runsdf, scenariosdf, selected, outputs=True, **kwargs)
+
+        current = adaptive.statistics( adaptive.completed(runsdf, tracked, names) )
+        print('run: adaptive, ' + str(len(pending)) + ' scenarios left, outputs statistics\n' + current.to_string())
+        if adaptive.converged(current, previous, tolerance):
+            print('run: adaptive, outputs stabilised within ' + str(tolerance) + ', ' + str(len(pending)) + ' scenarios not executed')
+            return
+        previous = current
+
+    print('run: adaptive, all scenarios executed before outputs stabilised within ' + str(tolerance))
+
+
+
+def load_distributed(scenariosdf, lease_folder):
+    '''
+    Runs status of a distributed process, in memory. Scenarios
+    are pending, unless done by any process, then with the
+    fields recorded at their done markers, see leases.py
+    '''
+    runsdf = pd.DataFrame({ 'simulation_name': scenariosdf['simulation_name'], 'status': 'pending' })
+    for marker in leases.collect(lease_folder).values():
+        for index, fields in marker.get('runs', {}).items():
+            if int(index) not in runsdf.index:
+                continue
+            for field, value in fields.items():
+                runsdf.loc[int(index),field] = value
+
+    return runsdf
+
+
+
+def merge_distributed(store_file, markers):
+    '''
+    Merges into the status store the run fields recorded at
+    done markers by distributed processes, see leases.py. A
+    marker is merged once, its completion time is saved as
+    field distributed_completed of its scenario
+
+    @params:
+        store_file (str) : path to the status store
+        markers    (dict): done markers (dict) by scenario index, see leases.collect
+    '''
+    runsdf  = store.load(store_file)
+    merged  = runsdf['distributed_completed'] if 'distributed_completed' in runsdf.columns else pd.Series(dtype=float)
+    updates = {}
+    for index, marker in markers.items():
+        if merged.get(index) == marker['completed']:
+            continue
+        for i, fields in marker.get('runs', {}).items():
+            if int(i) in runsdf.index:
+                updates[int(i)] = fields
+        updates[index] = dict(updates.get(index, {}), distributed_completed=marker['completed'])
+    updates = { index: fields for index, fields in updates.items() if index in runsdf.index }
+
+    if updates:
+        store.update_many(store_file, updates)
+        print('run: merged statuses of ' + str(len(updates)) + ' scenarios executed by distributed processes')
+
+
+
+def export_runs(store_file, runs_file, scenariosdf=None, space=None):
+    '''
+    Exports runs.csv from the status store, with all scenarios
+    of scenariosdf, or with those of a lazy scenario space 
+    present in the store
+    '''
+    if space is not None:
+        if not os.path.exists(store_file):
+            raise Exception('run: no runs to export, ' + store_file + ' not found')
+        scenariosdf = space.take(store.load(store_file).index)
+    store.export(store_file, scenariosdf, runs_file)
+
+
+
+if __name__=='__main__':
+
+    #############
+    # Experiment
+    if args.experiment is None:
+        raise Exception('run: --experiment was not defined')
+    experiment_name   = args.experiment
+    experiment_folder = os.path.join(base_dir, experiment_name)
+    if not os.path.exists(experiment_folder):
+        raise Exception('run: experiment ' + experiment_name + ' does not exists in output path.')
+
+    # Import scenarios, from scenarios.csv or from a
+    # lazy scenario space, see utils/scenarios.py
+    # All scenarios of scenarios.csv are loaded,
+    # a lazy space is only built within the range
+    scenariosdf, space = scenarios.load(os.path.join(experiment_folder, 'csv'), args.start, args.end, whole=True)
+
+
+    # Determine indexes
+    # start and end are positions,
+    # end is not included.
+    # A lazy space requires that range,
+    # unless exported, see utils/scenarios.py
+    if space is None:
+        indexes = list( scenariosdf.index[ args.start:args.end ] )
+    elif scenariosdf is not None:
+        indexes = list( scenariosdf.index )
+    elif not args.export:
+        space.range_chunk(args.start, args.end)
+
+    if args.workers < 1:
+        raise Exception('run: --workers should be at least 1')
+    if args.distributed and args.adaptive:
+        raise Exception('run: --distributed and --adaptive can not be combined')
+    if args.distributed and ( args.clean or args.export ):
+        raise Exception('run: --distributed processes do not write the status store, --clean and --export from the coordinator, without --distributed')
+    shared_store = not args.distributed
+
+
+    # Runs status store, 
+    # initialized with scenarios as pending.
+    # Distributed processes do not use it,
+    # it is not shared across hosts
+    runs_file  = os.path.join(experiment_folder, 'csv', runscsv)
+    store_file = os.path.join(experiment_folder, 'csv', runsdb)
+    if shared_store and ( ( space is None ) or ( not args.export ) ):
+        store.initialize(store_file, scenariosdf, clean=args.clean, csv_file=runs_file)
+
+    # Claims of scenarios by processes
+    # sharing the experiment, see leases.py.
+    # Their statuses are merged here
+    lease_folder = os.path.join(experiment_folder, '.leases')
+    if args.clean:
+        leases.clear(lease_folder)
+    if shared_store:
+        markers = leases.collect(lease_folder)
+        if markers and ( space is not None ):
+            # Scenarios of a lazy space, not in the store yet
+            done = set(markers) | set( int(i) for marker in markers.values() for i in marker.get('runs', {}) )
+            store.initialize(store_file, space.take(sorted(done)))
+        if markers:
+            merge_distributed(store_file, markers)
+
+    if args.export:
+        export_runs(store_file, runs_file, scenariosdf if space is None else None, space)
+        print('run: exported ' + runs_file)
+        sys.exit()
+
+
+    # RUN
+    if not args.run:
+        print('run: not running. Force execution with --run')
+        sys.exit()
 
 
+    # Load runs
+    if shared_store:
+        runsdf = store.load(store_file)
+    else:
+        runsdf = load_distributed(scenariosdf, lease_folder)
+
+    for column in ['fingerprint', 'duplicate_of', 'run_fingerprint', 'host', 'warm_start_from', 'failure_reason', 'period_discrepancies']:
+        if column not in runsdf.columns:
+            runsdf[column] = ''
+        runsdf[column] = runsdf[column].fillna('').astype(str)
+    for column in ['pid', 'started', 'outer_iterations', 'inner_iterations', 'run_time']:
+        if column not in runsdf.columns:
+            runsdf[column] = np.nan
+
+
+    # Run each model once
+    chunk = list(indexes)
+    compute_fingerprints(runsdf, scenariosdf, indexes)
+    duplicates = {}
+    if not args.duplicates:
+        indexes, duplicates = find_duplicates(runsdf, scenariosdf, indexes)
+        saved = sum( len(d) for d in duplicates.values() )
+        print('run: ' + str(len(indexes) + saved) + ' scenarios, ' + str(len(indexes)) + ' distinct models, ' + str(saved) + ' runs saved')
+
+    # Skip what is done or being done
+    if args.resume:
+        indexes = select_resumable(runsdf, indexes, duplicates, args.stale_hours)
+
+
+    # Execution budgets, see monitor.py
+    budgets = {
+            'wall_time'       : args.max_wall_time,
+            'step_time'       : args.max_step_time,
+            'outer_iterations': args.max_outer_iterations,
+            'failed_steps'    : args.max_failed_steps,
+        }
+
+    if args.distributed:
+        run_distributed(
+                runsdf, scenariosdf, indexes, 
+                leases.Holder(lease_folder, args.lease_seconds, fingerprints=runsdf['fingerprint'].to_dict()),
+                workers=args.workers, duplicates=duplicates, warm_start=args.warm_start, budgets=budgets,
+                longest_first=not args.in_order, backend=args.backend
+            )
+    elif args.adaptive:
+        run_adaptive(
+                runsdf, scenariosdf, indexes, args.outputs, args.batch, args.tolerance, focus=args.focus, tracked=chunk,
+                workers=args.workers, duplicates=duplicates, warm_start=args.warm_start, budgets=budgets,
+                longest_first=not args.in_order, backend=args.backend
+            )
+    else:
+        run_scenarios(
+                runsdf, scenariosdf, indexes, workers=args.workers, duplicates=duplicates, 
+                warm_start=args.warm_start, budgets=budgets, longest_first=not args.in_order, 
+                backend=args.backend
+            )
+
+    if shared_store:
+        export_runs(store_file, runs_file, scenariosdf if space is None else None, space)
+    else:
+        print('run: distributed, statuses kept at ' + lease_folder + ', merge them from the coordinator with: python run.py --experiment ' + experiment_name + ' --export')
@@ -0,0 +1,109 @@
+'''
+schedule.py
+
+Cost aware ordering of scenarios. Execution times of completed
+runs are saved at the run_time runs field, and the cost of a
+scenario is predicted from those of the closest timed runs in
+parameter space, averaged in log scale weighted by the inverse
+of their distances. With several workers, scenarios are
+dispatched longest predicted first, so the experiment does not
+end waiting on a slow run started last.
+'''
+
+import numpy as np
+import pandas as pd
+
+# Self
+import warmstart
+
+
+# Timed runs a prediction is averaged from
+neighbours = 5
+
+# Scenarios whose distances to timed runs are computed at once
+chunk_size = 1000
+
+# Statuses of runs whose time is representative,
+# failed ones might have been killed early
+timed_statuses = warmstart.completed_statuses
+
+
+
+def timed(runsdf, scenariosdf):
+    '''
+    Execution times of completed runs of scenarios
+
+    @return:
+        pandas.Series, seconds by scenario index
+    '''
+    if 'run_time' not in runsdf.columns:
+        return pd.Series( dtype=float )
+
+    runs  = runsdf[ runsdf['status'].isin( timed_statuses ) & runsdf.index.isin( scenariosdf.index ) ]
+    times = runs['run_time'].astype(float)
+
+    return times[ times > 0 ]
+
+
+
+def predict(runsdf, scenariosdf, indexes):
+    '''
+    Predicted execution time of scenarios, from the closest
+    timed runs, see module description
+
+    @params:
+        runsdf      (pandas.DataFrame): runs status
+        scenariosdf (pandas.DataFrame): scenarios
+        indexes     (list)            : scenario indexes
+
+    @return:
+        numpy.ndarray, seconds for each index, NaN if there
+        are no timed runs
+    '''
+    times = timed( runsdf, scenariosdf )
+    if len(times) == 0:
+        return np.full( len(indexes), np.nan )
+
+    scaled = warmstart.scaled_parameters( scenariosdf )
+    points = scaled.loc[ times.index ].to_numpy()
+    log_t  = np.log( times.to_numpy() )
+    k      = min( neighbours, len(times) )
+
+    predicted = np.zeros( len(indexes) )
+    for start in range( 0, len(indexes), chunk_size ):
+        chunk = scaled.loc[ indexes[start:start + chunk_size] ].to_numpy()
+        d     = np.sqrt( ( ( chunk[:, np.newaxis] - points[np.newaxis] )**2 ).sum( axis=2 ) )
+        close = np.argsort( d, axis=1, kind='stable' )[:, :k]
+        dk    = np.take_along_axis( d, close, axis=1 )
+        # Inverse distance weights, exact matches dominate
+        w     = 1/np.maximum( dk, 1e-9 )
+        predicted[start:start + len(chunk)] = np.exp( ( w*log_t[close] ).sum( axis=1 )/w.sum( axis=1 ) )
+
+    return predicted
+
+
+
+def longest_first(runsdf, scenariosdf, indexes):
+    '''
+    Orders scenarios by decreasing predicted execution time.
+    Ties, as when there are no timed runs, keep their order
+
+    @return:
+        list of indexes
+    '''
+    indexes = list( indexes )
+    if not indexes:
+        return indexes
+
+    predicted = predict( runsdf, scenariosdf, indexes )
+    if np.isnan( predicted ).all():
+        print('run: no timed runs to predict scenarios cost, executed in order')
+        return indexes
+
+    order = np.argsort( -predicted, kind='stable' )
+    print(
+        'run: scenarios ordered longest predicted first, from ' + str(len( timed( runsdf, scenariosdf ) )) +
+        ' timed runs, predicted {:.1f} s in total'.format( predicted.sum() )
+    )
+
+    return [ indexes[i] for i in order ]
@@ -23,6 +23,10 @@ import config
 parser = argparse.ArgumentParser( description='Create model scenarios' )
 parser.add_argument( '--experiment', type=str, help='name of the experiment' )
 parser.add_argument( '--sim'       , type=str, help='base name for simulations' )
+parser.add_argument( '--lazy'      , action='store_true', help='save the scenario space definition instead of all scenarios' )
+parser.add_argument( '--design'    , type=str, default='factorial', choices=['factorial'] + list(scenarios.samplers), help='factorial combination or space filling design of scenarios' )
+parser.add_argument( '--samples'   , type=int, default=32, help='number of scenarios of space filling designs' )
+parser.add_argument( '--seed'      , type=int, help='random seed of space filling designs' )
 args = parser.parse_args()
 
 
@@ -56,13 +60,41 @@ parameters = {
     'hk_field_variance'     : [1.25, 2.25],
 }
 
+# Ranges of parameters for space filling designs. A Range
+# is continuous and a list discrete values, see utils/scenarios.py
+ranges = {
+    'pumping_flow_rate'     : scenarios.Range(50, 100), # l/min
+    'specific_storage'      : scenarios.Range(1e-3, 1e-2),
+    'newton_raphson'        : [True, False],
+    'head_convergence'      : scenarios.Range(1e-6, 1e-5),
+    'hk_field_variance'     : scenarios.Range(1.25, 2.25),
+}
 
-# Create scenarios
-scenariosdf = scenarios.combine(sim_base_name, **parameters)
-
-
-# Save as csv
-scenariosdf.to_csv(os.path.join(experiment_folder, 'csv', 'scenarios.csv'))
+# Parameters sampled uniformly in log space
+log_scaled = ['specific_storage', 'head_convergence']
+
+
+# Create scenarios and save as csv, or save 
+# only the definition of the scenario space.
+# Only one of both files is kept
+scenarios_file = os.path.join(experiment_folder, 'csv', scenarios.scenarios_file)
+space_file     = os.path.join(experiment_folder, 'csv', scenarios.space_file)
+if args.lazy and ( args.design != 'factorial' ):
+    raise Exception('mf6het3d:setup: --lazy only applies to the factorial design')
+if args.lazy:
+    space = scenarios.ScenarioSpace(sim_base_name, **parameters)
+    space.save(space_file)
+    if os.path.exists(scenarios_file):
+        os.remove(scenarios_file)
+    print('mf6het3d:setup: ' + str(len(space)) + ' scenarios')
+else:
+    if args.design == 'factorial':
+        scenariosdf = scenarios.combine(sim_base_name, **parameters)
+    else:
+        scenariosdf = scenarios.sample(sim_base_name, args.samples, method=args.design, seed=args.seed, log_scale=log_scaled, **ranges)
+    scenariosdf.to_csv(scenarios_file)
+    if os.path.exists(space_file):
+        os.remove(space_file)
 
 
 print('mf6het3d:setup: saved scenarios for experiment ' + experiment_name )
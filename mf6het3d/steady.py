@@ -0,0 +1,87 @@
+'''
+steady.py
+
+Reuse of the initial steady state. Stress period 0 has all wells
+at 0, so its solution depends only on the parameters listed at
+steady_parameters, besides the grid and the constant heads.
+Scenarios sharing those form a group, whose steady state is
+solved once by a simulation of that period only. Scenarios
+then start from its heads, converging in stress period 0 at once.
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+import flopy
+
+
+# Scenario parameters the steady state depends on. Not
+# newton_raphson, configure always solves with Newton
+steady_parameters = ( 'hk_field_variance', 'head_convergence' )
+
+
+
+def group_parameters(parameters):
+    '''
+    Parameters of a scenario defining its steady state
+    '''
+    return {
+            k: ( parameters[k].item() if hasattr(parameters[k], 'item') else parameters[k] )
+            for k in steady_parameters if k in parameters
+        }
+
+
+
+def group_name(parameters):
+    '''
+    Name of the steady state simulation of a scenario, also used
+    as model name, so no longer than 16 characters as mf6 requires
+    '''
+    parameters = json.dumps( group_parameters(parameters), sort_keys=True )
+    return 'STEADY_' + hashlib.sha1( parameters.encode() ).hexdigest()[:8]
+
+
+
+def groups(scenariosdf):
+    '''
+    Groups scenarios by their steady state
+
+    @params:
+        scenariosdf (pandas.DataFrame): scenarios
+
+    @return:
+        dict, steady state parameters by group name
+    '''
+    return {
+            group_name( sc.to_dict() ): group_parameters( sc.to_dict() )
+            for idsc, sc in scenariosdf.iterrows()
+        }
+
+
+
+def heads_file(experiment_folder, name):
+    '''
+    Heads file written by the steady state simulation name
+    '''
+    return os.path.join( experiment_folder, name, name + '.hds' )
+
+
+
+def load_heads(file_path, stress_period=None):
+    '''
+    Heads of the last time step saved at file_path, 
+    or of the last time step of stress_period (zero based)
+
+    @return:
+        numpy.ndarray, shape (layers, rows, columns)
+    '''
+    if not os.path.exists( file_path ):
+        raise Exception('steady: heads file ' + file_path + ' not found, steady state not solved?')
+    heads     = flopy.utils.HeadFile( file_path )
+    kstpkpers = heads.get_kstpkper()
+    if stress_period is not None:
+        kstpkpers = [ k for k in kstpkpers if k[1] == stress_period ]
+        if not kstpkpers:
+            raise Exception('steady: stress period ' + str(stress_period) + ' not saved at ' + file_path)
+    return np.array( heads.get_data( kstpkper=kstpkpers[-1] ), dtype=np.float64 )
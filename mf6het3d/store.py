@@ -0,0 +1,177 @@
+'''
+store.py
+
+Runs status store, an SQLite database at the csv folder of
+an experiment. Each status transition updates a single row,
+and several processes can update it at the same time.
+The familiar runs.csv is produced by export.
+'''
+
+import os
+import sqlite3
+import pandas as pd
+
+
+# Seconds waiting for a lock held by another process
+timeout = 60
+
+
+
+def connect(db_file):
+    '''
+    Opens a connection to the store, in autocommit mode
+    '''
+    return sqlite3.connect(db_file, timeout=timeout, isolation_level=None)
+
+
+
+def to_sql(value):
+    '''
+    Converts numpy scalars into python values
+    '''
+    return value.item() if hasattr(value, 'item') else value
+
+
+
+def columns(connection):
+    '''
+    Column names of the runs table
+    '''
+    return [ row[1] for row in connection.execute('PRAGMA table_info(runs)') ]
+
+
+
+def add_columns(connection, names):
+    '''
+    Adds columns to the runs table if not present. Another
+    process might be adding the same column at the same time
+    '''
+    present = columns(connection)
+    for name in names:
+        if name in present:
+            continue
+        if not name.isidentifier():
+            raise Exception('store: invalid field name ' + str(name))
+        try:
+            connection.execute('ALTER TABLE runs ADD COLUMN ' + name)
+        except sqlite3.OperationalError as e:
+            if 'duplicate column' not in str(e):
+                raise
+
+
+
+def initialize(db_file, scenariosdf, clean=False, csv_file=None):
+    '''
+    Creates the store if needed and adds scenarios as pending.
+
+    A new store imports statuses from csv_file if it exists,
+    so experiments started with runs.csv keep their statuses.
+
+    @params:
+        db_file     (str)             : path to the store
+        scenariosdf (pandas.DataFrame): scenarios
+        clean       (bool)            : forget all previous statuses
+        csv_file    (str)             : path to a previous runs.csv
+    '''
+    is_new     = not os.path.exists(db_file)
+    connection = connect(db_file)
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS runs (idx INTEGER PRIMARY KEY, simulation_name TEXT, status TEXT)'
+        )
+        if clean:
+            connection.execute('DELETE FROM runs')
+        connection.executemany(
+            'INSERT OR IGNORE INTO runs (idx, simulation_name, status) VALUES (?, ?, ?)',
+            [ (to_sql(index), sc['simulation_name'], 'pending') for index, sc in scenariosdf.iterrows() ]
+        )
+
+        # Import previous runs.csv
+        if is_new and ( not clean ) and ( csv_file is not None ) and os.path.exists(csv_file):
+            runsdf = pd.read_csv(csv_file, index_col=0)
+            fields = [ c for c in runsdf.columns if c not in scenariosdf.columns ]
+            add_columns(connection, fields)
+            for index, run in runsdf[fields].iterrows():
+                values = [ None if pd.isna(v) else to_sql(v) for v in run.to_numpy() ]
+                connection.execute(
+                    'UPDATE runs SET ' + ', '.join( f + '=?' for f in fields ) + ' WHERE idx=?',
+                    values + [ to_sql(index) ]
+                )
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+
+
+def update_many(db_file, updates):
+    '''
+    Updates fields of several runs in a single transaction
+
+    @params:
+        db_file (str) : path to the store
+        updates (dict): dict of fields (dict) by scenario index
+    '''
+    if not updates:
+        return
+    connection = connect(db_file)
+    try:
+        add_columns(connection, set( f for fields in updates.values() for f in fields ))
+        connection.execute('BEGIN IMMEDIATE')
+        for index, fields in updates.items():
+            connection.execute(
+                'UPDATE runs SET ' + ', '.join( f + '=?' for f in fields ) + ' WHERE idx=?',
+                [ to_sql(v) for v in fields.values() ] + [ to_sql(index) ]
+            )
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+
+
+def update(db_file, index, **fields):
+    '''
+    Updates fields of a run, e.g. update(db_file, 3, status='running')
+    '''
+    update_many(db_file, { index: fields })
+
+
+
+def load(db_file):
+    '''
+    Loads the store as a pandas.DataFrame indexed by scenario index
+    '''
+    connection = connect(db_file)
+    try:
+        runsdf = pd.read_sql_query('SELECT * FROM runs ORDER BY idx', connection, index_col='idx')
+    finally:
+        connection.close()
+    runsdf.index.name = None
+    return runsdf
+
+
+
+def export(db_file, scenariosdf, csv_file):
+    '''
+    Writes the runs.csv view, scenarios with their statuses,
+    and compacts the store
+
+    @params:
+        db_file     (str)             : path to the store
+        scenariosdf (pandas.DataFrame): scenarios
+        csv_file    (str)             : path to runs.csv
+    '''
+    runsdf = load(db_file).drop(columns=['simulation_name'])
+    runsdf = scenariosdf.join(runsdf, how='left')
+
+    temporary = csv_file + '.' + str(os.getpid()) + '.tmp'
+    runsdf.to_csv(temporary)
+    os.replace(temporary, csv_file)
+
+    connection = connect(db_file)
+    try:
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
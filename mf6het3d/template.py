@@ -0,0 +1,147 @@
+'''
+template.py
+
+Package files shared between scenarios of an experiment.
+
+A package depending only on some scenario parameters (or none)
+is given a file name unique for those parameters. It is written
+once into the experiment template folder, and hard linked from
+there into every scenario folder requiring the same file.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+
+# Self
+import inputs
+
+
+
+def shared_filename(package_type, extension, **parameters):
+    '''
+    Name of a shared package file, unique for the given parameters.
+    Files of the package (external arrays) should start with the
+    same name followed by a dot.
+
+    @params:
+        package_type (str) : package type, e.g. 'npf'
+        extension    (str) : file extension
+        **parameters (dict): parameters the package depends on
+
+    @return:
+        str, e.g. npf_4a1b9c0de2.npf
+    '''
+    key = hashlib.sha1( json.dumps(parameters, sort_keys=True).encode() ).hexdigest()[:10]
+    return package_type + '_' + key + '.' + extension
+
+
+
+def link(source, target):
+    '''
+    Hard links source file to target, copies it if the
+    file system does not support links. An existing target
+    is replaced, and it is never seen partially written
+    '''
+    temporary = target + '.' + str(os.getpid()) + '.tmp'
+    try:
+        os.link(source, temporary)
+    except OSError:
+        shutil.copyfile(source, temporary)
+    os.replace(temporary, target)
+
+
+
+def publish(source, target):
+    '''
+    Hard links source file to target only if there is no
+    target yet, atomically, so a published file is never
+    replaced by another process. Without hard links, it is
+    copied and replaced as link does
+
+    @return:
+        bool, True if published, False if target existed
+    '''
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        return False
+    except OSError:
+        link(source, target)
+    return True
+
+
+
+def package_files(folder, filename):
+    '''
+    Files in folder belonging to the package written as filename,
+    the package file being the last one
+    '''
+    stem  = filename.rsplit('.', 1)[0] + '.'
+    files = [
+            f for f in os.listdir(folder) 
+            if f.startswith(stem) and ( f != filename ) and ( not f.endswith('.tmp') )
+        ]
+    return files + [ filename ]
+
+
+
+def write_package(package, sim_ws, template_folder, arrays=[]):
+    '''
+    Writes a shared package in sim_ws, by linking it from the
+    template folder or, if not there yet, by writing it, with
+    its binary arrays, see inputs.write_arrays, and publishing
+    it to the template folder.
+
+    Publishing links the package file last, so a package file
+    in the template folder always has its external files.
+    Several processes might publish the same package, first one
+    wins and the others link its files in place of theirs, so
+    every scenario shares the same files.
+    '''
+    if os.path.exists(os.path.join(template_folder, package.filename)):
+        for f in package_files(template_folder, package.filename):
+            link(os.path.join(template_folder, f), os.path.join(sim_ws, f))
+        return
+
+    package.write()
+    inputs.write_arrays(sim_ws, arrays)
+    for f in package_files(sim_ws, package.filename):
+        if not publish(os.path.join(sim_ws, f), os.path.join(template_folder, f)):
+            link(os.path.join(template_folder, f), os.path.join(sim_ws, f))
+
+
+
+def write_simulation(sim, template_folder, shared_files, arrays={}):
+    '''
+    Writes simulation files as MFSimulation.write_simulation does,
+    except for packages in shared_files, which are linked from
+    template_folder when possible, with their binary arrays.
+
+    @params:
+        sim             (flopy.mf6.MFSimulation): simulation to be written
+        template_folder (str)                   : template folder of the experiment
+        shared_files    (set)                   : file names of shared packages
+        arrays          (dict)                  : binary arrays by package file name, see inputs.write_arrays
+    '''
+    sim_ws = sim.simulation_data.mfpath.get_sim_path()
+    os.makedirs(sim_ws, exist_ok=True)
+    os.makedirs(template_folder, exist_ok=True)
+
+    # Same array wrapping as MFSimulation.write_simulation,
+    # otherwise shared files would depend on who wrote them
+    packages = [ sim.name_file ] + sim.sim_package_list
+    for model_name in sim.model_names:
+        model = sim.get_model(model_name)
+        dis   = model.get_package('dis')
+        if dis is not None and hasattr(dis, 'ncol'):
+            sim.simulation_data.max_columns_of_data = dis.ncol.get_data()
+        packages += [ model.name_file ] + model.packagelist
+
+    for package in packages:
+        if package.filename in shared_files:
+            write_package(package, sim_ws, template_folder, arrays.get(package.filename, []))
+        else:
+            package.write()
+            inputs.write_arrays(sim_ws, arrays.get(package.filename, []))
@@ -0,0 +1,208 @@
+'''
+warmstart.py
+
+Warm start of scenarios. Starting heads are taken from the heads
+saved by the closest completed scenario in parameter space, at
+the end of its stress period 0, instead of the linear initial
+conditions of configure. Solver iteration counts are parsed from
+list files, so the saving of warm started runs can be measured
+against cold started ones.
+'''
+
+import os
+import re
+import numpy as np
+
+# Self
+import steady
+import inputs
+
+
+# Scenario parameters defining the distance between scenarios
+parameters = ( 'pumping_flow_rate', 'specific_storage', 'newton_raphson', 'head_convergence', 'hk_field_variance' )
+
+# Statuses of scenarios whose heads might be used
+completed_statuses = ( 'success', 'alert' )
+
+# Stress period whose final heads are the starting heads
+warm_start_period = 0
+
+# Solver summary written by mf6 for each time step
+calls_pattern      = re.compile( rb'^\s*(\d+)\s+CALLS TO NUMERICAL SOLUTION', re.MULTILINE )
+iterations_pattern = re.compile( rb'^\s*(\d+)\s+TOTAL ITERATIONS', re.MULTILINE )
+
+
+
+def scaled_parameters(scenariosdf):
+    '''
+    Scenario parameters scaled by their range among
+    scenarios, into [0, 1]
+
+    @return:
+        pandas.DataFrame, a column by parameter
+    '''
+    columns = [ c for c in parameters if c in scenariosdf.columns ]
+    values  = scenariosdf[ columns ].astype(float)
+    ranges  = ( values.max() - values.min() ).replace( 0, np.nan )
+
+    return ( ( values - values.min() )/ranges ).fillna( 0 )
+
+
+
+def distances(scenariosdf, index, candidates):
+    '''
+    Distances from a scenario to candidates in parameter
+    space, each parameter scaled by its range among scenarios
+
+    @params:
+        scenariosdf (pandas.DataFrame): scenarios
+        index       (int)             : scenario index
+        candidates  (list)            : scenario indexes
+
+    @return:
+        pandas.Series, distance by candidate index
+    '''
+    scaled = scaled_parameters( scenariosdf )
+
+    return np.sqrt( ( ( scaled.loc[ candidates ] - scaled.loc[ index ] )**2 ).sum( axis=1 ) )
+
+
+
+def nearest(scenariosdf, index, candidates):
+    '''
+    Closest candidate to a scenario, other than itself
+
+    @return:
+        index of the closest candidate, None if there are none
+    '''
+    candidates = [ c for c in candidates if c != index ]
+    if not candidates:
+        return None
+    return distances( scenariosdf, index, candidates ).idxmin()
+
+
+
+def heads_file(experiment_folder, scenario):
+    '''
+    Heads file of a scenario, a row of scenarios.csv
+    '''
+    return os.path.join( experiment_folder, scenario['simulation_name'], scenario['model_name'] + '.hds' )
+
+
+
+def load_heads(file_path):
+    '''
+    Starting heads from a heads file, those at
+    the end of stress period warm_start_period
+    '''
+    return steady.load_heads( file_path, stress_period=warm_start_period )
+
+
+
+def iterations(simulation_folder, model_name):
+    '''
+    Total outer (calls to the numerical solution) and inner
+    iterations of a simulation, as reported by mf6 for each
+    time step in the simulation or the model list file
+
+    @return:
+        tuple (outer, inner), NaN if not found
+    '''
+    for list_file in [ 'mfsim.lst', model_name + '.lst' ]:
+        file_path = os.path.join( simulation_folder, list_file )
+        if not os.path.exists( file_path ):
+            continue
+        with open( file_path, 'rb' ) as f:
+            content = f.read()
+        outer = [ int(c) for c in calls_pattern.findall( content ) ]
+        inner = [ int(c) for c in iterations_pattern.findall( content ) ]
+        if outer:
+            return sum(outer), sum(inner)
+
+    return np.nan, np.nan
+
+
+
+def apply(simulation_folder, model_name, file_path):
+    '''
+    Sets the starting heads of a written simulation from a heads
+    file, rewriting the griddata of its initial conditions package
+    with binary arrays by layer, as flopy_config writes them. The 
+    package file is moved aside first, so files shared with other
+    scenarios are untouched, and it is put back by restore
+
+    @params:
+        simulation_folder (str): simulation folder
+        model_name        (str): name of the gwf model
+        file_path         (str): heads file
+
+    @return:
+        list of tuples (backup, original) file paths, see restore
+    '''
+    ic_file = inputs.package_file( simulation_folder, model_name, 'IC6' )
+    heads   = load_heads( file_path )
+    suffix  = '.warmstart.' + str(os.getpid()) + '.tmp'
+
+    with open( ic_file ) as f:
+        content = f.read()
+
+    # Starting heads by layer, named after the package file.
+    # Created files are removed by restore
+    backups = []
+    arrays  = [ '  strt  LAYERED' ]
+    for ilay, layer in enumerate( heads, 1 ):
+        array_file = os.path.basename( ic_file ) + '.strt_layer' + str(ilay) + suffix
+        inputs.write_array( os.path.join( simulation_folder, array_file ), layer, 'STRT', ilay )
+        backups.append( ( None, os.path.join( simulation_folder, array_file ) ) )
+        arrays.append( "    OPEN/CLOSE  '" + array_file + "'  FACTOR  1.0  (BINARY)" )
+    griddata = 'BEGIN griddata\n' + '\n'.join( arrays ) + '\nEND griddata'
+    content, replaced = re.subn( r'BEGIN\s+griddata.*?END\s+griddata', lambda m: griddata, content, flags=re.IGNORECASE | re.DOTALL )
+    if replaced != 1:
+        restore( backups )
+        raise Exception('warmstart: griddata block not found at ' + ic_file)
+
+    os.replace( ic_file, ic_file + suffix )
+    backups.append( ( ic_file + suffix, ic_file ) )
+    with open( ic_file, 'w' ) as f:
+        f.write( content )
+
+    return backups
+
+
+
+def restore(backups):
+    '''
+    Puts back files moved aside by apply,
+    and removes those it created
+    '''
+    for backup, original in backups:
+        if backup is None:
+            if os.path.exists( original ):
+                os.remove( original )
+        else:
+            os.replace( backup, original )
+
+
+
+def baseline(runsdf, scenariosdf, index):
+    '''
+    Iterations of the closest cold started run, a
+    reference for the saving of a warm started one
+
+    @return:
+        tuple (outer, inner), NaN if there is no such run
+    '''
+    for column in [ 'outer_iterations', 'warm_start_from' ]:
+        if column not in runsdf.columns:
+            return np.nan, np.nan
+
+    cold = runsdf[
+            runsdf['status'].isin( completed_statuses ) &
+            runsdf['outer_iterations'].notna() &
+            ( runsdf['warm_start_from'].fillna('') == '' )
+        ].index
+    closest = nearest( scenariosdf, index, list( cold ) )
+    if closest is None:
+        return np.nan, np.nan
+
+    return runsdf.loc[ closest, 'outer_iterations' ], runsdf.loc[ closest, 'inner_iterations' ]
@@ -1,134 +1,229 @@
 '''
 wells.py
+
+Builds the well package for a table of wells. Flow rates of
+all wells and stress periods are distributed among screened
+layers at once, for structured (DIS) and vertex (DISV) grids.
+
+A well is a dict as defined in flopy_config.configure:
+
+    {
+        'id'            : 'W1',
+        'point'         : shapely.geometry.Point(25, 50),
+        'screen_bottom' : 1,   # Elevation
+        'screen_top'    : 2,   # Elevation
+        'pumping'       : [ { 'stress_period_id': 0, 'flow_rate': 0 }, ... ],
+        'pumping_method': 'deepest_layer', # Optional
+        'layers'        : [7],             # Optional, instead of screen
+    }
 '''
 
 import flopy
 import numpy as np
 
+# Self
+import intersections
+
+
+# Available methods for distributing flow rates among layers
+PUMPING_METHODS = [
+        'deepest_layer',                   # Deepest screened layer, without corrections
+        'distributed_by_transmissivities', # Screened layers, proportional to transmissivities
+        'deepest_layer_kzz_correction',    # Deepest screened layer, vertical k of upper ones times KZZ_FACTOR
+        'homogeneous',                     # Screened layers, same flow rate
+    ]
+KZZ_FACTOR       = 10
+BOTTOM_TOLERANCE = 1e-7
+
+
+
+def intersect(gwf, grid, wells, cache_file=None):
+    '''
+    Intersects wells with the model grid, all at once
+    and through the cache of intersections.py.
+    Wells are considered to be a single point/cell
+    from the surface perspective, without diameter.
+    Wells on the edge of several cells are assigned to
+    the first one
+
+    @params:
+        gwf        (flopy.mf6.ModflowGwf)     : model
+        grid       (flopy.utils.GridIntersect): intersection object for gwf.modelgrid, might be None
+        wells      (list)                     : wells definition
+        cache_file (str)                      : intersections cache file, see intersections.py
+
+    @return:
+        tuple (nodes, cellids), nodes are indexes of the cells
+        within a layer, cellids are (row, column) for DIS
+        grids and (cell2d,) for DISV grids
+    '''
+    modelgrid = gwf.modelgrid
+    cellids   = []
+    for w, cells in zip( wells, intersections.intersect( modelgrid, [ w['point'] for w in wells ], cache_file, grid ) ):
+        if len(cells) == 0:
+            raise Exception('wells.py: well ' + str(w['id']) + ' is outside the grid')
+        cellids.append( tuple(cells[0]) if modelgrid.grid_type == 'structured' else ( cells[0], ) )
+
+    if modelgrid.grid_type == 'structured':
+        nodes = np.array([ c[0]*modelgrid.ncol + c[1] for c in cellids ], dtype=int)
+    elif modelgrid.grid_type == 'vertex':
+        nodes = np.array([ c[0] for c in cellids ], dtype=int)
+    else:
+        raise Exception('wells.py: grid type ' + str(modelgrid.grid_type) + ' not implemented.')
+
+    return nodes, cellids
+
+
+
+def screened_layers(gwf, wells, nodes):
+    '''
+    Layers screened by each well, given by its 'layers' or by
+    the layers whose bottom is within [screen_bottom, screen_top)
+
+    @return:
+        numpy.ndarray of bool, shape (number_of_wells, number_of_layers)
+    '''
+    modelgrid = gwf.modelgrid
+    nlay      = modelgrid.nlay
+    botm      = modelgrid.botm.reshape(nlay, -1)[:, nodes].T  # (wells, layers)
+
+    screen_top    = np.array([ w.get('screen_top', np.nan) for w in wells ], dtype=float)
+    screen_bottom = np.array([ w.get('screen_bottom', np.nan) for w in wells ], dtype=float)
+    screened      = (
+            ( botm - screen_top[:, np.newaxis] < BOTTOM_TOLERANCE ) &
+            ( botm - screen_bottom[:, np.newaxis] >= BOTTOM_TOLERANCE )
+        )
+
+    # Layers given explicitly
+    for iw, w in enumerate(wells):
+        if w.get('layers'):
+            screened[iw, :] = False
+            screened[iw, w['layers']] = True
 
+    return screened
 
-def build(gwf, grid, wells, nper):
+
+
+def build(gwf, grid, wells, nper, pumping_method='distributed_by_transmissivities', intersections_file=None, **kwargs):
     '''
     Initializes flopy well package based on input params
 
     Input:
-        - gwf   : flopy object
-        - grid  : gridgen object
-        - wells : dict with wells definition/config
-        - nper  : number of stress periods
+        - gwf            : flopy.mf6.ModflowGwf, with dis/disv and npf packages
+        - grid           : flopy.utils.GridIntersect for gwf.modelgrid, created if needed
+        - wells          : list of dicts with wells definition/config
+        - nper           : number of stress periods
+        - pumping_method : default method for wells screening several layers,
+                           see PUMPING_METHODS. Wells might define their own
+                           'pumping_method'
+        - intersections_file : cache of intersections, see intersections.py
+        - kwargs         : passed to flopy.mf6.ModflowGwfwel, e.g. filename
+
+    Wells cellids and layers are assigned to their definition.
+    If any well uses deepest_layer_kzz_correction, k33 of the
+    npf package is set once with all the corrections.
+
+    Returns the flopy.mf6.ModflowGwfwel package
     '''
-    ###########################
-    # WHEN LAYERS ARE KNOWN
-    ###########################
-    
-    WELLS=wells
+    modelgrid       = gwf.modelgrid
+    nlay            = modelgrid.nlay
+    number_of_wells = len(wells)
+    well_ids        = np.array([ w['id'] for w in wells ])
 
-    # Initialize wel_stress_period dict for wel pkg
-    wel_stress_period = {}
-    for sp in range(nper):
-        wel_stress_period[ sp ] = []
-    
+    # Cells and screened layers
+    nodes, cellids = intersect(gwf, grid, wells, intersections_file)
+    screened       = screened_layers(gwf, wells, nodes)
+    if not np.all( screened.any(axis=1) ):
+        raise Exception('wells.py: wells ' + ', '.join( well_ids[ ~screened.any(axis=1) ] ) + ' do not screen any layer')
+    for iw, w in enumerate(wells):
+        w['cellids'] = cellids[iw]
+        w['layers']  = list( np.flatnonzero( screened[iw] ) )
 
-    # Intersect wells with the grid
-    for w in WELLS:
 
-        w['grid_cells'] = grid.intersect([ (w['x'], w['y']) ], 'point', 0 )
-        #w['grid_cells'] = grid.intersect([ (w['x'], w['y']) ], 'point', w['layers'][0] )
+    # Methods, single layer wells fall back to deepest_layer
+    methods = np.array([ w.get('pumping_method', pumping_method) for w in wells ], dtype=object)
+    for method in np.unique(methods):
+        if method not in PUMPING_METHODS:
+            raise Exception('wells.py: pumping method ' + method + ' not implemented.')
+    kzz_correction = methods == 'deepest_layer_kzz_correction'
+    methods[ screened.sum(axis=1) == 1 ] = 'deepest_layer'
 
-        # If the well is not pumping, continue 
-        # to the next
-        if not w['pumping']:
-            continue
-    
-        # If the well has several layers
-        # Apply pumping method if defined
-        if len(w['layers']) > 1:
-            try:
-                sc['pumping_method']
-                w['pumping_method'] = sc['pumping_method']
-            except KeyError:
-                w['pumping_method'] = 'distributed_by_transmissivities'
-        else:
-            # Fallback to single layer
-            w['pumping_method'] = 'deepest_layer'
-   
-        # For DISV grid
-        well_nodenumber = w['grid_cells'].nodenumber.item()
-    
-        # Loop over pumping cycles/stress periods
+
+    # Flow rates as (number_of_wells, nper),
+    # defined tells which periods are given for each well
+    flow_rates = np.zeros( ( number_of_wells, nper ) )
+    defined    = np.zeros( ( number_of_wells, nper ), dtype=bool )
+    for iw, w in enumerate(wells):
         for wsp in w['pumping']:
-    
-            w_stress_period = []
-    
-            if w['pumping_method'] == 'deepest_layer':
-                # Apply flow rate to deepest layer without correcctions
-                w_stress_period.append(
-                        [
-                            (w['layers'][-1], well_nodenumber),
-                            wsp['flow_rate'],
-                            w['id'] + '_SP' + str(wsp['stress_period_id'])
-                        ]
-                    )
-    
-            elif w['pumping_method'] == 'distributed_by_transmissivities':
-                # Distribute flow rate based on transmissivities
-                # Requires npf package
-                bottom_array       = sc['gwf'].modelgrid.botm[:, well_nodenumber]
-                model_layers_height= abs(np.diff(bottom_array)) # Substracts from the last item, removes the first
-                well_layers_height = model_layers_height[ [ l-1 for l in w['layers'] ] ]
-                npf_package        = sc['gwf'].get_package('npf')
-                kxx_layers         = npf_package.k.array[w['layers'], well_nodenumber]
-                
-                if npf_package.k22.has_data():
-                    kyy_layers   = npf_package.k22.array[w['layers'], well_nodenumber]
-                    trans_layers = [ np.sqrt(kyy_layers[index]*kxx_layers[index])*l for index, l in enumerate(well_layers_height) ]
-                else:
-                    trans_layers = [ kxx_layers[index]*l for index, l in enumerate(well_layers_height) ]
-    
-                cell_flow_rates  = [ t*wsp['flow_rate']/sum(trans_layers) for t in trans_layers ]
-    
-                for index, layer in enumerate(w['layers']):
-                    w_stress_period.append(
-                        [
-                            (layer, well_nodenumber),
-                            cell_flow_rates[index],
-                            w['id'] + '_SP' + str(wsp['stress_period_id'])
-                        ]
-                    )
-    
-            elif w['pumping_method'] == 'deepest_layer_kzz_correction':
-                # Apply flow rate to deepest layer,
-                # increasing vertical k of upper layers
-                npf_package  = sc['gwf'].get_package('npf')
-                kxx_data     = npf_package.k.get_data()
-                kxx_data[ w['layers'][:-1], well_nodenumber ] = [ kxx*10 for kxx in kxx_data[ w['layers'][:-1], well_nodenumber ] ]
-                npf_package.k33.set_data(kxx_data) # It works, verified in .wel files
-                w_stress_period.append(
-                        [
-                            (w['layers'][-1], well_nodenumber),
-                            wsp['flow_rate'],
-                            w['id'] + '_SP' + str(wsp['stress_period_id'])
-                        ]
-                    )
-    
-            elif w['pumping_method'] == 'homogeneous':
-                # Distribute flow rate homogeneously
-                for layer in w['layers']:
-                    w_stress_period.append(
-                        [
-                            (layer, well_nodenumber),
-                            wsp['flow_rate']/len(w['layers']),
-                            w['id'] + '_SP' + str(wsp['stress_period_id'])
-                        ]
-                    )
-    
-            else:
-                raise Exception('setup.py: pumping method ' + w['pumping_method'] + ' not implemented.')
-    
-    
-            # Assign to stress period
-            wel_stress_period[ wsp['stress_period_id'] ].extend( w_stress_period )
-   
+            flow_rates[ iw, wsp['stress_period_id'] ] = wsp['flow_rate']
+            defined[ iw, wsp['stress_period_id'] ]    = True
+    pumping = defined.any(axis=1)
+
+
+    # Fraction of the well flow rate for each layer,
+    # shape (number_of_wells, number_of_layers)
+    layer_indexes  = np.arange(nlay)[np.newaxis, :]
+    deepest_layers = nlay - 1 - np.argmax( screened[:, ::-1], axis=1 )
+    deepest        = ( layer_indexes == deepest_layers[:, np.newaxis] ).astype(float)
+    homogeneous    = screened/screened.sum(axis=1)[:, np.newaxis]
+
+    to_deepest  = np.isin( methods, ['deepest_layer', 'deepest_layer_kzz_correction'] )
+    fractions   = np.zeros( ( number_of_wells, nlay ) )
+    fractions[ to_deepest ] = deepest[ to_deepest ]
+    fractions[ methods == 'homogeneous' ] = homogeneous[ methods == 'homogeneous' ]
+
+    npf = gwf.get_package('npf')
+    by_transmissivities = methods == 'distributed_by_transmissivities'
+    if by_transmissivities.any():
+        # Requires npf package
+        top          = modelgrid.top.reshape(-1)[nodes]
+        botm         = modelgrid.botm.reshape(nlay, -1)[:, nodes].T
+        thickness    = np.hstack( [ top[:, np.newaxis], botm[:, :-1] ] ) - botm
+        kxx_layers   = npf.k.array.reshape(nlay, -1)[:, nodes].T
+        if npf.k22.has_data():
+            kyy_layers = npf.k22.array.reshape(nlay, -1)[:, nodes].T
+            trans      = np.sqrt( kxx_layers*kyy_layers )*thickness*screened
+        else:
+            trans      = kxx_layers*thickness*screened
+        fractions[ by_transmissivities ] = ( trans/trans.sum(axis=1)[:, np.newaxis] )[ by_transmissivities ]
+
+
+    # Vertical k corrections of upper screened
+    # layers, applied in a single update of k33.
+    # Set even if no layer is corrected, so k33
+    # does not depend on the wells screens
+    if kzz_correction.any():
+        upper_layers = (
+                screened & ( layer_indexes < deepest_layers[:, np.newaxis] ) &
+                ( kzz_correction & pumping )[:, np.newaxis]
+            )
+        iw, layers = np.nonzero( upper_layers )
+        k33_array  = np.array( npf.k33.array if npf.k33.has_data() else npf.k.array ).reshape(nlay, -1)
+        k33_array[ layers, nodes[iw] ] *= KZZ_FACTOR
+        npf.k33.set_data( k33_array.reshape( npf.k.array.shape ) )
+
+
+    # Initialize wel_stress_period dict for wel pkg,
+    # one structured array per stress period
+    active    = fractions > 0
+    wel_dtype = np.dtype([ ('cellid', object), ('q', np.float64), ('boundname', object) ])
+    wel_stress_period = {}
+    for sp in range(nper):
+        iw, layers = np.nonzero( active & defined[:, sp][:, np.newaxis] )
+        if iw.size == 0:
+            wel_stress_period[ sp ] = []
+            continue
+        boundnames = np.char.add( well_ids[iw], '_SP' + str(sp) )
+        wel_stress_period[ sp ] = {
+                'data': np.rec.fromrecords(
+                    list( zip(
+                        [ ( int(l), ) + cellids[i] for i, l in zip(iw, layers) ],
+                        flow_rates[iw, sp]*fractions[iw, layers],
+                        boundnames.tolist()
+                    ) ),
+                    dtype=wel_dtype
+                )
+            }
 
 
     ###################
@@ -138,11 +233,11 @@ def build(gwf, grid, wells, nper):
         gwf,
         stress_period_data=wel_stress_period,
         boundnames=True,
-        save_flows=True
+        save_flows=True,
+        **kwargs
     )
 
 
 
-
 if  __name__=='__main__':
     print('wells.py')
@@ -0,0 +1,228 @@
+'''
+xmi.py
+
+In-process execution of mf6 through the XMI interface of the
+libmf6 shared library, with modflowapi. Time steps and outer
+iterations are driven from python, so the convergence of each
+time step is known as it is solved, budgets of monitor.py are
+applied between outer iterations, and heads are read from the
+memory of mf6 instead of the heads file.
+
+Requires modflowapi and the libmf6 library of the mf6 release,
+whose path is config.lib_name. Budget discrepancies are still
+checked from the list file, see budget.py, as mf6 does not
+expose its budget summary through the interface.
+
+libmf6 keeps its state in Fortran modules and can not be
+initialized twice in a process, so each simulation is solved
+in a fresh process, see run. As the mf6 executable, a time step
+that does not converge stops the simulation as failed, unless
+the simulation name file sets option CONTINUE.
+'''
+
+import os
+import time
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Self
+import inputs
+import monitor
+import adaptive
+
+
+# Solution driven, first (and only) one of the simulation
+solution_id = 1
+
+
+
+def load_library(lib_name, simulation_folder):
+    '''
+    Loads libmf6 for a simulation
+    '''
+    try:
+        from modflowapi import ModflowApi
+    except ImportError:
+        raise Exception('xmi: modflowapi is required by the libmf6 backend, pip install modflowapi')
+    if not os.path.exists( lib_name ):
+        raise Exception('xmi: libmf6 not found at ' + str(lib_name) + ', define lib_name in config.')
+
+    return ModflowApi( lib_name, working_directory=simulation_folder )
+
+
+
+def reduced_nodes(mf6, model_name, nodes):
+    '''
+    Index of user nodes in the arrays of mf6, which exclude
+    inactive cells. Inactive nodes are -1
+    '''
+    try:
+        reduced = mf6.get_value( mf6.get_var_address( 'NODEREDUCED', model_name.upper(), 'DIS' ) )
+    except Exception:
+        reduced = np.zeros( 0 )
+    if len(reduced) < nodes:
+        return np.arange( nodes )
+    return np.where( reduced > 0, reduced - 1, -1 ).astype(int)
+
+
+
+def chd_flows(mf6, model_name, chd_names):
+    '''
+    Pointers to the flows of constant head cells, positive
+    into the model. None for packages not found
+    '''
+    pointers = []
+    for name in chd_names:
+        try:
+            pointers.append( mf6.get_value_ptr( mf6.get_var_address( 'SIMVALS', model_name.upper(), name.upper() ) ) )
+        except Exception:
+            pointers.append( None )
+    return pointers
+
+
+
+def continues(simulation_folder):
+    '''
+    Verifies if a simulation continues after a time step
+    fails to converge, option CONTINUE of mfsim.nam
+    '''
+    return any(
+            entry[0].upper() == 'CONTINUE'
+            for entry in inputs.block_entries( os.path.join( simulation_folder, 'mfsim.nam' ), 'options' )
+        )
+
+
+
+def run(simulation_folder, simulation_name, model_name, lib_name, outputs=False, cache_file=None, silent=False, **budgets):
+    '''
+    Executes a simulation through libmf6, in a fresh process
+    spawned for it, see solve. Parameters and return as solve
+    '''
+    with ProcessPoolExecutor( max_workers=1, mp_context=multiprocessing.get_context('spawn') ) as executor:
+        return executor.submit(
+                solve, simulation_folder, simulation_name, model_name, lib_name, 
+                outputs=outputs, cache_file=cache_file, silent=silent, **budgets
+            ).result()
+
+
+
+def solve(simulation_folder, simulation_name, model_name, lib_name, outputs=False, cache_file=None, silent=False, **budgets):
+    '''
+    Executes a simulation in-process, under the budgets of monitor.py.
+    A time step that does not converge fails the simulation, unless
+    it continues, see continues, or a failed_steps budget is given,
+    which then bounds those time steps
+
+    @params:
+        simulation_folder (str) : folder with mfsim.nam
+        simulation_name   (str) : name of the simulation
+        model_name        (str) : name of the gwf model
+        lib_name          (str) : libmf6 shared library
+        outputs           (bool): compute named outputs from memory, see adaptive.py
+        cache_file        (str) : intersections cache, see intersections.py
+        silent            (bool): do not print progress
+        budgets                 : wall_time, step_time, outer_iterations, failed_steps
+                                  budgets of None are not applied
+
+    @return:
+        tuple (success, reason, values), reason is empty on
+        success, values are named outputs if requested
+    '''
+    mf6 = load_library( lib_name, simulation_folder )
+
+    # Time steps not converged, allowed
+    tolerant = continues( simulation_folder ) or ( budgets.get('failed_steps') is not None )
+
+    reason  = ''
+    values  = {}
+    started = time.time()
+    outer   = 0
+    failed  = 0
+    try:
+        mf6.initialize()
+        max_iterations = int( mf6.get_value( mf6.get_var_address( 'MXITER', 'SLN_' + str(solution_id) ) )[0] )
+        heads          = mf6.get_value_ptr( mf6.get_var_address( 'X', model_name.upper() ) )
+
+        # Well columns and constant head flows, tracked from memory
+        if outputs:
+            modelgrid = inputs.modelgrid( simulation_folder, simulation_name, model_name )
+            ncpl      = modelgrid.ncpl
+            nodes     = reduced_nodes( mf6, model_name, modelgrid.nlay*ncpl )
+            columns   = {
+                    name: None if cell is None else nodes[ cell + ncpl*np.arange( modelgrid.nlay ) ]
+                    for name, cell in adaptive.well_cells( modelgrid, cache_file ).items()
+                }
+            chd_names = [
+                    entry[2] for entry in inputs.block_entries( inputs.model_file( simulation_folder, model_name ), 'packages' )
+                    if ( entry[0].upper() == 'CHD6' ) and ( len(entry) > 2 )
+                ]
+            flows     = chd_flows( mf6, model_name, chd_names )
+            reference = None
+            changes   = { name: [] for name in columns }
+            outflow   = 0.0
+
+        current = mf6.get_current_time()
+        end     = mf6.get_end_time()
+        while ( current < end ) and ( not reason ):
+            # Time step length is set by mf6 once prepared
+            mf6.prepare_time_step( mf6.get_time_step() )
+            dt           = mf6.get_time_step()
+            step_started = time.time()
+
+            # Outer iterations, budgets checked between them
+            mf6.prepare_solve( solution_id )
+            converged = False
+            kiter     = 0
+            while ( kiter < max_iterations ) and ( not converged ):
+                converged = mf6.solve( solution_id )
+                kiter    += 1
+                outer    += 1
+                reason    = monitor.exceeded( budgets, time.time() - started, time.time() - step_started, outer, failed )
+                if reason:
+                    break
+            mf6.finalize_solve( solution_id )
+            if not converged:
+                failed += 1
+                reason  = reason or monitor.exceeded( budgets, time.time() - started, 0, outer, failed )
+                if not ( reason or tolerant ):
+                    reason = 'not converged at time ' + str( mf6.get_current_time() )
+
+            mf6.finalize_time_step()
+            current = mf6.get_current_time()
+            if not silent:
+                print('xmi: time ' + str(current) + ', ' + str(kiter) + ' outer iterations' + ( '' if converged else ', not converged' ))
+
+            # Outputs of this time step. Reference heads are
+            # those of the last time step of reference_period
+            if outputs:
+                for pointer in flows:
+                    if pointer is not None:
+                        outflow -= dt*pointer[ pointer < 0 ].sum()
+                period = int( mf6.get_value( mf6.get_var_address( 'KPER', 'TDIS' ) )[0] ) - 1
+                if period <= adaptive.reference_period:
+                    reference = { name: None if c is None else heads[ c[c >= 0] ].copy() for name, c in columns.items() }
+                else:
+                    for name, c in columns.items():
+                        if c is not None:
+                            changes[name].append( reference[name] - heads[ c[c >= 0] ] )
+
+    except Exception as e:
+        # Input or solver errors of mf6, see the list file
+        reason = 'libmf6 error, ' + str(e)
+
+    finally:
+        try:
+            mf6.finalize()
+        except Exception:
+            pass
+
+    if reason:
+        return False, reason, values
+
+    if outputs:
+        for name in columns:
+            values['drawdown_' + name] = np.nan if columns[name] is None else adaptive.largest_change( changes[name] )
+        values['outlet_budget'] = outflow if any( p is not None for p in flows ) else np.nan
+
+    return True, '', values
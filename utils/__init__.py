@@ -1 +1 @@
-import scenarios
+from . import scenarios
@@ -1,20 +1,193 @@
 # python
 import os
+import json
 import numpy as np
 import pandas as pd
-from itertools import product
+
+
+# Lazy scenario spaces are saved at the
+# experiment csv folder instead of scenarios.csv
+scenarios_file = 'scenarios.csv'
+space_file     = 'scenarios.json'
+
+
+
+class Range:
+    '''
+    Continuous range of a parameter of a space filling design,
+    see sample. Ranges are explicit, a tuple is a fixed value
+    as anything else but lists
+
+    @params:
+        low  (float): lower bound
+        high (float): upper bound
+    '''
+
+    def __init__(self, low, high):
+        if not low < high:
+            raise Exception('scenarios.Range: low ' + str(low) + ' should be lower than high ' + str(high))
+        self.low  = low
+        self.high = high
+
+
+    def __repr__(self):
+        return 'Range(' + repr(self.low) + ', ' + repr(self.high) + ')'
+
+
+
+class ScenarioSpace:
+    '''
+    Full factorial scenario space, never materialized.
+
+    Scenarios are numbered as itertools.product would list them,
+    last parameter varying fastest, so any index is mapped to its
+    parameters by mixed-radix decoding, and any range of scenarios
+    is built on demand.
+
+    @params:
+        sim_base_name (str): base simulation name
+        **kwargs     (dict): dictionary of parameters (keys) and values.
+                             A list (or array) of values is enumerated,
+                             any other value is fixed, tuples too
+    '''
+
+    def __init__(self, sim_base_name, **kwargs):
+
+        if not kwargs:
+            raise Exception('scenarios.ScenarioSpace: no keyword arguments given.')
+
+        self.sim_base_name = sim_base_name
+        self.parameters    = {}
+        for variable, values in kwargs.items():
+            if isinstance(values, Range):
+                raise Exception('scenarios.ScenarioSpace: ' + variable + ' is a range, only space filling designs sample ranges')
+            if isinstance(values, tuple):
+                fixed    = np.empty(1, dtype=object)
+                fixed[0] = values
+                values   = fixed
+            elif not isinstance(values, (list, np.ndarray)):
+                values = [values]
+            if len(values) == 0:
+                raise Exception('scenarios.ScenarioSpace: no values given for ' + variable)
+            self.parameters[variable] = np.asarray(values)
+
+        self.radices = tuple( len(values) for values in self.parameters.values() )
+
+
+    def __len__(self):
+        return int( np.prod(self.radices, dtype=np.int64) )
+
+
+    def decode(self, indexes):
+        '''
+        Parameters values of scenarios
+
+        @params:
+            indexes (array like): scenario indexes
+
+        @return:
+            dict of numpy.ndarray by parameter name
+        '''
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if indexes.size and ( ( indexes.min() < 0 ) or ( indexes.max() >= len(self) ) ):
+            raise Exception('scenarios.ScenarioSpace: indexes out of range [0, ' + str(len(self)) + ')')
+        digits = np.unravel_index(indexes, self.radices)
+
+        return {
+                variable: values[digit]
+                for ( variable, values ), digit in zip( self.parameters.items(), digits )
+            }
+
+
+    def take(self, indexes):
+        '''
+        Scenarios given by their indexes
+
+        @return:
+            pandas.DataFrame() indexed by scenario index, with
+            columns simulation_name, model_name and parameters
+        '''
+        index    = pd.Index( np.asarray(indexes, dtype=np.int64) )
+        names    = self.sim_base_name + index.astype(str)
+        outputdf = pd.DataFrame(
+                {
+                    'simulation_name': names,
+                    'model_name'     : names + '_MODEL',
+                },
+                index=index,
+            )
+        for variable, values in self.decode(index.to_numpy()).items():
+            outputdf[variable] = values
+
+        return outputdf
+
+
+    def chunk(self, start=None, stop=None):
+        '''
+        Scenarios within [start, stop), as python slices
+        '''
+        return self.take( np.arange( *slice(start, stop).indices(len(self)) ) )
+
+
+    def range_chunk(self, start=None, stop=None):
+        '''
+        Scenarios within [start, stop), only if a range is given,
+        so the whole space is never built by mistake
+        '''
+        if ( start is None ) and ( stop is None ):
+            raise Exception(
+                'scenarios: lazy space of ' + str(len(self)) + ' scenarios, ' +
+                'give a range of scenarios with --start and --end'
+            )
+        return self.chunk(start, stop)
+
+
+    def chunks(self, chunk_size=100000, start=None, stop=None):
+        '''
+        Scenarios within [start, stop), by chunks of chunk_size
+        '''
+        start, stop, _ = slice(start, stop).indices(len(self))
+        for chunk_start in range(start, stop, chunk_size):
+            yield self.take( np.arange( chunk_start, min(chunk_start + chunk_size, stop) ) )
+
+
+    def save(self, file_path):
+        '''
+        Saves the space definition as json
+        '''
+        with open(file_path, 'w') as f:
+            json.dump(
+                {
+                    'sim_base_name': self.sim_base_name,
+                    'parameters'   : { k: v.tolist() for k, v in self.parameters.items() },
+                },
+                f,
+                indent=4,
+            )
+
+
+    @staticmethod
+    def load(file_path):
+        '''
+        Loads a space saved with save
+        '''
+        with open(file_path) as f:
+            definition = json.load(f)
+        return ScenarioSpace(definition['sim_base_name'], **definition['parameters'])
+
 
 
 def combine(sim_base_name, **kwargs):
     '''
 
-    Given a list of keyword arguments, which entries 
-    are parameter names to be modeled, the function 
+    Given a list of keyword arguments, which entries
+    are parameter names to be modeled, the function
     creates a list of scenarios mixing those parameters
-    
+
     @params:
         sim_base_name (str): base simulation name
-        **kwargs     (dict): dictionary of parameters (keys) and values
+        **kwargs     (dict): dictionary of parameters (keys) and values,
+                             as ScenarioSpace
 
     @return:
         pandas.DataFrame() with columns simulation_name, model_name and parameters
@@ -23,34 +196,243 @@ def combine(sim_base_name, **kwargs):
     if not kwargs:
         raise Exception('scenarios.combine: no keyword arguments given.')
 
-    # Count the number of scenarios
-    number_of_scenarios = 1
-    variables_values = []
-    for variable, values in kwargs.items():
-    
-        # If not list, transform and append
-        if not isinstance(values, (list, np.ndarray)):
-            variables_values.append([values])
-            continue
-        
-        # If list append
-        number_of_scenarios = number_of_scenarios*len(values)
-        variables_values.append(values)
-    
-    
-    df = pd.DataFrame.from_records(
-            list( i for i in product( *variables_values ) ),
-            columns=kwargs.keys()
-        )
-    
-    # Create simulation and model names columns and consolidate dataframe
-    id_array                    = df.index.to_numpy()
-    outputdf                    = pd.DataFrame()
-    outputdf['simulation_name'] = np.core.defchararray.add( np.repeat(sim_base_name, len(id_array)) , id_array.astype(str) )
-    outputdf['model_name']      = np.core.defchararray.add( outputdf['simulation_name'].to_numpy().astype(str), np.repeat('_MODEL', len(id_array)) )
-    outputdf                    = pd.concat([outputdf, df], axis=1)
+    return ScenarioSpace(sim_base_name, **kwargs).chunk()
+
+
+
+def load(csv_folder, start=None, end=None, whole=False):
+    '''
+    Loads scenarios of an experiment, from scenarios.csv or,
+    if not present, from the lazy space at scenarios.json
+
+    @params:
+        csv_folder (str) : experiment csv folder
+        start      (int) : first scenario position
+        end        (int) : last scenario position, not included
+        whole      (bool): all scenarios of scenarios.csv whatever the range,
+                           and none of a lazy space without a range
+
+    @return:
+        tuple (pandas.DataFrame of scenarios within [start, end), None if not built,
+               ScenarioSpace or None if loaded from scenarios.csv).
+        A lazy space requires start or end, unless whole, see range_chunk
+    '''
+    if os.path.exists( os.path.join(csv_folder, scenarios_file) ):
+        scenariosdf = pd.read_csv( os.path.join(csv_folder, scenarios_file), index_col=0 )
+        return ( scenariosdf if whole else scenariosdf.iloc[ start:end ] ), None
+
+    if os.path.exists( os.path.join(csv_folder, space_file) ):
+        space = ScenarioSpace.load( os.path.join(csv_folder, space_file) )
+        if whole and ( start is None ) and ( end is None ):
+            return None, space
+        return space.range_chunk(start, end), space
 
+    raise Exception('scenarios.load: neither ' + scenarios_file + ' nor ' + space_file + ' found at ' + csv_folder)
 
-    return outputdf
 
 
+##########################
+# Space filling designs #
+##########################
+
+# Sobol direction numbers (Joe and Kuo, new-joe-kuo-6.21201),
+# (s, a, m) for dimensions 2 onwards. First dimension is
+# the van der Corput sequence
+sobol_directions = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]),
+    (5, 14, [1, 3, 5, 5, 31]),
+    (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]),
+    (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]),
+    (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]),
+    (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+]
+sobol_bits = 30
+
+# Halton bases
+primes = [ 2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71 ]
+
+
+
+def latin_hypercube(n, d, rng):
+    '''
+    Latin hypercube sample, each dimension split into n
+    strata with one point each, randomly placed within it
+
+    @return:
+        numpy.ndarray of shape (n, d) within [0, 1)
+    '''
+    strata = np.argsort( rng.random((d, n)), axis=1 ).T
+    return ( strata + rng.random((n, d)) )/n
+
+
+
+def sobol_direction_numbers(d):
+    '''
+    Direction numbers of the first d Sobol dimensions,
+    as integers of sobol_bits bits
+
+    @return:
+        numpy.ndarray of shape (d, sobol_bits), dtype uint64
+    '''
+    if d > len(sobol_directions) + 1:
+        raise Exception('scenarios.sobol: at most ' + str(len(sobol_directions) + 1) + ' dimensions')
+
+    v = np.zeros( (d, sobol_bits), dtype=np.uint64 )
+    v[0] = [ 1 << ( sobol_bits - 1 - k ) for k in range(sobol_bits) ]
+    for j in range(1, d):
+        s, a, m = sobol_directions[j - 1]
+        for k in range(sobol_bits):
+            if k < s:
+                v[j, k] = m[k] << ( sobol_bits - 1 - k )
+                continue
+            value = int(v[j, k - s]) ^ ( int(v[j, k - s]) >> s )
+            for i in range(1, s):
+                if ( a >> ( s - 1 - i ) ) & 1:
+                    value ^= int(v[j, k - i])
+            v[j, k] = value
+
+    return v
+
+
+
+def sobol(n, d, rng, scramble=True):
+    '''
+    Sobol sample in Gray code order. Scrambled by a random
+    linear matrix scrambling and a digital shift. Balance
+    properties hold for n being a power of 2
+
+    @return:
+        numpy.ndarray of shape (n, d) within [0, 1)
+    '''
+    v = sobol_direction_numbers(d)
+
+    if scramble:
+        # Lower triangular matrices with unit diagonal
+        # acting on the bits, most significant first
+        scrambled = np.zeros_like(v)
+        for j in range(d):
+            lower = np.tril( rng.integers(0, 2, (sobol_bits, sobol_bits)), -1 ) + np.eye(sobol_bits, dtype=int)
+            bits  = ( v[j][:, np.newaxis] >> np.arange(sobol_bits - 1, -1, -1, dtype=np.uint64) ) & np.uint64(1)
+            bits  = ( bits.astype(int) @ lower.T ) % 2
+            scrambled[j] = ( bits.astype(np.uint64) << np.arange(sobol_bits - 1, -1, -1, dtype=np.uint64) ).sum(axis=1)
+        v = scrambled
+
+    # Points as XOR of direction numbers
+    # of the bits set in the Gray code
+    index = np.arange(n, dtype=np.uint64)
+    gray  = index ^ ( index >> np.uint64(1) )
+    x     = np.zeros( (n, d), dtype=np.uint64 )
+    for k in range( max( int(n - 1).bit_length(), 1 ) ):
+        bit = ( ( gray >> np.uint64(k) ) & np.uint64(1) ).astype(bool)
+        x[bit] ^= v[:, k]
+
+    if scramble:
+        x ^= rng.integers( 0, 1 << sobol_bits, d, dtype=np.uint64 )
+
+    return x/float( 1 << sobol_bits )
+
+
+
+def halton(n, d, rng, scramble=True):
+    '''
+    Halton sample, radical inverses of the point index in the
+    first d prime bases. Scrambled by a random permutation of
+    the digits of each base, keeping 0 in place
+
+    @return:
+        numpy.ndarray of shape (n, d) within [0, 1)
+    '''
+    if d > len(primes):
+        raise Exception('scenarios.halton: at most ' + str(len(primes)) + ' dimensions')
+
+    x = np.zeros( (n, d) )
+    for j, base in enumerate( primes[:d] ):
+        permutation = np.arange(base)
+        if scramble:
+            permutation[1:] = 1 + rng.permutation(base - 1)
+        index  = np.arange(n)
+        factor = 1/base
+        while index.any():
+            x[:, j] += permutation[ index % base ]*factor
+            index    = index//base
+            factor  /= base
+
+    return x
+
+
+
+# Available designs
+samplers = {
+        'lhs'   : lambda n, d, rng: latin_hypercube(n, d, rng),
+        'sobol' : lambda n, d, rng: sobol(n, d, rng),
+        'halton': lambda n, d, rng: halton(n, d, rng),
+    }
+
+
+
+def sample(sim_base_name, number_of_scenarios, method='lhs', seed=None, log_scale=(), **kwargs):
+    '''
+    Space filling design of scenarios. A unit sample is drawn
+    for the parameters to be varied and scaled to their ranges
+
+    @params:
+        sim_base_name       (str) : base simulation name
+        number_of_scenarios (int) : number of scenarios
+        method              (str) : 'lhs', 'sobol' or 'halton'
+        seed                (int) : random seed, for reproducible designs
+        log_scale          (list) : parameters sampled uniformly in log space
+        **kwargs           (dict) : parameters (keys) and values. A Range is
+                                    continuous, a list (or array) discrete values
+                                    sampled uniformly, any other value is fixed,
+                                    tuples too, as in ScenarioSpace
+
+    @return:
+        pandas.DataFrame() with columns simulation_name, model_name and parameters
+    '''
+
+    if not kwargs:
+        raise Exception('scenarios.sample: no keyword arguments given.')
+    if method not in samplers:
+        raise Exception('scenarios.sample: method ' + str(method) + ' not implemented, use one of ' + ', '.join(samplers))
+    for variable in log_scale:
+        if not isinstance(kwargs.get(variable), Range) or ( kwargs[variable].low <= 0 ):
+            raise Exception('scenarios.sample: log scaled ' + variable + ' requires a positive Range')
+
+    varied = [ v for v, values in kwargs.items() if isinstance(values, (Range, list, np.ndarray)) ]
+    rng    = np.random.default_rng(seed)
+    unit   = samplers[method]( number_of_scenarios, len(varied), rng )
+
+    df = pd.DataFrame( index=np.arange(number_of_scenarios) )
+    for variable, values in kwargs.items():
+        if variable not in varied:
+            df[variable] = pd.Series( [values]*number_of_scenarios, index=df.index, dtype=object if isinstance(values, tuple) else None )
+            continue
+        u = unit[:, varied.index(variable)]
+        if isinstance(values, Range):
+            low, high = values.low, values.high
+            if variable in log_scale:
+                df[variable] = 10**( np.log10(low) + u*( np.log10(high) - np.log10(low) ) )
+            else:
+                df[variable] = low + u*( high - low )
+        else:
+            values       = np.asarray(values)
+            df[variable] = values[ np.minimum( ( u*len(values) ).astype(int), len(values) - 1 ) ]
+
+    # Create simulation and model names columns and consolidate dataframe
+    names    = sim_base_name + df.index.astype(str)
+    outputdf = pd.DataFrame( { 'simulation_name': names, 'model_name': names + '_MODEL' }, index=df.index )
+
+    return pd.concat([outputdf, df], axis=1)